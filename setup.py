@@ -26,7 +26,7 @@ tests_require = [
 
 
 install_requires = [
-    'django>=1.2',
+    'django>=1.4,<1.5',
     'django-crispy-forms>=1.1.4',
     'django-gravatar',
     'psycopg2',
@@ -1,5 +1,5 @@
 from django.contrib import admin
-from zumanji.models import Project, Revision, Build
+from zumanji.models import Project, Revision, Build, ImportJob
 
 
 class ProjectAdmin(admin.ModelAdmin):
@@ -24,3 +24,11 @@ class BuildAdmin(admin.ModelAdmin):
     raw_id_fields = ('revision',)
 
 admin.site.register(Build, BuildAdmin)
+
+
+class ImportJobAdmin(admin.ModelAdmin):
+    list_display = ('id', 'project', 'status', 'build', 'date_created', 'date_finished')
+    list_filter = ('status', 'project')
+    raw_id_fields = ('build',)
+
+admin.site.register(ImportJob, ImportJobAdmin)
@@ -0,0 +1,117 @@
+"""
+Content-addressed storage of traces on disk.
+
+When ``ZUMANJI_CONFIG['BLOB_STORE']`` names a directory, encoded traces are
+written there rather than to the database, keyed by their sha1 (as
+``<root>/ab/cd/abcd...``), so a trace which is identical across builds is
+only ever stored once. Blobs are read back through a read-only memory map,
+so a trace is decoded straight from the page cache.
+"""
+__all__ = ('BlobStore', 'get_blob_store')
+
+import errno
+import hashlib
+import mmap
+import os
+import tempfile
+import time
+from django.conf import settings
+
+
+class BlobStore(object):
+    def __init__(self, root):
+        self.root = root
+
+    def get_path(self, checksum):
+        return os.path.join(self.root, checksum[:2], checksum[2:4], checksum)
+
+    def put(self, data):
+        """
+        Stores the blob (unless it already exists), returning its checksum.
+        """
+        checksum = hashlib.sha1(data).hexdigest()
+        path = self.get_path(checksum)
+        try:
+            # a blob which is used again is kept as long as one just written
+            # (see ``collect_garbage``)
+            os.utime(path, None)
+            return checksum
+        except OSError, e:
+            if e.errno != errno.ENOENT:
+                raise
+
+        dirname = os.path.dirname(path)
+        try:
+            os.makedirs(dirname)
+        except OSError, e:
+            if e.errno != errno.EEXIST:
+                raise
+
+        # written under a temporary name, so a blob is never seen half written
+        fd, tmp_path = tempfile.mkstemp(dir=dirname, prefix='.tmp-')
+        try:
+            with os.fdopen(fd, 'wb') as fp:
+                fp.write(data)
+            os.rename(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+        return checksum
+
+    def open(self, checksum):
+        """
+        Returns a read-only memory map of the blob.
+        """
+        with open(self.get_path(checksum), 'rb') as fp:
+            return mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def __iter__(self):
+        """
+        Yields the checksum of every stored blob.
+        """
+        for dirpath, dirnames, filenames in os.walk(self.root):
+            dirnames.sort()
+            for filename in sorted(filenames):
+                if not filename.startswith('.'):
+                    yield filename
+
+    def delete(self, checksum, older_than=None):
+        """
+        Removes the blob, unless it was modified after ``older_than`` (a
+        timestamp). Returns whether it was removed.
+        """
+        path = self.get_path(checksum)
+        try:
+            if older_than is not None and os.path.getmtime(path) > older_than:
+                return False
+            os.unlink(path)
+        except OSError, e:
+            if e.errno != errno.ENOENT:
+                raise
+            return False
+        return True
+
+    def collect_garbage(self, referenced, grace=3600):
+        """
+        Removes every blob which isn't in ``referenced``, other than those
+        written within the last ``grace`` seconds (whose rows may not have
+        been committed yet). Returns the number of blobs removed.
+        """
+        older_than = time.time() - grace
+        num_deleted = 0
+        for checksum in self:
+            if checksum not in referenced and self.delete(checksum, older_than):
+                num_deleted += 1
+        return num_deleted
+
+
+def get_blob_store():
+    """
+    Returns the configured ``BlobStore``, or None if traces are stored in
+    the database.
+    """
+    root = getattr(settings, 'ZUMANJI_CONFIG', {}).get('BLOB_STORE')
+    if not root:
+        return None
+    return BlobStore(root)
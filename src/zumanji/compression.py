@@ -0,0 +1,188 @@
+"""
+Pluggable compression of stored data.
+
+Every compressed value starts with a small header naming the codec which
+wrote it (and the dictionary it was compressed against, if any), so values
+stay readable whichever codec is configured later on. zlib is always
+available; lzma, zstd and lz4 are used when their modules are installed.
+
+Only zstd supports dictionaries. A dictionary is trained from samples of a
+project's traces, which repeat the same signatures and frames over and
+over, and lets even a short trace compress as well as a long one.
+"""
+__all__ = ('compress', 'decompress', 'get_codec', 'get_header', 'train_dictionary')
+
+import struct
+import zlib
+
+try:
+    import lzma
+except ImportError:
+    try:
+        from backports import lzma
+    except ImportError:
+        lzma = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import lz4.frame as lz4_frame
+except ImportError:
+    lz4_frame = None
+
+# codec tag, flags
+HEADER = struct.Struct('<BB')
+
+DICTIONARY_ID = struct.Struct('<I')
+
+# Flags
+HAS_DICTIONARY = 0x01
+
+# Size (in bytes) of trained dictionaries
+DICTIONARY_SIZE = 112 * 1024
+
+
+class Codec(object):
+    # Identifies the codec within the header; tags never end in 0x8, so a
+    # value can't be mistaken for a bare zlib stream (see ``GzippedJSONField``)
+    tag = None
+    name = None
+    supports_dictionaries = False
+
+    def compress(self, data, dictionary=None):
+        raise NotImplementedError
+
+    def decompress(self, data, dictionary=None):
+        raise NotImplementedError
+
+
+class ZlibCodec(Codec):
+    tag = 0x01
+    name = 'zlib'
+
+    def compress(self, data, dictionary=None):
+        return zlib.compress(data)
+
+    def decompress(self, data, dictionary=None):
+        return zlib.decompress(data)
+
+
+class LZMACodec(Codec):
+    tag = 0x02
+    name = 'lzma'
+
+    def compress(self, data, dictionary=None):
+        return lzma.compress(data, format=lzma.FORMAT_XZ)
+
+    def decompress(self, data, dictionary=None):
+        return lzma.decompress(data)
+
+
+class ZstdCodec(Codec):
+    tag = 0x03
+    name = 'zstd'
+    supports_dictionaries = True
+    level = 3
+
+    def get_dictionary(self, dictionary):
+        if dictionary is None:
+            return None
+        return zstandard.ZstdCompressionDict(dictionary)
+
+    def compress(self, data, dictionary=None):
+        return zstandard.ZstdCompressor(level=self.level,
+            dict_data=self.get_dictionary(dictionary)).compress(data)
+
+    def decompress(self, data, dictionary=None):
+        return zstandard.ZstdDecompressor(
+            dict_data=self.get_dictionary(dictionary)).decompress(data)
+
+
+class LZ4Codec(Codec):
+    tag = 0x04
+    name = 'lz4'
+
+    def compress(self, data, dictionary=None):
+        return lz4_frame.compress(data)
+
+    def decompress(self, data, dictionary=None):
+        return lz4_frame.decompress(data)
+
+
+CODECS = dict((c.name, c()) for c, module in (
+    (ZlibCodec, zlib),
+    (LZMACodec, lzma),
+    (ZstdCodec, zstandard),
+    (LZ4Codec, lz4_frame),
+) if module is not None)
+
+CODECS_BY_TAG = dict((c.tag, c) for c in CODECS.itervalues())
+
+
+def get_codec(name):
+    try:
+        return CODECS[name]
+    except KeyError:
+        raise ValueError('Unknown (or not installed) codec: %r' % name)
+
+
+def get_header(data, offset=0):
+    """
+    Returns a tuple of (codec, dictionary_id, offset) for a compressed
+    value starting at ``offset``, where the returned ``offset`` is where
+    the compressed data starts.
+    """
+    tag, flags = HEADER.unpack_from(data, offset)
+    try:
+        codec = CODECS_BY_TAG[tag]
+    except KeyError:
+        raise ValueError('Unknown (or not installed) codec: %r' % tag)
+
+    offset += HEADER.size
+    dictionary_id = None
+    if flags & HAS_DICTIONARY:
+        dictionary_id = DICTIONARY_ID.unpack_from(data, offset)[0]
+        offset += DICTIONARY_ID.size
+    return codec, dictionary_id, offset
+
+
+def compress(data, codec='zlib', dictionary=None):
+    """
+    Compresses ``data`` with the named codec. ``dictionary`` is an optional
+    tuple of (id, data), which is ignored unless the codec supports it.
+    """
+    codec = get_codec(codec)
+    if dictionary is None or not codec.supports_dictionaries:
+        return HEADER.pack(codec.tag, 0) + codec.compress(data)
+
+    dictionary_id, dictionary_data = dictionary
+    return (HEADER.pack(codec.tag, HAS_DICTIONARY) + DICTIONARY_ID.pack(dictionary_id)
+            + codec.compress(data, dictionary_data))
+
+
+def decompress(data, get_dictionary=None, offset=0):
+    """
+    Decompresses a value written by ``compress`` (starting at ``offset``
+    within ``data``, which may be any buffer). ``get_dictionary`` returns
+    the data of a dictionary given its id, and is required for values which
+    were compressed against one.
+    """
+    codec, dictionary_id, offset = get_header(data, offset)
+    if dictionary_id is None:
+        return codec.decompress(buffer(data, offset))
+
+    if get_dictionary is None:
+        raise ValueError('Data was compressed with dictionary %d' % dictionary_id)
+    return codec.decompress(buffer(data, offset), get_dictionary(dictionary_id))
+
+
+def train_dictionary(samples, size=DICTIONARY_SIZE):
+    """
+    Trains a zstd dictionary from the given (uncompressed) samples.
+    """
+    if zstandard is None:
+        raise ValueError('Training dictionaries requires the zstandard module')
+    return zstandard.train_dictionary(size, list(samples)).as_bytes()
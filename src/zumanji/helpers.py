@@ -1,14 +1,23 @@
-import difflib
-import itertools
+import dateutil.parser
 import re
 from collections import defaultdict
 from django.conf import settings
-from django.utils.datastructures import SortedDict
+from django.db.models import Count, Q, Sum
 from zumanji.github import github
-from zumanji.models import Revision, Test, TestData
+from zumanji.models import (BuildTag, CallModule, CallSignature, CallSite, Revision, StackFrame,
+    TestData, TestInterfaceStat, TestSeries)
+from zumanji.trace import Trace
+from zumanji.tracediff import (TRACE_DIFF_KEY, get_call_ids, get_opcodes, get_rows,
+    unpack_opcodes)
 
 HISTORICAL_POINTS = 25
 
+TOP_CALLSITES = 10
+
+TRACE_PAGE_SIZE = 200
+
+BUILD_PAGE_SIZE = 50
+
 REVISION_RE = re.compile(r'^[A-Za-z0-9]{40}$')
 
 
@@ -20,98 +29,155 @@ def is_github_revision(project, value):
     return is_revision(value) and '/' in project.label
 
 
-def get_trace_data(test, previous_test=None):
-    if previous_test:
-        try:
-            previous_trace = previous_test.testdata_set.get(key='trace').data
-        except TestData.DoesNotExist:
-            previous_trace = []
-    else:
-        previous_trace = []
+def get_trace(test):
+    try:
+        return test.testdata_set.get(key='trace').trace
+    except TestData.DoesNotExist:
+        return Trace.from_calls([])
 
+
+def get_stored_opcodes(test, previous_test):
+    """
+    Returns the diff stored by the importer between the traces of
+    ``previous_test`` and ``test`` as ``(opcodes, exact)``, or None if it
+    was made against another test (or an older import of this one).
+    """
     try:
-        trace = test.testdata_set.get(key='trace').data
+        data = test.testdata_set.get(key=TRACE_DIFF_KEY).data
     except TestData.DoesNotExist:
-        trace = []
+        return None
+    if data.get('test') != previous_test.id or data.get('checksum') != previous_test.checksum:
+        return None
+    return unpack_opcodes(data['opcodes']), data.get('exact', True)
+
+
+def get_trace_data(test, previous_test=None, offset=0, limit=TRACE_PAGE_SIZE):
+    """
+    Diffs the trace of ``test`` against that of ``previous_test``.
 
-    if not (trace or previous_trace):
+    Only the rows from ``offset`` up to ``limit`` are returned, and only the
+    calls shown in those rows are decoded.
+    """
+    traces = (
+        get_trace(previous_test) if previous_test else Trace.from_calls([]),
+        get_trace(test),
+    )
+    if not any(traces):
         return {}
 
-    previous_trace = SortedDict(('%s_%s' % (x, c['id']), c) for x, c in enumerate(previous_trace))
-    trace = SortedDict(('%s_%s' % (x, c['id']), c) for x, c in enumerate(trace))
+    if previous_test is None:
+        opcodes, exact = [('insert', 0, 0, 0, len(traces[1]))], True
+    else:
+        diff = get_stored_opcodes(test, previous_test)
+        if diff is None:
+            diff = get_opcodes(*get_call_ids(test.project, *traces))
+        opcodes, exact = diff
+
+    rows = get_rows(opcodes)
+    num_rows = len(rows)
+    if limit is None:
+        end = num_rows
+    else:
+        end = min(offset + limit, num_rows)
+    rows = rows[offset:end]
+
+    # the calls shown, by their index within each trace
+    shown = [dict((r[1 + n], trace[r[1 + n]]) for r in rows if r[1 + n] is not None)
+             for n, trace in enumerate(traces)]
+    CallSignature.expand_traces(test.project, *[c.values() for c in shown])
 
-    seqmatch = difflib.SequenceMatcher()
-    seqmatch.set_seqs(previous_trace.keys(), trace.keys())
+    def get_key(n, row):
+        # a row without a call on this side takes the key of the other side's
+        if row[1 + n] is None:
+            n = 1 - n
+        return '%s_%s' % (row[1 + n], shown[n][row[1 + n]]['id'])
 
     trace_diff = (
         {'test': previous_test, 'calls': []},  # left
-        {'test': test, 'calls': []},  # left
+        {'test': test, 'calls': []},  # right
     )
-    for tag, i1, i2, j1, j2 in seqmatch.get_opcodes():
-        if tag in ('equal', 'replace'):
-            for key in previous_trace.keys()[i1:i2]:
-                trace_diff[0]['calls'].append((tag, key, previous_trace[key]))
-            for key in trace.keys()[j1:j2]:
-                trace_diff[1]['calls'].append((tag, key, trace[key]))
-        elif tag == 'delete':
-            for key in previous_trace.keys()[i1:i2]:
-                trace_diff[0]['calls'].append((tag, key, previous_trace[key]))
-                trace_diff[1]['calls'].append((tag, key, None))
-        elif tag == 'insert':
-            for key in trace.keys()[j1:j2]:
-                trace_diff[0]['calls'].append((tag, key, None))
-                trace_diff[1]['calls'].append((tag, key, trace[key]))
-        else:
-            raise ValueError(tag)
-
-    all_calls = dict(previous_trace)
-    all_calls.update(trace)
+    all_calls = {}
+    for n, side in enumerate(trace_diff):
+        for row in rows:
+            call = shown[n].get(row[1 + n])
+            side['calls'].append((row[0], get_key(n, row), call))
+
+        side_calls = shown[n].values()
+        if side['test']:
+            StackFrame.expand_stacks(side['test'].build_id, side_calls)
+        all_calls.update((k, c) for _, k, c in side['calls'] if c is not None)
 
     return {
         'diff': trace_diff,
         'calls': all_calls,
-        'num_diffs': sum(sum(1 for t, _, c in n['calls'] if t != 'equal') for n in trace_diff),
+        'num_diffs': sum(i2 - i1 + j2 - j1 for tag, i1, i2, j1, j2 in opcodes if tag != 'equal'),
+        'num_rows': num_rows,
+        'exact': exact,
+        'offset': offset,
+        'next_offset': end if end < num_rows else None,
     }
 
 
 def get_historical_data(build, test_list):
-    previous_builds = []
-    cur_build = build
-    for point in xrange(HISTORICAL_POINTS):
-        prev_build = cur_build.get_previous_build()
-        if prev_build is None:
-            break
-        previous_builds.insert(0, prev_build.id)
-        cur_build = prev_build
-
-    previous_tests = list(Test.objects.filter(
-        build__in=previous_builds,
-        label__in=[t.label for t in test_list]
+    previous_builds = [b.id for b in reversed(build.get_previous_builds(HISTORICAL_POINTS))]
+
+    interfaces = [i for i, _ in settings.ZUMANJI_CONFIG['call_types']]
+
+    # {(label, build_id): {interface: mean_calls}}, for each build which ran the test
+    calls = dict(
+        ((s.label, s.build_id), s.calls)
+        for s in TestSeries.objects.filter(
+            project=build.project_id,
+            label__in=[t.label for t in test_list],
+            build__in=previous_builds + [build.id],
+        ).only('label', 'build', 'calls')
     )
-    .order_by('-build__datetime'))
-
-    historical = defaultdict(lambda: defaultdict(list))
-    for test in itertools.chain(previous_tests, test_list):
-        history_data = []
-        for interface, _ in settings.ZUMANJI_CONFIG['call_types']:
-            if interface not in test.data:
-                history_data.append(0)
-            else:
-                interface_calls = test.data[interface].get('mean_calls')
-                history_data.append(interface_calls)
-        historical[test.label][test.build_id] = history_data
+    for test in test_list:
+        calls.setdefault((test.label, test.build_id), {})
 
     padding = [(None, [])] * HISTORICAL_POINTS
     results = {}
     for test in test_list:
         results[test.id] = (padding + [
-            (b, historical[test.label][b])
+            (b, [calls[test.label, b].get(i, 0) for i in interfaces]
+                if (test.label, b) in calls else [])
             for b in (previous_builds + [test.build_id])
         ])[-HISTORICAL_POINTS:]
 
     return results
 
 
+def get_duration_change(current, previous):
+    """
+    Compares the mean durations of two results, returning None unless the
+    difference is larger than the uncertainty of both combined.
+
+    Results measured from a single run have no known uncertainty, so they
+    never differ significantly.
+    """
+    current_margin = current.margin_duration
+    previous_margin = previous.margin_duration
+    if not (current_margin or previous_margin):
+        return None
+
+    change = current.mean_duration - previous.mean_duration
+    margin = (current_margin ** 2 + previous_margin ** 2) ** 0.5
+    if abs(change) <= margin:
+        return None
+
+    return {
+        'current': current.mean_duration,
+        'current_interval': (current.mean_duration - current_margin,
+                             current.mean_duration + current_margin),
+        'previous': previous.mean_duration,
+        'previous_interval': (previous.mean_duration - previous_margin,
+                              previous.mean_duration + previous_margin),
+        'change': '%+.3f' % change,
+        'margin': margin,
+        'type': 'increase' if change > 0 else 'decrease',
+    }
+
+
 def get_changes(previous_build, objects):
     if not (previous_build and objects):
         return {}
@@ -121,6 +187,13 @@ def get_changes(previous_build, objects):
     ).select_related('parent')
 
     previous_build_objects = dict((o.label, o) for o in qs)
+    changed_calls = TestInterfaceStat.get_changed_calls(
+        project=previous_build.project_id,
+        build_ids=set(o.build_id for o in objects),
+        previous_build_id=previous_build.id,
+        labels=previous_build_objects.keys(),
+        interfaces=[i for i, _ in settings.ZUMANJI_CONFIG['call_types']],
+    )
     changes = dict()
 
     # {group: [{notes: notes, type: type}]}
@@ -128,26 +201,18 @@ def get_changes(previous_build, objects):
         last_obj = previous_build_objects.get(obj.label)
         obj_changes = {
             'interfaces': {},
+            'duration': None,
             'status': 'new' if last_obj is None else None,
         }
         if last_obj:
-            data = obj.data
-            last_obj_data = last_obj.data
-            for interface, _ in settings.ZUMANJI_CONFIG['call_types']:
-                if interface in data:
-                    current = data[interface].get('mean_calls', 0)
-                else:
-                    current = 0
+            obj_changes['duration'] = get_duration_change(obj, last_obj)
 
-                if interface in last_obj_data:
-                    previous = last_obj_data[interface].get('mean_calls', 0)
-                else:
-                    previous = 0
-
-                change = current - previous
-                if change == 0:
+            for interface, _ in settings.ZUMANJI_CONFIG['call_types']:
+                if (obj.label, interface) not in changed_calls:
                     continue
 
+                current, previous = changed_calls[(obj.label, interface)]
+                change = current - previous
                 obj_changes['interfaces'][interface] = {
                     'current': current,
                     'previous': previous,
@@ -155,7 +220,7 @@ def get_changes(previous_build, objects):
                     'type': 'increase' if change > 0 else 'decrease',
                 }
 
-        if obj_changes['status'] != 'new' and not obj_changes['interfaces']:
+        if obj_changes['status'] != 'new' and not (obj_changes['interfaces'] or obj_changes['duration']):
             continue
 
         changes[obj] = obj_changes
@@ -165,6 +230,51 @@ def get_changes(previous_build, objects):
         reverse=True)
 
 
+def get_top_callsites(build, test=None, limit=TOP_CALLSITES):
+    """
+    Returns the ``CallSite``s which made the most calls within a build, or
+    beneath one of its tests.
+    """
+    qs = CallSite.objects.filter(build=build)
+
+    if test is None:
+        qs = qs.filter(test__isnull=True)
+    elif not test.num_tests:
+        qs = qs.filter(test=test)
+    else:
+        # Branches are totalled from their leaves
+        rows = qs.filter(test__label__startswith=test.label + '.').values(
+            'interface', 'filename', 'function', 'lineno',
+        ).annotate(
+            calls=Sum('num_calls'),
+            duration=Sum('total_duration'),
+            tests=Count('test'),
+        ).order_by('-calls', '-duration')[:limit]
+
+        return [
+            CallSite(
+                project_id=build.project_id,
+                build_id=build.id,
+                interface=row['interface'],
+                filename=row['filename'],
+                function=row['function'],
+                lineno=row['lineno'],
+                num_calls=row['calls'],
+                total_duration=row['duration'],
+                num_tests=row['tests'],
+            ) for row in rows
+        ]
+
+    return list(qs.order_by('-num_calls', '-total_duration')[:limit])
+
+
+def get_top_modules(build, limit=TOP_CALLSITES):
+    """
+    Returns the ``CallModule``s which made the most calls within a build.
+    """
+    return list(CallModule.objects.filter(build=build).order_by('-num_calls', '-total_duration')[:limit])
+
+
 def get_git_changes(build, previous_build):
     # TODO: reenable this when it doesnt hit github on each request
     return None
@@ -184,3 +294,100 @@ def get_git_changes(build, previous_build):
         commits.append(revision)
 
     return reversed(commits)
+
+
+class BuildRow(object):
+    """
+    The columns of a build shown in a list of builds, fetched without
+    loading the build (or its revision) as a model.
+    """
+    __slots__ = ('id', 'datetime', 'num_tests', 'total_duration', 'revision_label',
+                 'revision_datetime', 'oneline', 'author_name', 'tags')
+
+    FIELDS = ('id', 'datetime', 'num_tests', 'total_duration', 'revision__label',
+              'revision__datetime', 'revision__subject', 'revision__author_name')
+
+    def __init__(self, values):
+        (self.id, self.datetime, self.num_tests, self.total_duration, self.revision_label,
+            self.revision_datetime, self.oneline, self.author_name) = values
+        # (id, label) of each tag
+        self.tags = []
+
+    @property
+    def cursor(self):
+        """
+        The cursor of the page which follows this row.
+        """
+        return format_build_cursor(self.revision_datetime, self.datetime, self.id)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'datetime': self.datetime.isoformat(),
+            'num_tests': self.num_tests,
+            'total_duration': self.total_duration,
+            'revision': self.revision_label,
+            'oneline': self.oneline,
+            'author': self.author_name,
+            'tags': [{'id': i, 'label': l} for i, l in self.tags],
+        }
+
+
+def format_build_cursor(revision_datetime, datetime, build_id):
+    return '%s,%s,%d' % (revision_datetime.isoformat() if revision_datetime else '',
+                         datetime.isoformat(), build_id)
+
+
+def parse_build_cursor(value):
+    """
+    Returns the (revision_datetime, datetime, id) of a cursor written by
+    ``format_build_cursor``, raising ValueError if it isn't one.
+    """
+    try:
+        revision_datetime, datetime, build_id = value.split(',')
+        return (dateutil.parser.parse(revision_datetime) if revision_datetime else None,
+                dateutil.parser.parse(datetime), int(build_id))
+    except (AttributeError, TypeError, ValueError, OverflowError):
+        raise ValueError('Invalid cursor: %r' % (value,))
+
+
+def get_build_page(queryset, cursor=None, limit=BUILD_PAGE_SIZE):
+    """
+    Returns a list of up to ``limit`` ``BuildRow`` from ``queryset`` which
+    follow ``cursor`` (see ``parse_build_cursor``), latest revision first,
+    along with the cursor of the next page (or None if there isn't one).
+
+    Pages are fetched by key rather than by offset, so any page costs the
+    same. Builds of revisions without a commit date come last.
+    """
+    values = []
+    if cursor is None or cursor[0] is not None:
+        dated = queryset.filter(revision__datetime__isnull=False)
+        if cursor is not None:
+            revision_datetime, datetime, build_id = cursor
+            dated = dated.filter(
+                Q(revision__datetime__lt=revision_datetime)
+                | Q(revision__datetime=revision_datetime, datetime__lt=datetime)
+                | Q(revision__datetime=revision_datetime, datetime=datetime, id__lt=build_id))
+            # the undated builds all follow
+            cursor = None
+        values.extend(dated.order_by('-revision__datetime', '-datetime', '-id').values_list(
+            *BuildRow.FIELDS)[:limit + 1])
+
+    if len(values) <= limit:
+        undated = queryset.filter(revision__datetime__isnull=True)
+        if cursor is not None:
+            _, datetime, build_id = cursor
+            undated = undated.filter(Q(datetime__lt=datetime) | Q(datetime=datetime, id__lt=build_id))
+        values.extend(undated.order_by('-datetime', '-id').values_list(
+            *BuildRow.FIELDS)[:limit + 1 - len(values)])
+
+    rows = [BuildRow(v) for v in values[:limit]]
+    rows_by_id = dict((r.id, r) for r in rows)
+    for build_id, tag_id, label in BuildTag.builds.through.objects.filter(
+            build__in=rows_by_id.keys()).order_by('buildtag__label').values_list(
+            'build', 'buildtag', 'buildtag__label'):
+        rows_by_id[build_id].tags.append((tag_id, label))
+
+    next_cursor = rows[-1].cursor if len(values) > limit else None
+    return rows, next_cursor
@@ -1,49 +1,66 @@
-__all__ = ('import_build',)
+__all__ = ('import_build', 'import_build_file', 'BuildImporter')
 
 import datetime
 import hashlib
+import logging
 from collections import defaultdict
-from zumanji.models import Project, Revision, Build, BuildTag, Test
+from django.conf import settings
+from django.db import transaction, IntegrityError
+from django.db.models import Count, Sum
+from django.utils import simplejson
+from zumanji.blobstore import get_blob_store
+from zumanji.interfaces import get_interface
+from zumanji.lineage import lock_project, place_build
+from zumanji.models import (Project, Revision, Build, BuildLineage, BuildTag, CallModule,
+    CallSignature, CallSite, CompressionDictionary, ProjectSummary, StackFrame, Test, TestData,
+    TestInterfaceStat, TestSeries)
+from zumanji.stats import LeafTable, RunningStats
+from zumanji.stream import checksum_payload
+from zumanji.trace import encode_trace
+from zumanji.tracediff import TRACE_DIFF_KEY, get_call_ids, get_opcodes, pack_opcodes
 
+# Number of rows written per INSERT (and looked up per SELECT when resolving ids)
+BATCH_SIZE = 500
 
-def convert_timestamp(timestamp):
-    return datetime.datetime.strptime(timestamp, '%Y-%m-%dT%H:%M:%S.%f')
+# Upper bound on the number of calls held in memory for a single INSERT of traces
+TRACE_BATCH_CALLS = 10000
 
+# Upper bound on the number of calls kept from building a tree until its traces are
+# written (the traces of any further tests are formatted again)
+KEPT_TRACE_CALLS = 100000
 
-def count_leaves_with_tests(labels):
-    # test.label: set(leaves)
-    leaves = defaultdict(set)
-    for label in labels:
-        leaves[label].add(label)
-        parent = label.rsplit('.', 1)[0]
-        leaves[parent].add(label)
-        while len(leaves[parent]) > 1 and '.' in parent:
-            parent = parent.rsplit('.', 1)[0]
-            leaves[parent].add(parent)
+# Attempts made to import a payload when a concurrent import creates the same rows
+MAX_ATTEMPTS = 3
 
-    return dict((k, len(v)) for k, v in leaves.iteritems())
+logger = logging.getLogger('zumanji.importer')
 
 
-def regroup_tests(tests):
-    grouped = defaultdict(list)
+def convert_timestamp(timestamp):
+    return datetime.datetime.strptime(timestamp, '%Y-%m-%dT%H:%M:%S.%f')
 
-    for test in tests:
-        key = []
-        for part in test['id'].split('.')[:-1]:
-            key.append(part)
-            grouped['.'.join(key)].append(test)
 
-    return sorted(grouped.items(), key=lambda x: x[0])
+def hash_parts(*parts):
+    result = hashlib.md5()
+    for part in parts:
+        if isinstance(part, unicode):
+            part = part.encode('utf-8')
+        result.update(part or '')
+    return result.hexdigest()
 
 
 def with_call_id(data):
-    call_id = hashlib.md5(data['interface'])
-    call_id.update(data['command'])
-    call_id.update(data.get('filename') or '')
-    call_id.update(data.get('function') or '')
-    call_id = call_id.hexdigest()
+    """
+    Identifies the call by its fingerprint (its normalized command), so that
+    calls which only differ by their values share an id. The signature id,
+    ``sig``, identifies its exact command.
+    """
+    fingerprint = get_interface(data['interface']).fingerprint(data['command'], data['args'])
 
-    data['id'] = call_id
+    data['fingerprint'] = fingerprint
+    data['id'] = hash_parts(data['interface'], fingerprint,
+        data.get('filename'), data.get('function'))
+    data['sig'] = hash_parts(data['interface'], data['command'],
+        data.get('filename'), data.get('function'))
     return data
 
 
@@ -108,11 +125,64 @@ def format_v1_data(item):
     })
 
 
-def percentile(values, percentile=90):
-    return values[int(len(values) * (percentile / 100.0))]
+def checksum_data(data):
+    return hashlib.sha1(simplejson.dumps(data, sort_keys=True)).hexdigest()
+
+
+def get_callsites(calls):
+    """
+    Returns a mapping of (interface, filename, function, lineno) to
+    [num_calls, total_duration] for the given calls.
+    """
+    callsites = {}
+    for call in calls:
+        key = (call['interface'], call.get('filename'), call.get('function'), call.get('lineno'))
+        callsite = callsites.get(key)
+        if callsite is None:
+            callsite = callsites[key] = [0, 0.0]
+        callsite[0] += 1
+        callsite[1] += call['duration']
+    return callsites
+
+
+def get_trace_codec():
+    """
+    Returns the codec traces are compressed with, which can be set with
+    ``ZUMANJI_CONFIG['TRACE_CODEC']``.
+    """
+    return getattr(settings, 'ZUMANJI_CONFIG', {}).get('TRACE_CODEC', 'zlib')
+
 
+def chunked(iterable, size):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
 
-def create_test_leaf(build, data, parent, version=1):
+
+def get_samples(data):
+    """
+    Returns the durations of each run of a test; ``duration`` is either a
+    single duration, or a list of them.
+    """
+    samples = RunningStats()
+    durations = data['duration']
+    if not isinstance(durations, (list, tuple)):
+        durations = [durations]
+    for duration in durations:
+        samples.add(float(duration))
+    return samples
+
+
+def format_test_leaf(data, version=1):
+    """
+    Returns a tuple of (attributes, trace) for the given leaf, where
+    attributes are the values for its ``Test`` row.
+    """
     if version == 1:
         format_data = format_v1_data
 
@@ -144,154 +214,824 @@ def create_test_leaf(build, data, parent, version=1):
         extra_data[item['interface']]['mean_calls'] += 1
         extra_data[item['interface']]['mean_duration'] += item['duration']
 
-    test = Test.objects.create(
-        build=build,
-        project=build.project,
-        revision=build.revision,
-        label=data['id'],
-        description=description,
-        mean_duration=data['duration'],
-        upper90_duration=data['duration'],
-        upper_duration=data['duration'],
-        lower_duration=data['duration'],
-        data=extra_data,
-        parent=parent,
-    )
-
-    test.testdata_set.create(
-        build=test.build,
-        revision=test.revision,
-        project=test.project,
-        key='trace',
-        data=interface_data,
-    )
-
-    return test
+    attrs = get_samples(data).get_attrs()
+    attrs.update({
+        'description': description,
+        'data': dict(extra_data),
+    })
+
+    return attrs, interface_data
 
 
-def import_build(data, project=None, revision=None):
-    version = int(data.get('version', 1))
-    timestamp = convert_timestamp(data['time'])
-
-    project_label = project or data.get('project')
-    if not project_label:
-        raise ValueError('You must specify a project')
-
-    revision_label = revision or data.get('revision')
-    if not revision_label:
-        raise ValueError('You must specify a revision')
-
-    # We avoid recreating the core items that might get referenced by an ID in the interface
-    project = Project.objects.get_or_create(
-        label=project_label,
-    )[0]
-
-    revision = Revision.get_or_create(
-        project=project,
-        label=revision_label,
-    )[0]
-
-    build, created = Build.objects.get_or_create(
-        project=project,
-        revision=revision,
-        datetime=timestamp,
-    )
-
-    # Clean out old tests
-    build.test_set.all().delete()
-
-    # Clean out old tags
-    build.tags.all().delete()
-    # Add tags
-    tag_list = [
-        BuildTag.objects.get_or_create(label=tag_name)[0]
-        for tag_name in data.get('tags', [])
-    ]
-    build.tags.add(*tag_list)
-
-    num_tests = 0
-    total_duration = 0.0
-    tests_by_id = {}
-    grouped_tests = regroup_tests(data['tests'])
-
-    # Eliminate useless parents (parents which only have a single child)
-    leaf_counts = count_leaves_with_tests((t['id'] for t in data['tests']))
-
-    def find_parent(label):
-        if '.' not in label:
-            return None
-
-        key = label.split('.')[:-1]
-        while key:
-            path = '.'.join(key)
-            if path in tests_by_id:
-                return tests_by_id[path]
-            key.pop()
-        return None
+class TestNode(object):
+    """
+    An in-memory representation of a ``Test`` row which has not yet been
+    written.
+
+    ``depth`` is only known once the node's parent has been assigned, and
+    ``trace`` is the formatted trace of a leaf, if it was kept.
+    """
+    __slots__ = ('label', 'parent', 'attrs', 'is_leaf', 'depth', 'id',
+                 'trace_checksum', 'trace', 'dirty')
+
+    def __init__(self, label, parent=None, attrs=None, is_leaf=False, trace_checksum=None,
+                 trace=None):
+        self.label = label
+        self.parent = parent
+        self.attrs = attrs or {}
+        self.is_leaf = is_leaf
+        self.trace_checksum = trace_checksum
+        self.trace = trace
+        self.depth = parent.depth + 1 if parent else None
+        self.id = None
+        # whether the row was written by this import (as opposed to left as-is)
+        self.dirty = False
+
+    @property
+    def checksum(self):
+        return checksum_data([
+            self.label,
+            self.parent.label if self.parent else None,
+            self.attrs,
+            self.trace_checksum,
+        ])
+
+
+class LabelTrie(object):
+    """
+    A prefix tree of test labels, with a node for each dotted component.
+
+    ``leaf`` is the (attrs, trace_checksum, trace) of the test whose label
+    ends at a node, if any.
+    """
+    __slots__ = ('label', 'children', 'leaf')
+
+    def __init__(self, label=None):
+        self.label = label
+        self.children = {}
+        self.leaf = None
+
+    def add(self, label, leaf):
+        parts = label.split('.')
+        node = self
+        for depth, part in enumerate(parts):
+            child = node.children.get(part)
+            if child is None:
+                # labels are only built for nodes the first time they're seen
+                child = node.children[part] = LabelTrie('.'.join(parts[:depth + 1]))
+            node = child
+        node.leaf = leaf
+
+    def get_nodes(self):
+        """
+        Returns a tuple of (nodes, leaves, ranges) in a single walk of the
+        tree, where:
+
+        - ``nodes`` are the ``TestNode``s worth keeping, ordered so that
+          every parent precedes its children;
+        - ``leaves`` are the leaf nodes, such that the leaves beneath any
+          branch are contiguous;
+        - ``ranges`` are the (branch, start, end) of each branch's leaves.
+
+        A branch is only kept if it directly contains a test, is a test
+        itself, or has a child which is itself kept along with at least one
+        other entry; the rest of a chain of single children is collapsed
+        into its nearest kept ancestor. A test whose label is also a branch
+        is only kept as the branch, and tests without a parent are dropped.
+        """
+        nodes, leaves, ranges = [], [], []
+
+        def visit(trie):
+            # Returns the number of entries within this branch (the tests directly
+            # within it, plus one for itself if it is a test or any of its children
+            # have more than one), and the nodes beneath it yet to have a parent
+            start = len(leaves)
+            num_tests = 0
+            is_entry = trie.leaf is not None
+            orphans = []
+            for part in sorted(trie.children):
+                child = trie.children[part]
+                if child.leaf is not None:
+                    num_tests += 1
+
+                if child.children:
+                    child_entries, child_orphans = visit(child)
+                    orphans.extend(child_orphans)
+                    is_entry = is_entry or child_entries > 1
+                else:
+                    attrs, trace_checksum, trace = child.leaf
+                    node = TestNode(child.label, attrs=attrs, is_leaf=True,
+                        trace_checksum=trace_checksum, trace=trace)
+                    nodes.append(node)
+                    leaves.append(node)
+                    orphans.append(node)
+
+            num_entries = num_tests + is_entry
+            if not num_entries:
+                # nothing here is worth a branch of its own
+                return num_entries, orphans
+
+            branch = TestNode(trie.label)
+            for node in orphans:
+                node.parent = branch
+            nodes.append(branch)
+            ranges.append((branch, start, len(leaves)))
+            return num_entries, [branch]
+
+        for part in sorted(self.children):
+            child = self.children[part]
+            # tests without a parent are never kept
+            if child.children:
+                visit(child)
+
+        # Children were visited (and so listed) before their parents
+        nodes.reverse()
+        for node in nodes:
+            node.depth = node.parent.depth + 1 if node.parent else 0
 
-    grouped_tests = [(l, t) for l, t in grouped_tests if leaf_counts.get(l) >= 1]
+        return nodes, leaves, ranges
 
-    # Create branches
-    for label, _ in grouped_tests:
-        parent = find_parent(label)
 
-        branch = Test.objects.create(
-            parent=parent,
-            project=project,
-            revision=revision,
-            build=build,
-            label=label,
+class BuildImporter(object):
+    """
+    Imports a build by assembling the entire test tree (including the
+    rollups for each branch) in memory, and then writing ``Test`` and
+    ``TestData`` rows using batched bulk inserts.
+
+    Parents are written before their children, one level of the tree at a
+    time, so that each level can reference the ids of the level above it.
+
+    Importing a build which already exists is a no-op if the payload has not
+    changed. Otherwise, only the rows whose contents differ from what is
+    already stored (according to their checksums) are written or removed.
+
+    ``data['tests']`` is iterated twice: once to build the tree, and once
+    more to write each leaf's trace. Only the summary of each leaf is kept
+    between the two, so it may be any re-iterable (such as a ``TestStream``)
+    rather than a list.
+
+    A test may have been run several times, either within the payload
+    (as a list of durations, or by being listed more than once) or by
+    uploading more builds of the same revision and tags. The runs are
+    combined into a running mean and variance for each leaf.
+
+    The number of rows (and batches) written in each phase is available in
+    ``counts`` once the import has run.
+    """
+    def __init__(self, data, project=None, revision=None, batch_size=BATCH_SIZE):
+        self.data = data
+        self.version = int(data.get('version', 1))
+        self.timestamp = convert_timestamp(data['time'])
+
+        self.project_label = project or data.get('project')
+        if not self.project_label:
+            raise ValueError('You must specify a project')
+
+        self.revision_label = revision or data.get('revision')
+        if not self.revision_label:
+            raise ValueError('You must specify a revision')
+
+        self.batch_size = batch_size
+        self.counts = defaultdict(int)
+
+        # Streamed payloads are hashed as they're read
+        self.checksum = getattr(data, 'checksum', None) or checksum_payload(data)
+
+    def resolve_references(self):
+        """
+        Gets or creates the rows which are shared with other builds (the
+        project, revision and tags).
+        """
+        # We avoid recreating the core items that might get referenced by an ID in the interface
+        self.project = Project.objects.get_or_create(
+            label=self.project_label,
+        )[0]
+
+        self.revision = Revision.get_or_create(
+            project=self.project,
+            label=self.revision_label,
+        )[0]
+
+        self.tags = [
+            BuildTag.objects.get_or_create(label=tag_name)[0]
+            for tag_name in self.data.get('tags', [])
+        ]
+
+    def run(self):
+        if not hasattr(self, 'revision'):
+            self.resolve_references()
+
+        build, created = Build.objects.get_or_create(
+            project=self.project,
+            revision=self.revision,
+            datetime=self.timestamp,
+        )
+        self.build = build
+        # the leaves whose trace has to be diffed once the build is placed
+        self.traces = []
+
+        if not created and build.checksum == self.checksum:
+            logger.info('Build %s is unchanged, skipping import', build.id)
+            self.counts['unchanged'] += build.num_tests
+            self.unchanged = True
+            return build
+        self.unchanged = False
+
+        # Replace old tags (which may still be in use by other builds)
+        build.tags.clear()
+        build.tags.add(*self.tags)
+
+        nodes = self.build_tree(self.data['tests'])
+
+        existing = self.get_existing_tests(build)
+        self.write_tests(build, nodes, existing)
+        self.write_interface_stats(build, nodes)
+        self.write_series(build, nodes)
+        self.write_test_data(build, nodes, self.data['tests'])
+        self.traces = [(n.id, n.label) for n in nodes if n.is_leaf and n.dirty]
+        # Anything we didn't see in this payload is no longer part of the build
+        self.delete_tests(existing.values())
+        self.write_callsite_rollups(build)
+
+        leaves = [n for n in nodes if n.is_leaf]
+        num_tests = len(leaves)
+        total_duration = sum(n.attrs['mean_duration'] for n in leaves)
+
+        Build.objects.filter(id=build.id).update(
+            num_tests=num_tests,
+            total_duration=total_duration,
+            checksum=self.checksum,
         )
-        tests_by_id[branch.label] = branch
+        build.num_tests = num_tests
+        build.total_duration = total_duration
+        build.checksum = self.checksum
+
+        logger.info('Imported build %s (%s)', build.id,
+            ', '.join('%s=%s' % i for i in sorted(self.counts.iteritems())))
+
+        return build
+
+    def place(self):
+        """
+        Puts the build on its lineage, unless it already is, and diffs the
+        traces which now follow another run of their test.
+
+        Runs once the import has been committed, so only ever sees builds
+        which are complete; the project is locked until the end of the
+        transaction (see ``zumanji.lineage``).
+        """
+        build = self.build
+
+        lock_project(self.project)
+        build.parent_build_id, build.position = Build.objects.filter(id=build.id).values_list(
+            'parent_build', 'position')[0]
+        if build.position is None:
+            placed = place_build(self.project, build)
+        else:
+            placed = []
+        self.counts['lineage'] += len(placed)
+
+        # the previous run of every test of these builds may have changed
+        for placed_build in Build.objects.filter(id__in=placed):
+            TestData.objects.filter(build=placed_build, key=TRACE_DIFF_KEY).delete()
+            self.write_trace_diffs(placed_build, TestData.objects.filter(
+                build=placed_build, key='trace').values_list('test', 'test__label'))
+        if build.id not in placed:
+            self.write_trace_diffs(build, self.traces)
+
+        if self.unchanged:
+            return build
+
+        # the pages of this build, and of every build whose history includes it
+        Build.touch([build.id] + list(BuildLineage.objects.filter(ancestor=build).values_list(
+            'build', flat=True)))
+
+        ProjectSummary.update(self.project, date_imported=datetime.datetime.now())
+
+        return build
 
-    for label, tests in reversed(grouped_tests):
-        branch = tests_by_id[label]
+    def build_tree(self, tests):
+        """
+        Returns a list of ``TestNode``s, ordered so that every parent
+        precedes its children.
 
-        # Create any leaves which do not exist yet
-        for test_data in (t for t in tests if t['id'] not in tests_by_id):
-            test = create_test_leaf(build, test_data, branch, version)
-            tests_by_id[test.label] = test
+        The formatted traces of leaves are kept for ``write_test_data`` until
+        they total ``KEPT_TRACE_CALLS`` calls.
+        """
+        trie = LabelTrie()
+        leaf_attrs = []
+        samples = {}
+        kept_calls = 0
+        for test_data in tests:
+            attrs, trace = format_test_leaf(test_data, self.version)
+            label = test_data['id']
+            # Repeated runs of a test are merged into one leaf (which keeps the first trace)
+            if label in samples:
+                samples[label].merge(RunningStats.from_attrs(attrs))
+                continue
+            samples[label] = RunningStats.from_attrs(attrs)
+            leaf_attrs.append((label, attrs))
+            trace_checksum = checksum_data(trace)
+            if kept_calls + len(trace) <= KEPT_TRACE_CALLS:
+                kept_calls += len(trace)
+            else:
+                trace = None
+            trie.add(label, (attrs, trace_checksum, trace))
 
-            num_tests += 1
-            total_duration += test.mean_duration
+        # Each upload of a revision adds its runs to those of the last one
+        previous_samples = self.get_previous_samples(self.build)
+        for label, attrs in leaf_attrs:
+            if label in previous_samples:
+                samples[label].merge(previous_samples[label])
+            attrs.update(samples[label].get_attrs())
+
+        nodes, leaves, ranges = trie.get_nodes()
 
         # Update aggregated data
-        group_durations = []
-        interface_durations = defaultdict(list)
-
-        for test in (tests_by_id[t['id']] for t in tests):
-            group_durations.append(test.mean_duration)
-            for interface, values in test.data.iteritems():
-                interface_durations[interface].append(values)
-
-        group_num_tests = len(group_durations)
-        group_total_duration = sum(group_durations)
-        group_durations.sort()
-
-        td_data = {}
-        for interface, values in interface_durations.iteritems():
-            durations = [v['mean_duration'] for v in values]
-            td_data[interface] = {
-                'mean_calls': sum(v['mean_calls'] for v in values),
-                'mean_duration': sum(durations),
-                'upper_duration': durations[-1],
-                'lower_duration': durations[0],
-                'upper90_duration': percentile(durations, 90),
-            }
-
-        tests_by_id[branch.label] = Test.objects.filter(id=branch.id).update(
-            label=label,
-            num_tests=group_num_tests,
-            mean_duration=group_total_duration,
-            upper_duration=group_durations[-1],
-            lower_duration=group_durations[0],
-            upper90_duration=percentile(group_durations, 90),
-            data=td_data,
+        rollups = LeafTable(((l.label, l.attrs) for l in leaves), ordered=True).rollup_ranges(
+            [(branch.label, start, end) for branch, start, end in ranges])
+        for branch, _, _ in ranges:
+            branch.attrs = rollups[branch.label]
+
+        self.counts['branches'] += len(ranges)
+        self.counts['leaves'] += len(leaves)
+
+        return nodes
+
+    def get_previous_build(self, build):
+        """
+        Returns the latest earlier build of the same revision which has the
+        same tags as this one.
+        """
+        tag_ids = set(t.id for t in self.tags)
+        builds = Build.objects.filter(
+            project=build.project_id,
+            revision=build.revision_id,
+            datetime__lt=build.datetime,
+        ).order_by('-datetime')
+        for previous_build in builds:
+            if set(previous_build.tags.values_list('id', flat=True)) == tag_ids:
+                return previous_build
+        return None
+
+    def get_previous_samples(self, build):
+        """
+        Returns a mapping of label to ``RunningStats`` for each leaf of the
+        previous build of this revision.
+        """
+        previous_build = self.get_previous_build(build)
+        if previous_build is None:
+            return {}
+
+        fields = ('num_samples', 'mean_duration', 'stddev_duration', 'lower_duration', 'upper_duration')
+        return dict(
+            (values[0], RunningStats.from_attrs(dict(zip(fields, values[1:]))))
+            for values in previous_build.test_set.filter(num_tests=0).values_list('label', *fields)
+        )
+
+    def get_existing_tests(self, build):
+        """
+        Returns a mapping of label to (id, checksum) for each test already
+        stored for this build.
+        """
+        return dict(
+            (label, (test_id, checksum))
+            for label, test_id, checksum in build.test_set.values_list('label', 'id', 'checksum')
         )
 
-    Build.objects.filter(id=build.id).update(
-        num_tests=num_tests,
-        total_duration=total_duration,
-    )
+    def write_tests(self, build, nodes, existing):
+        """
+        Writes each node which differs from what is in ``existing``, removing
+        each node seen from ``existing`` as it goes.
+        """
+        levels = defaultdict(list)
+        for node in nodes:
+            levels[node.depth].append(node)
+
+        for depth in sorted(levels):
+            for chunk in chunked(levels[depth], self.batch_size):
+                new_nodes = []
+                changed = []
+                for node in chunk:
+                    checksum = node.checksum
+                    try:
+                        node.id, current_checksum = existing.pop(node.label)
+                    except KeyError:
+                        new_nodes.append(node)
+                        continue
+
+                    if current_checksum == checksum:
+                        self.counts['unchanged'] += 1
+                        continue
+
+                    Test.objects.filter(id=node.id).update(
+                        parent=node.parent.id if node.parent else None,
+                        checksum=checksum,
+                        **node.attrs
+                    )
+                    node.dirty = True
+                    changed.append(node.id)
+                    self.counts['updated'] += 1
+
+                # The traces of changed leaves are rewritten along with new ones, and
+                # a leaf which has become a branch no longer has any
+                if changed:
+                    TestData.objects.filter(test__in=changed).delete()
+                    CallSite.objects.filter(test__in=changed).delete()
+
+                if not new_nodes:
+                    continue
+
+                Test.objects.bulk_create([
+                    Test(
+                        project_id=build.project_id,
+                        revision_id=build.revision_id,
+                        build_id=build.id,
+                        parent_id=node.parent.id if node.parent else None,
+                        label=node.label,
+                        checksum=node.checksum,
+                        **node.attrs
+                    ) for node in new_nodes
+                ])
+                self.counts['tests'] += len(new_nodes)
+                self.counts['batches'] += 1
+
+                # Resolve the ids for this chunk so the next level can reference them
+                nodes_by_label = dict((n.label, n) for n in new_nodes)
+                for label, test_id in Test.objects.filter(
+                        build=build, label__in=nodes_by_label.keys()).values_list('label', 'id'):
+                    nodes_by_label[label].id = test_id
+                    nodes_by_label[label].dirty = True
+
+            self.counts['levels'] += 1
+
+    def write_interface_stats(self, build, nodes):
+        """
+        Replaces the per-interface stats of every node written by this
+        import.
+        """
+        for chunk in chunked((n for n in nodes if n.dirty), self.batch_size):
+            TestInterfaceStat.objects.filter(test__in=[n.id for n in chunk]).delete()
+
+            rows = [
+                TestInterfaceStat.from_data(interface, data,
+                    project_id=build.project_id,
+                    build_id=build.id,
+                    test_id=node.id,
+                    label=node.label,
+                )
+                for node in chunk
+                for interface, data in node.attrs['data'].iteritems()
+            ]
+            if rows:
+                TestInterfaceStat.objects.bulk_create(rows)
+                self.counts['interface_stats'] += len(rows)
+                self.counts['batches'] += 1
+
+    def write_series(self, build, nodes):
+        """
+        Replaces the ``TestSeries`` row of every node written by this import.
+        """
+        for chunk in chunked((n for n in nodes if n.dirty), self.batch_size):
+            TestSeries.objects.filter(test__in=[n.id for n in chunk]).delete()
+            TestSeries.objects.bulk_create([
+                TestSeries.from_attrs(node.attrs,
+                    project_id=build.project_id,
+                    build_id=build.id,
+                    test_id=node.id,
+                    label=node.label,
+                    position=build.position or 0,
+                )
+                for node in chunk
+            ])
+            self.counts['series'] += len(chunk)
+            self.counts['batches'] += 1
+
+    def write_test_data(self, build, nodes, tests):
+        leaves = dict((n.label, n) for n in nodes if n.is_leaf and n.dirty)
+        if not leaves:
+            return
+
+        codec = get_trace_codec()
+        dictionary = CompressionDictionary.get_latest(build.project_id, codec)
+        blob_store = get_blob_store()
+
+        # call ids whose signatures are known to be stored
+        seen_signatures = set()
+        # checksums of the frames known to be stored
+        seen_frames = set()
+        # the checksum of each frame (by its JSON) seen in this build
+        frame_checksums = {}
+
+        def flush(rows, signatures, frames, callsites):
+            self.write_signatures(build, signatures, seen_signatures)
+            self.write_frames(build, frames, seen_frames)
+            TestData.objects.bulk_create(rows)
+            self.counts['testdata'] += len(rows)
+            self.counts['batches'] += 1
+
+            for chunk in chunked(callsites, self.batch_size):
+                CallSite.objects.bulk_create(chunk)
+                self.counts['callsites'] += len(chunk)
+                self.counts['batches'] += 1
+
+        def get_traces():
+            # traces kept by build_tree are written first, so the tests need only be
+            # read again for those which weren't
+            for node in nodes:
+                if node.trace is not None:
+                    calls, node.trace = node.trace, None
+                    if leaves.pop(node.label, None) is not None:
+                        yield node, calls
+
+            if not leaves:
+                return
+
+            for test_data in tests:
+                # a test may be listed more than once, but only the first is imported
+                node = leaves.pop(test_data['id'], None)
+                if node is None:
+                    continue
+
+                _, calls = format_test_leaf(test_data, self.version)
+                yield node, calls
+
+        rows, signatures, frames, callsites, num_calls = [], {}, {}, [], 0
+        for node, calls in get_traces():
+            for (interface, filename, function, lineno), (count, duration) in get_callsites(calls).iteritems():
+                callsites.append(CallSite(
+                    project_id=build.project_id,
+                    build_id=build.id,
+                    test_id=node.id,
+                    interface=interface,
+                    filename=filename,
+                    function=function,
+                    lineno=lineno,
+                    num_calls=count,
+                    total_duration=duration,
+                    num_tests=1,
+                ))
+
+            trace = []
+            for call in calls:
+                signature, call = CallSignature.split_call(call)
+                if call['sig'] not in seen_signatures:
+                    signatures[call['sig']] = signature
+
+                stack = []
+                for frame in call.get('stacktrace') or ():
+                    key = simplejson.dumps(frame, sort_keys=True)
+                    checksum = frame_checksums.get(key)
+                    if checksum is None:
+                        checksum = frame_checksums[key] = hash_parts(key)
+                    if checksum not in seen_frames:
+                        frames[checksum] = frame
+                    stack.append(checksum)
+                call['stacktrace'] = stack
 
-    return build
+                trace.append(call)
+
+            row = TestData(
+                project_id=build.project_id,
+                revision_id=build.revision_id,
+                build_id=build.id,
+                test_id=node.id,
+                key='trace',
+            )
+            blob = encode_trace(trace, codec, dictionary)
+            if blob_store is not None:
+                row.blob_checksum = blob_store.put(blob)
+                row.blob_length = len(blob)
+            else:
+                row.blob = blob
+            rows.append(row)
+            num_calls += len(trace)
+
+            if len(rows) >= self.batch_size or num_calls >= TRACE_BATCH_CALLS:
+                flush(rows, signatures, frames, callsites)
+                rows, signatures, frames, callsites, num_calls = [], {}, {}, [], 0
+
+        if rows:
+            flush(rows, signatures, frames, callsites)
+
+    def write_trace_diffs(self, build, tests):
+        """
+        Stores the diff of the trace of each of the given ``(id, label)``
+        tests against that of the same test in the previous build on its
+        lineage, which is the diff shown by default (see
+        ``zumanji.tracediff``).
+        """
+        for chunk in chunked(tests, self.batch_size):
+            # the latest run of each test before this build (series are ordered by position)
+            previous = {}
+            for label, test_id, checksum in TestSeries.objects.filter(
+                    project=build.project_id,
+                    label__in=[label for _, label in chunk],
+                    build__descendant_links__build=build.id,
+                    ).order_by('position').values_list('label', 'test', 'test__checksum'):
+                previous[label] = (test_id, checksum)
+            if not previous:
+                continue
+
+            traces = dict(
+                (d.test_id, d.trace)
+                for d in TestData.objects.filter(
+                    test__in=[test_id for test_id, _ in chunk] + [t for t, _ in previous.itervalues()],
+                    key='trace',
+                )
+            )
+
+            rows = []
+            for test_id, label in chunk:
+                if label not in previous or test_id not in traces:
+                    continue
+                previous_id, previous_checksum = previous[label]
+                if previous_id not in traces:
+                    continue
+
+                opcodes, exact = get_opcodes(*get_call_ids(build.project_id, traces[previous_id],
+                    traces[test_id]))
+                rows.append(TestData(
+                    project_id=build.project_id,
+                    revision_id=build.revision_id,
+                    build_id=build.id,
+                    test_id=test_id,
+                    key=TRACE_DIFF_KEY,
+                    data={
+                        'test': previous_id,
+                        'checksum': previous_checksum,
+                        'opcodes': pack_opcodes(opcodes),
+                        'exact': exact,
+                    },
+                ))
+
+            TestData.objects.bulk_create(rows)
+            self.counts['trace_diffs'] += len(rows)
+            self.counts['batches'] += 1
+
+    def write_callsite_rollups(self, build):
+        """
+        Replaces the build's totals for each callsite (and each file) with
+        the sum of those of its leaves.
+        """
+        CallSite.objects.filter(build=build, test__isnull=True).delete()
+        CallModule.objects.filter(build=build).delete()
+
+        leaf_callsites = CallSite.objects.filter(build=build, test__isnull=False)
+
+        rows = leaf_callsites.values('interface', 'filename', 'function', 'lineno').annotate(
+            calls=Sum('num_calls'),
+            duration=Sum('total_duration'),
+            tests=Count('test'),
+        ).order_by()
+        for chunk in chunked(list(rows), self.batch_size):
+            CallSite.objects.bulk_create([
+                CallSite(
+                    project_id=build.project_id,
+                    build_id=build.id,
+                    interface=row['interface'],
+                    filename=row['filename'],
+                    function=row['function'],
+                    lineno=row['lineno'],
+                    num_calls=row['calls'],
+                    total_duration=row['duration'],
+                    num_tests=row['tests'],
+                ) for row in chunk
+            ])
+            self.counts['batches'] += 1
+
+        rows = leaf_callsites.values('interface', 'filename').annotate(
+            calls=Sum('num_calls'),
+            duration=Sum('total_duration'),
+            tests=Count('test', distinct=True),
+        ).order_by()
+        for chunk in chunked(list(rows), self.batch_size):
+            CallModule.objects.bulk_create([
+                CallModule(
+                    project_id=build.project_id,
+                    build_id=build.id,
+                    interface=row['interface'],
+                    filename=row['filename'],
+                    num_calls=row['calls'],
+                    total_duration=row['duration'],
+                    num_tests=row['tests'],
+                ) for row in chunk
+            ])
+            self.counts['batches'] += 1
+
+    def write_signatures(self, build, signatures, seen_signatures):
+        """
+        Stores each of the given signatures which the project does not
+        already have.
+        """
+        for chunk in chunked(signatures.iteritems(), self.batch_size):
+            chunk = dict(chunk)
+            stored = set(CallSignature.objects.filter(
+                project=build.project_id,
+                checksum__in=chunk.keys(),
+            ).values_list('checksum', flat=True))
+
+            missing = [
+                CallSignature(project_id=build.project_id, checksum=checksum, **signature)
+                for checksum, signature in chunk.iteritems()
+                if checksum not in stored
+            ]
+            if missing:
+                CallSignature.objects.bulk_create(missing)
+                self.counts['signatures'] += len(missing)
+                self.counts['batches'] += 1
+
+            seen_signatures.update(chunk)
+
+    def write_frames(self, build, frames, seen_frames):
+        """
+        Stores each of the given frames which the build does not already
+        have.
+        """
+        for chunk in chunked(frames.iteritems(), self.batch_size):
+            chunk = dict(chunk)
+            stored = set(StackFrame.objects.filter(
+                build=build,
+                checksum__in=chunk.keys(),
+            ).values_list('checksum', flat=True))
+
+            missing = [
+                StackFrame(build_id=build.id, checksum=checksum, data=frame)
+                for checksum, frame in chunk.iteritems()
+                if checksum not in stored
+            ]
+            if missing:
+                StackFrame.objects.bulk_create(missing)
+                self.counts['frames'] += len(missing)
+                self.counts['batches'] += 1
+
+            seen_frames.update(chunk)
+
+    def delete_tests(self, tests):
+        test_ids = [test_id for test_id, _ in tests]
+
+        for chunk in chunked(test_ids, self.batch_size):
+            TestData.objects.filter(test__in=chunk).delete()
+            CallSite.objects.filter(test__in=chunk).delete()
+            TestInterfaceStat.objects.filter(test__in=chunk).delete()
+            TestSeries.objects.filter(test__in=chunk).delete()
+            # Detach them first so removing one never cascades into another
+            Test.objects.filter(id__in=chunk).update(parent=None)
+        for chunk in chunked(test_ids, self.batch_size):
+            Test.objects.filter(id__in=chunk).delete()
+            self.counts['deleted'] += len(chunk)
+
+
+def prewarm_pages(build):
+    """
+    Renders the pages of a newly imported build into the page cache, if
+    enabled. A failure is logged rather than failing the import.
+    """
+    from zumanji.pagecache import is_prewarm_enabled, prewarm_build
+
+    if not is_prewarm_enabled():
+        return
+    try:
+        prewarm_build(build)
+    except Exception:
+        logger.exception('Failed to prewarm the pages of build %s', build.id)
+
+
+def import_build(data, project=None, revision=None):
+    importer = BuildImporter(data, project=project, revision=revision)
+    importer.run()
+    return importer.place()
+
+
+def import_build_file(fp, project=None, revision=None, lock=None):
+    """
+    Imports the payload stored in ``fp`` within its own transaction, and
+    returns the ``BuildImporter`` used.
+
+    When importing concurrently, ``lock`` should be shared by every
+    importer, and is held while the rows shared between builds are
+    created, and while the build is placed on its lineage (in a second
+    transaction, once the import is committed). The import is retried if
+    another importer still creates one of the same rows first.
+    """
+    from zumanji.stream import BuildPayload
+
+    for attempt in xrange(MAX_ATTEMPTS):
+        importer = BuildImporter(BuildPayload(fp), project=project, revision=revision)
+        try:
+            if lock is not None:
+                with lock:
+                    transaction.commit_on_success(importer.resolve_references)()
+
+            transaction.commit_on_success(importer.run)()
+        except IntegrityError:
+            if attempt + 1 == MAX_ATTEMPTS:
+                raise
+        else:
+            if lock is not None:
+                with lock:
+                    transaction.commit_on_success(importer.place)()
+            else:
+                transaction.commit_on_success(importer.place)()
+            prewarm_pages(importer.build)
+            return importer
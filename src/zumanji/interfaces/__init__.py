@@ -0,0 +1,35 @@
+from django.conf import settings
+from django.utils.importlib import import_module
+from zumanji.interfaces.base import Interface
+from zumanji.interfaces.cache import CacheInterface
+from zumanji.interfaces.redis import RedisInterface
+from zumanji.interfaces.sql import SQLInterface
+
+DEFAULT_INTERFACES = {
+    'sql': SQLInterface,
+    'redis': RedisInterface,
+    'pipelined_redis': RedisInterface,
+    'cache': CacheInterface,
+}
+
+_interfaces = {}
+
+
+def load_interface(path):
+    module, attr = path.rsplit('.', 1)
+    return getattr(import_module(module), attr)
+
+
+def get_interface(name):
+    """
+    Returns the ``Interface`` for calls of the given type. These can be
+    overridden with ``ZUMANJI_CONFIG['interfaces']``, a mapping of the type
+    to the import path of its class.
+    """
+    if name not in _interfaces:
+        overrides = getattr(settings, 'ZUMANJI_CONFIG', {}).get('interfaces', {})
+        if name in overrides:
+            _interfaces[name] = load_interface(overrides[name])
+        else:
+            _interfaces[name] = DEFAULT_INTERFACES.get(name, Interface)
+    return _interfaces[name]
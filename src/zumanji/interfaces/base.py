@@ -1,5 +1,9 @@
+import re
 from django.shortcuts import render
 
+# hex digests, uuids and plain numbers within keys
+KEY_ID_RE = re.compile(r'\b[0-9a-fA-F]{8}-(?:[0-9a-fA-F]{4}-){3}[0-9a-fA-F]{12}\b|\b[0-9a-fA-F]{16,}\b|\d+')
+
 
 class Interface(object):
     template = None
@@ -7,6 +11,14 @@ class Interface(object):
     def __init__(self, data):
         self.data = data
 
+    @classmethod
+    def fingerprint(cls, command, args):
+        """
+        Returns a normalized version of ``command`` which is identical for
+        every call that only differs by the values it was given.
+        """
+        return command
+
     def render(self):
         if self.template is None:
             raise NotImplementedError
@@ -14,3 +26,29 @@ class Interface(object):
         return render(self.template, {
             'data': self.data,
         })
+
+
+class KeyedInterface(Interface):
+    """
+    An interface whose calls act on a key (given as the first argument),
+    such as a cache or key/value store.
+    """
+    @classmethod
+    def get_key_pattern(cls, args):
+        """
+        Returns the key found in ``args`` with any ids replaced by a
+        placeholder.
+        """
+        for arg in args or ():
+            if isinstance(arg, (list, tuple)):
+                arg = arg[0] if arg else None
+            if isinstance(arg, basestring):
+                return KEY_ID_RE.sub('%s', arg)
+        return None
+
+    @classmethod
+    def fingerprint(cls, command, args):
+        key = cls.get_key_pattern(args)
+        if key is None:
+            return command
+        return u'%s %s' % (command, key)
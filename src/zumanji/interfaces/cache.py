@@ -1,5 +1,5 @@
-from zumanji.interfaces.base import Interface
+from zumanji.interfaces.base import KeyedInterface
 
 
-class CacheInterface(Interface):
+class CacheInterface(KeyedInterface):
     template = 'zumanji/interfaces/cache.html'
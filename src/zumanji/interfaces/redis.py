@@ -0,0 +1,5 @@
+from zumanji.interfaces.base import KeyedInterface
+
+
+class RedisInterface(KeyedInterface):
+    pass
@@ -0,0 +1,18 @@
+import re
+from zumanji.interfaces.base import Interface
+
+STRING_RE = re.compile(r"'(?:[^'\\]|''|\\.)*'")
+NUMBER_RE = re.compile(r'(?<![\w."])-?\d+(?:\.\d+)?\b')
+IN_LIST_RE = re.compile(r'\bIN\s*\(\s*%s(?:\s*,\s*%s)*\s*\)', re.I)
+VALUES_RE = re.compile(r'\bVALUES\s*(\([^()]*\))(?:\s*,\s*\([^()]*\))+', re.I)
+WHITESPACE_RE = re.compile(r'\s+')
+
+
+class SQLInterface(Interface):
+    @classmethod
+    def fingerprint(cls, command, args):
+        command = STRING_RE.sub('%s', command)
+        command = NUMBER_RE.sub('%s', command)
+        command = IN_LIST_RE.sub('IN (%s)', command)
+        command = VALUES_RE.sub(r'VALUES \1', command)
+        return WHITESPACE_RE.sub(' ', command).strip()
@@ -0,0 +1,63 @@
+"""
+Deferred imports of uploaded builds.
+"""
+import logging
+from datetime import datetime
+from django.core.files.base import File
+from django.db import transaction
+from zumanji.importer import import_build_file
+from zumanji.models import ImportJob
+
+logger = logging.getLogger('zumanji.jobs')
+
+
+def enqueue_build(project, fp, revision=None):
+    """
+    Stores the payload in ``fp`` and queues it for import.
+    """
+    job = ImportJob(
+        project=project,
+        revision_label=revision or None,
+    )
+    job.payload.save('%s.json' % project.label.replace('/', '-'), File(fp), save=False)
+    job.save()
+    return job
+
+
+def run_job(job, lock=None):
+    """
+    Imports the payload of a claimed job, recording the outcome on the job.
+    """
+    try:
+        job.payload.open('rb')
+        try:
+            importer = import_build_file(job.payload, project=job.project.label,
+                revision=job.revision_label, lock=lock)
+        finally:
+            job.payload.close()
+    except Exception, e:
+        logger.exception('Failed to import job %s', job.id)
+        job.status = 'failed'
+        job.error = unicode(e)
+    else:
+        job.status = 'done'
+        job.build = importer.build
+
+    job.date_finished = datetime.now()
+    transaction.commit_on_success(job.save)()
+    return job
+
+
+def process_jobs(lock=None, limit=None):
+    """
+    Runs queued jobs until none are left (or ``limit`` have been run), and
+    returns the number run.
+    """
+    count = 0
+    while limit is None or count < limit:
+        job = transaction.commit_on_success(ImportJob.claim_next)()
+        if job is None:
+            break
+        run_job(job, lock=lock)
+        count += 1
+    return count
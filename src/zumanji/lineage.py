@@ -0,0 +1,393 @@
+"""
+Materialized ancestry of a project's builds.
+
+Each build points at the build before it on its lineage (``parent_build``):
+the previous build of the same revision, or else the latest build of the
+nearest built ancestor along the revision's first-parent chain. Projects
+without commit history (revisions with no known parents) are ordered by
+the time of each build instead.
+
+``BuildLineage`` then holds every ancestor of a build within
+``LINEAGE_DEPTH`` steps, so walking history is a single indexed query
+rather than a query per step. A build's ``position`` is the number of
+builds before it on its lineage, and is copied to its ``TestSeries``.
+
+A newly imported build has no position until ``place_build`` puts it on
+its lineage, once its import has been committed. Only the new build's
+ancestors and descendants are visited: the builds which may now follow it
+are the other children of its parent, the builds without a parent, and
+the next build of its revision (and, for a revision without history, the
+next build of any such revision). Since the lineage only depends on which
+builds are placed, and placement is serialized by ``lock_project``, builds
+end up in the same place whichever order (or how many at once) they were
+imported in.
+
+Builds imported before lineage existed are placed by migration 0028.
+Changes to the history itself (such as revisions fetched by
+``poll_github``), and any build left unplaced (by an import which failed
+after committing), are picked up by ``update_lineage``, which recomputes
+everything in memory for a project, and writes only the rows which
+changed.
+"""
+__all__ = ('LINEAGE_DEPTH', 'lock_project', 'place_build', 'update_lineage')
+
+from collections import defaultdict
+from django.db.models import Q
+from zumanji.models import Build, BuildLineage, Project, Revision, RevisionParent, TestSeries
+
+# Number of ancestors stored for each build
+LINEAGE_DEPTH = 50
+
+BATCH_SIZE = 500
+
+
+def get_generations(labels, parents):
+    """
+    Returns the generation of each revision: 0 for a revision without any
+    (known) parents, otherwise one more than that of its latest parent.
+    """
+    generations = {}
+    for label in labels:
+        # depth first, without recursing (histories are long)
+        stack, visiting = [label], set([label])
+        while stack:
+            current = stack[-1]
+            pending = [p for p in parents.get(current, ())
+                       if p in labels and p not in generations and p not in visiting]
+            if pending:
+                stack.extend(pending)
+                visiting.update(pending)
+                continue
+            stack.pop()
+            if current not in generations:
+                generations[current] = max([generations[p] + 1 for p in parents.get(current, ())
+                                            if p in generations] or [0])
+    return generations
+
+
+def get_first_parents(revisions, parents, generations):
+    """
+    Returns the first parent of each revision. Revisions imported before
+    the first parent was recorded use their latest parent instead.
+    """
+    first_parents = {}
+    for label, first_parent in revisions.iteritems():
+        if first_parent is None and parents.get(label):
+            first_parent = max(parents[label], key=lambda p: (generations.get(p, -1), p))
+        first_parents[label] = first_parent
+    return first_parents
+
+
+def get_parent_builds(builds, first_parents):
+    """
+    Returns the parent of each of the given (id, revision_label, datetime)
+    builds.
+    """
+    builds_by_revision = defaultdict(list)
+    for build_id, label, dt in builds:
+        builds_by_revision[label].append((dt, build_id))
+    for revision_builds in builds_by_revision.itervalues():
+        revision_builds.sort()
+
+    # the nearest revision with a build at or above each revision
+    nearest_built = {}
+
+    def get_nearest_built(label):
+        path = []
+        while label is not None and label not in nearest_built:
+            if label in builds_by_revision:
+                nearest_built[label] = label
+                break
+            if label in path:
+                break
+            path.append(label)
+            label = first_parents.get(label)
+        result = nearest_built.get(label) if label is not None else None
+        for step in path:
+            nearest_built[step] = result
+        return result
+
+    # builds of revisions without any history are simply ordered by time
+    unrooted = sorted((dt, build_id) for build_id, label, dt in builds if not first_parents.get(label))
+    previous_unrooted = dict((unrooted[i][1], unrooted[i - 1][1]) for i in xrange(1, len(unrooted)))
+
+    results = {}
+    for build_id, label, dt in builds:
+        revision_builds = builds_by_revision[label]
+        index = revision_builds.index((dt, build_id))
+        if index > 0:
+            results[build_id] = revision_builds[index - 1][1]
+        elif first_parents.get(label):
+            ancestor = get_nearest_built(first_parents[label])
+            results[build_id] = builds_by_revision[ancestor][-1][1] if ancestor else None
+        else:
+            results[build_id] = previous_unrooted.get(build_id)
+    return results
+
+
+def get_positions(parent_builds):
+    """
+    Returns the number of builds before each build on its lineage.
+    """
+    positions = {}
+    for build_id in parent_builds:
+        chain, seen = [], set()
+        current = build_id
+        while current is not None and current not in positions and current not in seen:
+            chain.append(current)
+            seen.add(current)
+            current = parent_builds.get(current)
+        position = positions[current] + 1 if current in positions else 0
+        for step in reversed(chain):
+            positions[step] = position
+            position += 1
+    return positions
+
+
+def get_ancestors(build_id, parent_builds):
+    ancestors = []
+    parent = parent_builds.get(build_id)
+    while parent is not None and len(ancestors) < LINEAGE_DEPTH:
+        ancestors.append(parent)
+        parent = parent_builds.get(parent)
+    return ancestors
+
+
+def update_lineage(project):
+    """
+    Brings the generations of the project's revisions, and the parent,
+    position and ancestors of each of its builds, up to date. Returns the
+    number of builds whose ancestors were rewritten. The project stays
+    locked (see ``lock_project``) until the end of the transaction.
+    """
+    lock_project(project)
+    revisions = dict(Revision.objects.filter(project=project).values_list('label', 'first_parent_label'))
+    parents = defaultdict(list)
+    for label, parent_label in RevisionParent.objects.filter(project=project).values_list(
+            'revision_label', 'parent_label'):
+        parents[label].append(parent_label)
+
+    generations = get_generations(set(revisions), parents)
+    current_generations = dict(Revision.objects.filter(project=project).values_list('label', 'generation'))
+    changed_generations = defaultdict(list)
+    for label, generation in generations.iteritems():
+        if current_generations.get(label) != generation:
+            changed_generations[generation].append(label)
+    for generation, labels in changed_generations.iteritems():
+        for offset in xrange(0, len(labels), BATCH_SIZE):
+            Revision.objects.filter(project=project, label__in=labels[offset:offset + BATCH_SIZE]).update(
+                generation=generation)
+
+    first_parents = get_first_parents(revisions, parents, generations)
+
+    builds = list(Build.objects.filter(project=project).values_list(
+        'id', 'revision__label', 'datetime', 'parent_build', 'position'))
+    parent_builds = get_parent_builds([b[:3] for b in builds], first_parents)
+
+    changed = defaultdict(list)
+    # builds whose next build may have changed
+    touched = set()
+    for build_id, _, _, current_parent, _ in builds:
+        if parent_builds[build_id] != current_parent:
+            changed[parent_builds[build_id]].append(build_id)
+            touched.update((current_parent, parent_builds[build_id]))
+    for parent_id, build_ids in changed.iteritems():
+        for offset in xrange(0, len(build_ids), BATCH_SIZE):
+            Build.objects.filter(id__in=build_ids[offset:offset + BATCH_SIZE]).update(
+                parent_build=parent_id)
+
+    positions = get_positions(parent_builds)
+    moved = defaultdict(list)
+    for build_id, _, _, _, current_position in builds:
+        if positions[build_id] != current_position:
+            moved[positions[build_id]].append(build_id)
+    for position, build_ids in moved.iteritems():
+        for offset in xrange(0, len(build_ids), BATCH_SIZE):
+            chunk = build_ids[offset:offset + BATCH_SIZE]
+            Build.objects.filter(id__in=chunk).update(position=position)
+            TestSeries.objects.filter(build__in=chunk).update(position=position)
+
+    # a build's ancestors change along with those of any build within reach above it
+    children = defaultdict(list)
+    for build_id, parent_id in parent_builds.iteritems():
+        if parent_id is not None:
+            children[parent_id].append(build_id)
+
+    affected = set()
+    level = [b for build_ids in changed.itervalues() for b in build_ids]
+    for _ in xrange(LINEAGE_DEPTH):
+        level = [b for b in level if b not in affected]
+        if not level:
+            break
+        affected.update(level)
+        level = [c for b in level for c in children[b]]
+
+    Build.touch(touched | affected)
+
+    affected = sorted(affected)
+    for offset in xrange(0, len(affected), BATCH_SIZE):
+        chunk = affected[offset:offset + BATCH_SIZE]
+        BuildLineage.objects.filter(build__in=chunk).delete()
+        BuildLineage.objects.bulk_create([
+            BuildLineage(build_id=build_id, ancestor_id=ancestor_id, distance=distance)
+            for build_id in chunk
+            for distance, ancestor_id in enumerate(get_ancestors(build_id, parent_builds), 1)
+        ])
+
+    return len(affected)
+
+
+def lock_project(project):
+    """
+    Locks the project's row until the end of the transaction, so that its
+    lineage is only ever updated by one transaction at a time.
+    """
+    list(Project.objects.select_for_update().filter(id=project.id).values_list('id', flat=True))
+
+
+def get_first_parent(project, label):
+    """
+    Returns the first parent of a single revision (see
+    ``get_first_parents``), or None if it's unknown or has none.
+    """
+    first_parents = Revision.objects.filter(project=project, label=label).values_list(
+        'first_parent_label', flat=True)[:1]
+    if not first_parents:
+        return None
+    if first_parents[0] is not None:
+        return first_parents[0] or None
+
+    parents = list(RevisionParent.objects.filter(project=project, revision_label=label).values_list(
+        'parent_label', flat=True))
+    if not parents:
+        return None
+    generations = dict(Revision.objects.filter(project=project, label__in=parents).exclude(
+        generation=None).values_list('label', 'generation'))
+    return max(parents, key=lambda p: (generations.get(p, -1), p))
+
+
+def get_latest(queryset):
+    build_ids = queryset.order_by('-datetime', '-id').values_list('id', flat=True)[:1]
+    return build_ids[0] if build_ids else None
+
+
+def filter_unrooted(project, queryset):
+    """
+    Limits the builds to those of revisions without any history.
+    """
+    legacy_labels = RevisionParent.objects.filter(project=project).values('revision_label')
+    return queryset.filter(
+        Q(revision__first_parent_label__isnull=True) | Q(revision__first_parent_label=''),
+    ).exclude(revision__first_parent_label__isnull=True, revision__label__in=legacy_labels)
+
+
+def get_parent_build(project, build):
+    """
+    Returns the id of the build's parent among the builds which have been
+    placed (see ``get_parent_builds``).
+    """
+    placed = Build.objects.filter(project=project, position__isnull=False)
+    earlier = placed.filter(Q(datetime__lt=build.datetime) | Q(datetime=build.datetime, id__lt=build.id))
+
+    previous = get_latest(earlier.filter(revision=build.revision_id))
+    if previous is not None:
+        return previous
+
+    label = get_first_parent(project, build.revision.label)
+    if label is None:
+        # the latest earlier build of any revision without history
+        return get_latest(filter_unrooted(project, earlier))
+
+    seen = set()
+    while label is not None and label not in seen:
+        seen.add(label)
+        ancestor = get_latest(placed.filter(revision__label=label))
+        if ancestor is not None:
+            return ancestor
+        label = get_first_parent(project, label)
+    return None
+
+
+def place_build(project, build):
+    """
+    Puts a build which hasn't been placed yet on its lineage, and moves
+    the builds which now follow it. Returns the ids of the builds whose
+    parent was set or changed.
+
+    Should only be called with the project locked (see ``lock_project``),
+    once the build has been committed. Other unplaced builds are ignored,
+    and follow whichever builds they would otherwise when they're placed.
+    """
+    placed = Build.objects.filter(project=project, position__isnull=False)
+    parent_id = get_parent_build(project, build)
+    if parent_id is None:
+        position = 0
+    else:
+        position = Build.objects.filter(id=parent_id).values_list('position', flat=True)[0] + 1
+
+    # the only builds which may now follow this one instead
+    followers = Q(parent_build__isnull=True)
+    if parent_id is not None:
+        followers |= Q(parent_build=parent_id)
+    candidates = dict((b.id, b) for b in placed.filter(followers).select_related('revision'))
+    later = placed.filter(Q(datetime__gt=build.datetime) | Q(datetime=build.datetime, id__gt=build.id))
+    next_builds = [later.filter(revision=build.revision_id)]
+    if get_first_parent(project, build.revision.label) is None:
+        next_builds.append(filter_unrooted(project, later))
+    for queryset in next_builds:
+        for b in queryset.select_related('revision').order_by('datetime', 'id')[:1]:
+            candidates[b.id] = b
+
+    Build.objects.filter(id=build.id).update(parent_build=parent_id, position=position)
+    TestSeries.objects.filter(build=build.id).update(position=position)
+    build.parent_build_id, build.position = parent_id, position
+
+    moved = [c for c in candidates.itervalues() if get_parent_build(project, c) == build.id]
+    if moved:
+        Build.objects.filter(id__in=[c.id for c in moved]).update(parent_build=build.id)
+    # builds whose next build may have changed
+    touched = set([build.id, parent_id] + [c.parent_build_id for c in moved])
+
+    ancestors = {build.id: []}
+    if parent_id is not None:
+        ancestors[build.id] = [parent_id] + list(BuildLineage.objects.filter(build=parent_id).order_by(
+            'distance').values_list('ancestor', flat=True)[:LINEAGE_DEPTH - 1])
+
+    # walk down from the build: the ancestors of those within reach change,
+    # as do the positions of any which moved
+    level, depth = [build.id], 0
+    while level:
+        depth += 1
+        children = []
+        for offset in xrange(0, len(level), BATCH_SIZE):
+            children.extend(Build.objects.filter(parent_build__in=level[offset:offset + BATCH_SIZE]).values_list(
+                'id', 'parent_build', 'position'))
+
+        shifted = [b for b, _, current in children if current != position + depth]
+        for offset in xrange(0, len(shifted), BATCH_SIZE):
+            chunk = shifted[offset:offset + BATCH_SIZE]
+            Build.objects.filter(id__in=chunk).update(position=position + depth)
+            TestSeries.objects.filter(build__in=chunk).update(position=position + depth)
+
+        if depth <= LINEAGE_DEPTH:
+            for build_id, parent, _ in children:
+                ancestors[build_id] = ([parent] + ancestors[parent])[:LINEAGE_DEPTH]
+            level = [b for b, _, _ in children]
+        else:
+            # out of reach, only the positions still change
+            level = shifted
+
+    Build.touch(touched | set(ancestors))
+
+    affected = sorted(ancestors)
+    for offset in xrange(0, len(affected), BATCH_SIZE):
+        chunk = affected[offset:offset + BATCH_SIZE]
+        BuildLineage.objects.filter(build__in=chunk).delete()
+        BuildLineage.objects.bulk_create([
+            BuildLineage(build_id=build_id, ancestor_id=ancestor_id, distance=distance)
+            for build_id in chunk
+            for distance, ancestor_id in enumerate(ancestors[build_id], 1)
+        ])
+
+    return [build.id] + [c.id for c in moved]
+
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand, CommandError
+from optparse import make_option
+from zumanji.blobstore import get_blob_store
+from zumanji.models import TestData
+
+
+class Command(BaseCommand):
+    help = 'Removes traces from the blob store which no build refers to'
+
+    option_list = BaseCommand.option_list + (
+        make_option('--grace', '-g', dest='grace', type='int', default=3600,
+            help='Seconds to keep unreferenced blobs for (as an import may not have committed yet)'),
+    )
+
+    def handle(self, grace=3600, **options):
+        blob_store = get_blob_store()
+        if blob_store is None:
+            raise CommandError('No blob store is configured (see BLOB_STORE)')
+
+        referenced = set(TestData.objects.filter(
+            blob_checksum__isnull=False,
+        ).values_list('blob_checksum', flat=True).distinct())
+
+        num_deleted = blob_store.collect_garbage(referenced, grace)
+        self.stdout.write('Removed %d blob(s) (%d referenced)\n' % (num_deleted, len(referenced)))
@@ -1,34 +1,162 @@
+import glob
+import multiprocessing
 import os.path
-from django.db import transaction
-from django.utils import simplejson
+from django.db import connection
 from django.core.management.base import BaseCommand, CommandError
+from django.utils import simplejson
 from optparse import make_option
-from zumanji.importer import import_build
+from zumanji.importer import import_build_file
+
+# Held while resolving the rows shared between builds (see ``init_worker``)
+_reference_lock = None
+
+
+def init_worker(lock):
+    global _reference_lock
+    _reference_lock = lock
+
+    # Never share the parent's database connection with a worker
+    connection.close()
+
+
+def find_json_files(paths):
+    """
+    Expands each path (which may be a file, a directory, or a glob) into the
+    list of JSON files it refers to.
+    """
+    results = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, dirnames, filenames in os.walk(path):
+                dirnames.sort()
+                results.extend(
+                    os.path.join(root, f)
+                    for f in sorted(filenames)
+                    if f.endswith('.json')
+                )
+        elif glob.has_magic(path):
+            results.extend(sorted(glob.glob(path)))
+        elif os.path.exists(path):
+            results.append(path)
+        else:
+            raise CommandError('Json file %r does not exist' % path)
+    return results
+
+
+def get_file_key(json_file):
+    stat = os.stat(json_file)
+    return os.path.abspath(json_file), stat.st_size, int(stat.st_mtime)
+
+
+class Ledger(object):
+    """
+    A record of the files which have already been imported, stored as one
+    JSON object per line so that an interrupted import loses at most the
+    file it was writing.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.entries = set()
+
+        if os.path.exists(path):
+            with open(path, 'r') as fp:
+                for line in fp:
+                    if not line.strip():
+                        continue
+                    entry = simplejson.loads(line)
+                    self.entries.add((entry['path'], entry['size'], entry['mtime']))
+
+    def __contains__(self, json_file):
+        return get_file_key(json_file) in self.entries
+
+    def add(self, json_file, build_id):
+        path, size, mtime = key = get_file_key(json_file)
+        with open(self.path, 'a') as fp:
+            fp.write(simplejson.dumps({
+                'path': path,
+                'size': size,
+                'mtime': mtime,
+                'build_id': build_id,
+            }) + '\n')
+        self.entries.add(key)
+
+
+def import_json_file(args):
+    """
+    Imports a single file, returning a tuple of (json_file, build_id,
+    counts, error).
+    """
+    json_file, project, revision = args
+
+    try:
+        with open(json_file, 'rb') as fp:
+            importer = import_build_file(fp, project=project, revision=revision,
+                lock=_reference_lock)
+    except Exception, e:
+        return json_file, None, None, unicode(e)
+
+    return json_file, importer.build.id, dict(importer.counts), None
 
 
 class Command(BaseCommand):
-    args = '<json_file json_file ...>'
+    args = '<json_file|directory|glob json_file|directory|glob ...>'
     help = 'Imports the specified JSON files'
 
     option_list = BaseCommand.option_list + (
         make_option('--project', '-p', dest='project', help='Project Label'),
         make_option('--revision', '-r', dest='revision', help='Revision Label'),
+        make_option('--workers', '-w', dest='workers', type='int', default=1,
+            help='Number of worker processes to import files with'),
+        make_option('--ledger', '-l', dest='ledger',
+            help='Record imported files in (and skip files already recorded in) this file'),
     )
 
-    @transaction.commit_on_success
     def handle(self, *args, **options):
-        for json_file in args:
+        json_files = find_json_files(args)
+
+        if options.get('ledger'):
+            ledger = Ledger(options['ledger'])
+            num_files = len(json_files)
+            json_files = [f for f in json_files if f not in ledger]
+            if num_files != len(json_files):
+                self.stdout.write('Skipping %d file(s) already in ledger\n' % (num_files - len(json_files),))
+        else:
+            ledger = None
+
+        tasks = [(f, options.get('project'), options.get('revision')) for f in json_files]
 
-            self.stdout.write('Reading json file %r\n' % (json_file,))
+        workers = options.get('workers') or 1
+        if workers > 1 and len(tasks) > 1:
+            connection.close()
+            pool = multiprocessing.Pool(workers, initializer=init_worker,
+                initargs=(multiprocessing.Lock(),))
+            results = pool.imap_unordered(import_json_file, tasks)
+        else:
+            pool = None
+            results = (import_json_file(t) for t in tasks)
 
-            if not os.path.exists(json_file):
-                raise CommandError('Json file %r does not exist' % json_file)
+        failed = []
+        try:
+            for json_file, build_id, counts, error in results:
+                if error:
+                    self.stderr.write('Failed to import %r: %s\n' % (json_file, error))
+                    failed.append(json_file)
+                    continue
 
-            with open(json_file, 'r') as fp:
-                data = simplejson.loads(fp.read())
+                if ledger is not None:
+                    ledger.add(json_file, build_id)
 
-            build = import_build(data, project=options.get('project'),
-                revision=options.get('revision'))
-            transaction.commit()
+                self.stdout.write('Imported %r (build_id=%r)\n' % (json_file, build_id))
+                for phase, count in sorted(counts.iteritems()):
+                    self.stdout.write('  %s: %d\n' % (phase, count))
+        except BaseException:
+            if pool is not None:
+                pool.terminate()
+            raise
+        else:
+            if pool is not None:
+                pool.close()
+                pool.join()
 
-            self.stdout.write('Imported %r (build_id=%r)\n' % (json_file, build.id))
+        if failed:
+            raise CommandError('Failed to import %d file(s)' % len(failed))
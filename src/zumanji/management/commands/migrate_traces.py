@@ -0,0 +1,54 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from optparse import make_option
+from zumanji.blobstore import get_blob_store
+from zumanji.importer import get_trace_codec
+from zumanji.models import TestData
+from zumanji.trace import encode_trace
+
+
+def migrate_traces(batch_size=500):
+    """
+    Re-encodes every trace which is still stored as JSON, one batch per
+    transaction, yielding the running total after each batch.
+    """
+    queryset = TestData.objects.filter(key='trace', blob__isnull=True, blob_checksum__isnull=True)
+    codec = get_trace_codec()
+    blob_store = get_blob_store()
+
+    last_id = 0
+    num_migrated = 0
+    while True:
+        rows = list(queryset.filter(id__gt=last_id).order_by('id')[:batch_size])
+        if not rows:
+            break
+
+        with transaction.commit_on_success():
+            for row in rows:
+                trace = row.data if isinstance(row.data, list) else []
+                blob = encode_trace(trace, codec)
+                if blob_store is not None:
+                    values = {'blob_checksum': blob_store.put(blob), 'blob_length': len(blob)}
+                else:
+                    values = {'blob': blob}
+                TestData.objects.filter(id=row.id).update(data={}, **values)
+
+        last_id = rows[-1].id
+        num_migrated += len(rows)
+        yield num_migrated
+
+
+class Command(BaseCommand):
+    help = 'Converts traces stored as JSON into the binary trace encoding'
+
+    option_list = BaseCommand.option_list + (
+        make_option('--batch-size', '-b', dest='batch_size', type='int', default=500,
+            help='Number of traces to convert per transaction'),
+    )
+
+    def handle(self, batch_size=500, **options):
+        num_migrated = 0
+        for num_migrated in migrate_traces(batch_size):
+            self.stdout.write('Migrated %d trace(s)\n' % num_migrated)
+
+        self.stdout.write('Done (%d trace(s) migrated)\n' % num_migrated)
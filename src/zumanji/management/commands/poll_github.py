@@ -2,6 +2,7 @@ from django.db import transaction
 from django.core.management.base import BaseCommand
 from optparse import make_option
 from zumanji.github import github
+from zumanji.lineage import update_lineage
 from zumanji.models import Project, Revision
 
 
@@ -31,3 +32,8 @@ class Command(BaseCommand):
                     if not rev.data or refetch:
                         rev.update_from_github(data)
                         rev.save()
+                        # cached pages show the revision's subject and author
+                        rev.touch_builds()
+
+            num_builds = transaction.commit_on_success(update_lineage)(project)
+            print "  Updated lineage of %d build(s)" % num_builds
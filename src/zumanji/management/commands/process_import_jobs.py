@@ -0,0 +1,61 @@
+import logging
+import multiprocessing
+import time
+from django.db import connection
+from django.core.management.base import BaseCommand
+from optparse import make_option
+from zumanji.jobs import process_jobs
+
+logger = logging.getLogger('zumanji.jobs')
+
+
+def run_worker(lock, once, interval):
+    # Never share the parent's database connection with a worker
+    connection.close()
+
+    while True:
+        try:
+            process_jobs(lock=lock)
+        except Exception:
+            # e.g. the database going away; the job is queued again once it times out
+            logger.exception('Failed to process import jobs')
+            connection.close()
+        if once:
+            break
+        time.sleep(interval)
+
+
+class Command(BaseCommand):
+    help = 'Imports builds which were queued by the upload view'
+
+    option_list = BaseCommand.option_list + (
+        make_option('--concurrency', '-c', dest='concurrency', type='int', default=1,
+            help='Number of worker processes to import jobs with'),
+        make_option('--once', dest='once', action='store_true',
+            help='Exit once the queue is empty rather than waiting for new jobs'),
+        make_option('--interval', '-i', dest='interval', type='float', default=5.0,
+            help='Seconds to wait before checking an empty queue again'),
+    )
+
+    def handle(self, concurrency=1, once=False, interval=5.0, **options):
+        lock = multiprocessing.Lock()
+
+        if concurrency <= 1:
+            run_worker(lock, once, interval)
+            return
+
+        connection.close()
+        workers = [
+            multiprocessing.Process(target=run_worker, args=(lock, once, interval))
+            for _ in xrange(concurrency)
+        ]
+        for worker in workers:
+            worker.start()
+
+        try:
+            for worker in workers:
+                worker.join()
+        except KeyboardInterrupt:
+            for worker in workers:
+                worker.terminate()
+            raise
@@ -0,0 +1,141 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Q
+from optparse import make_option
+from zumanji import compression
+from zumanji.blobstore import get_blob_store
+from zumanji.importer import get_trace_codec
+from zumanji.models import CompressionDictionary, Project, TestData
+from zumanji.trace import VERSION, Trace, encode_trace
+
+
+def get_traces(project):
+    """
+    Returns the project's encoded traces, whether they're stored in the
+    database or in the blob store.
+    """
+    return TestData.objects.filter(
+        Q(blob__isnull=False) | Q(blob_checksum__isnull=False),
+        project=project,
+        key='trace',
+    )
+
+
+def read_trace(blob, blob_checksum, blob_store):
+    if blob_checksum is not None:
+        if blob_store is None:
+            raise ValueError('Traces are stored in a blob store, but BLOB_STORE is not configured')
+        blob = blob_store.open(blob_checksum)
+    return Trace(blob, get_dictionary=CompressionDictionary.get_data)
+
+
+def train_dictionary(project, codec, num_samples=1000):
+    """
+    Trains (and stores) a new dictionary from the project's latest traces.
+    """
+    blob_store = get_blob_store()
+    rows = get_traces(project).order_by('-id').values_list('blob', 'blob_checksum')[:num_samples]
+
+    samples = [read_trace(blob, blob_checksum, blob_store).get_body() for blob, blob_checksum in rows]
+    if not samples:
+        return None
+
+    return CompressionDictionary.objects.create(
+        project=project,
+        codec=codec,
+        data=compression.train_dictionary(samples),
+    )
+
+
+def recompress_traces(project, codec, batch_size=500):
+    """
+    Re-encodes each of the project's traces which wasn't written with the
+    codec (and its latest dictionary), one batch per transaction, yielding
+    the running totals of (recompressed, skipped) after each batch.
+
+    Traces in the blob store are written back to it, under their new
+    checksum; the old blobs are left for ``gc_blobs``.
+    """
+    dictionary = CompressionDictionary.get_latest(project, codec)
+    dictionary_id = dictionary[0] if dictionary else None
+    blob_store = get_blob_store()
+
+    queryset = get_traces(project)
+
+    last_id = 0
+    num_recompressed, num_skipped = 0, 0
+    while True:
+        rows = list(queryset.filter(id__gt=last_id).order_by('id').values_list(
+            'id', 'blob', 'blob_checksum')[:batch_size])
+        if not rows:
+            break
+
+        with transaction.commit_on_success():
+            for testdata_id, blob, blob_checksum in rows:
+                trace = read_trace(blob, blob_checksum, blob_store)
+                if (trace.version, trace.codec, trace.dictionary_id) == (VERSION, codec, dictionary_id):
+                    num_skipped += 1
+                    continue
+
+                blob = encode_trace(list(trace), codec, dictionary)
+                if blob_checksum is not None:
+                    TestData.objects.filter(id=testdata_id).update(
+                        blob_checksum=blob_store.put(blob),
+                        blob_length=len(blob),
+                    )
+                else:
+                    TestData.objects.filter(id=testdata_id).update(blob=blob)
+                num_recompressed += 1
+
+        last_id = rows[-1][0]
+        yield num_recompressed, num_skipped
+
+
+class Command(BaseCommand):
+    help = 'Recompresses stored traces with the configured (or given) codec'
+
+    option_list = BaseCommand.option_list + (
+        make_option('--codec', '-c', dest='codec',
+            help='Codec to compress with (defaults to TRACE_CODEC)'),
+        make_option('--project', '-p', dest='project', help='Project Label'),
+        make_option('--train', dest='train', action='store_true',
+            help='Train a new dictionary for each project first'),
+        make_option('--samples', dest='samples', type='int', default=1000,
+            help='Number of traces to train each dictionary from'),
+        make_option('--batch-size', '-b', dest='batch_size', type='int', default=500,
+            help='Number of traces to recompress per transaction'),
+    )
+
+    def handle(self, codec=None, project=None, train=False, samples=1000, batch_size=500, **options):
+        codec = codec or get_trace_codec()
+        try:
+            supports_dictionaries = compression.get_codec(codec).supports_dictionaries
+        except ValueError, e:
+            raise CommandError(unicode(e))
+
+        if train and not supports_dictionaries:
+            raise CommandError('The %s codec does not support dictionaries' % codec)
+
+        projects = Project.objects.all()
+        if project:
+            projects = projects.filter(label=project)
+
+        for project in projects:
+            if train:
+                try:
+                    dictionary = train_dictionary(project, codec, samples)
+                except ValueError, e:
+                    raise CommandError(unicode(e))
+                if dictionary is not None:
+                    self.stdout.write('Trained dictionary %d for %s (%d bytes)\n' % (
+                        dictionary.id, project.label, len(dictionary.data)))
+
+            num_recompressed, num_skipped = 0, 0
+            try:
+                for num_recompressed, num_skipped in recompress_traces(project, codec, batch_size):
+                    self.stdout.write('%s: recompressed %d trace(s)\n' % (project.label, num_recompressed))
+            except ValueError, e:
+                raise CommandError(unicode(e))
+
+            self.stdout.write('%s: done (%d recompressed, %d already %s)\n' % (
+                project.label, num_recompressed, num_skipped, codec))
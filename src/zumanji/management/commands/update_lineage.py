@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from optparse import make_option
+from zumanji.lineage import update_lineage
+from zumanji.models import Project
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the lineage (parent builds and their ancestors) of each project'
+
+    option_list = BaseCommand.option_list + (
+        make_option('--project', '-p', dest='project', help='Project Label'),
+    )
+
+    def handle(self, project=None, **options):
+        projects = Project.objects.all()
+        if project:
+            projects = projects.filter(label=project)
+
+        for project in projects:
+            with transaction.commit_on_success():
+                num_builds = update_lineage(project)
+            self.stdout.write('%s: updated lineage of %d build(s)\n' % (project.label, num_builds))
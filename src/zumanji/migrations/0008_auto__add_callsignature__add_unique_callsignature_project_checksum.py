@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+from south.utils import datetime_utils as datetime
+from south.db import db
+from south.v2 import SchemaMigration
+from django.db import models
+
+
+class Migration(SchemaMigration):
+
+    def forwards(self, orm):
+        # Adding model 'CallSignature'
+        db.create_table('zumanji_callsignature', (
+            ('id', self.gf('django.db.models.fields.AutoField')(primary_key=True)),
+            ('project', self.gf('django.db.models.fields.related.ForeignKey')(to=orm['zumanji.Project'])),
+            ('checksum', self.gf('django.db.models.fields.CharField')(max_length=32)),
+            ('interface', self.gf('django.db.models.fields.CharField')(max_length=64)),
+            ('command', self.gf('django.db.models.fields.TextField')()),
+            ('filename', self.gf('django.db.models.fields.TextField')(null=True)),
+            ('function', self.gf('django.db.models.fields.TextField')(null=True)),
+        ))
+        db.send_create_signal('zumanji', ['CallSignature'])
+
+        # Adding unique constraint on 'CallSignature', fields ['project', 'checksum']
+        db.create_unique('zumanji_callsignature', ['project_id', 'checksum'])
+
+
+    def backwards(self, orm):
+        # Removing unique constraint on 'CallSignature', fields ['project', 'checksum']
+        db.delete_unique('zumanji_callsignature', ['project_id', 'checksum'])
+
+        # Deleting model 'CallSignature'
+        db.delete_table('zumanji_callsignature')
+
+
+    models = {
+        'zumanji.build': {
+            'Meta': {'unique_together': "(('revision', 'datetime'),)", 'object_name': 'Build'},
+            'checksum': ('django.db.models.fields.CharField', [], {'max_length': '40', 'null': 'True'}),
+            'data': ('django.db.models.fields.TextField', [], {'default': '{}', 'blank': 'True'}),
+            'datetime': ('django.db.models.fields.DateTimeField', [], {}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'num_tests': ('django.db.models.fields.PositiveIntegerField', [], {'default': '0'}),
+            'project': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['zumanji.Project']"}),
+            'result': ('django.db.models.fields.CharField', [], {'max_length': '16', 'null': 'True'}),
+            'revision': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['zumanji.Revision']"}),
+            'total_duration': ('django.db.models.fields.FloatField', [], {'default': '0.0'})
+        },
+        'zumanji.buildtag': {
+            'Meta': {'object_name': 'BuildTag'},
+            'builds': ('django.db.models.fields.related.ManyToManyField', [], {'related_name': "'tags'", 'symmetrical': 'False', 'to': "orm['zumanji.Build']"}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'label': ('django.db.models.fields.CharField', [], {'max_length': '255'})
+        },
+        'zumanji.callsignature': {
+            'Meta': {'unique_together': "(('project', 'checksum'),)", 'object_name': 'CallSignature'},
+            'checksum': ('django.db.models.fields.CharField', [], {'max_length': '32'}),
+            'command': ('django.db.models.fields.TextField', [], {}),
+            'filename': ('django.db.models.fields.TextField', [], {'null': 'True'}),
+            'function': ('django.db.models.fields.TextField', [], {'null': 'True'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'interface': ('django.db.models.fields.CharField', [], {'max_length': '64'}),
+            'project': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['zumanji.Project']"})
+        },
+        'zumanji.importjob': {
+            'Meta': {'object_name': 'ImportJob'},
+            'build': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['zumanji.Build']", 'null': 'True'}),
+            'date_created': ('django.db.models.fields.DateTimeField', [], {'default': 'datetime.datetime.now'}),
+            'date_finished': ('django.db.models.fields.DateTimeField', [], {'null': 'True'}),
+            'date_started': ('django.db.models.fields.DateTimeField', [], {'null': 'True'}),
+            'error': ('django.db.models.fields.TextField', [], {'null': 'True'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'payload': ('django.db.models.fields.files.FileField', [], {'max_length': '255'}),
+            'project': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['zumanji.Project']"}),
+            'revision_label': ('django.db.models.fields.CharField', [], {'max_length': '64', 'null': 'True'}),
+            'status': ('django.db.models.fields.CharField', [], {'default': "'queued'", 'max_length': '16', 'db_index': 'True'})
+        },
+        'zumanji.project': {
+            'Meta': {'object_name': 'Project'},
+            'data': ('django.db.models.fields.TextField', [], {'default': '{}', 'blank': 'True'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'label': ('django.db.models.fields.CharField', [], {'unique': 'True', 'max_length': '64'})
+        },
+        'zumanji.revision': {
+            'Meta': {'unique_together': "(('project', 'label'),)", 'object_name': 'Revision'},
+            'data': ('django.db.models.fields.TextField', [], {'default': '{}', 'blank': 'True'}),
+            'datetime': ('django.db.models.fields.DateTimeField', [], {'null': 'True'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'label': ('django.db.models.fields.CharField', [], {'max_length': '64'}),
+            'project': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['zumanji.Project']"})
+        },
+        'zumanji.revisionparent': {
+            'Meta': {'unique_together': "(('project', 'revision_label', 'parent_label'),)", 'object_name': 'RevisionParent'},
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'parent_label': ('django.db.models.fields.CharField', [], {'max_length': '64', 'null': 'True'}),
+            'project': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['zumanji.Project']"}),
+            'revision_label': ('django.db.models.fields.CharField', [], {'max_length': '64', 'null': 'True'})
+        },
+        'zumanji.test': {
+            'Meta': {'unique_together': "(('build', 'label'),)", 'object_name': 'Test'},
+            'build': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['zumanji.Build']"}),
+            'checksum': ('django.db.models.fields.CharField', [], {'max_length': '40', 'null': 'True'}),
+            'data': ('django.db.models.fields.TextField', [], {'default': '{}', 'blank': 'True'}),
+            'description': ('django.db.models.fields.TextField', [], {'null': 'True'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'label': ('django.db.models.fields.CharField', [], {'max_length': '255'}),
+            'lower_duration': ('django.db.models.fields.FloatField', [], {'default': '0.0'}),
+            'mean_duration': ('django.db.models.fields.FloatField', [], {'default': '0.0'}),
+            'num_tests': ('django.db.models.fields.PositiveIntegerField', [], {'default': '0'}),
+            'parent': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['zumanji.Test']", 'null': 'True'}),
+            'project': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['zumanji.Project']"}),
+            'result': ('django.db.models.fields.CharField', [], {'max_length': '16', 'null': 'True'}),
+            'revision': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['zumanji.Revision']"}),
+            'upper90_duration': ('django.db.models.fields.FloatField', [], {'default': '0.0'}),
+            'upper_duration': ('django.db.models.fields.FloatField', [], {'default': '0.0'})
+        },
+        'zumanji.testdata': {
+            'Meta': {'unique_together': "(('test', 'key'),)", 'object_name': 'TestData'},
+            'build': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['zumanji.Build']"}),
+            'data': ('django.db.models.fields.TextField', [], {'default': '{}', 'blank': 'True'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'key': ('django.db.models.fields.CharField', [], {'max_length': '32'}),
+            'project': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['zumanji.Project']"}),
+            'revision': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['zumanji.Revision']"}),
+            'test': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['zumanji.Test']"})
+        }
+    }
+
+    complete_apps = ['zumanji']
\ No newline at end of file
@@ -1,9 +1,17 @@
 import base64
+import copy
 import dateutil.parser
-from django.db import models
+import zlib
+from datetime import datetime, timedelta
+from django.conf import settings
+from django.db import connection, models
 from django.db.models import Q
 from django.utils import simplejson
+from zumanji import compression
+from zumanji.blobstore import get_blob_store
 from zumanji.github import github
+from zumanji.stats import get_margin
+from zumanji.trace import Trace
 
 
 RESULT_CHOICES = tuple((k, k) for k in (
@@ -13,28 +21,119 @@ RESULT_CHOICES = tuple((k, k) for k in (
     'deprecated',
 ))
 
+JOB_STATUS_CHOICES = tuple((k, k) for k in (
+    'queued',
+    'running',
+    'done',
+    'failed',
+))
+
+# Seconds after which a running import job is assumed to have lost its worker
+IMPORT_JOB_TIMEOUT = 3600
+
+
+class EncodedJSON(object):
+    """
+    A value of a ``GzippedJSONField`` as it was loaded from the database,
+    which has yet to be decoded.
+    """
+    __slots__ = ('value',)
+
+    def __init__(self, value):
+        self.value = value
+
+    def __getstate__(self):
+        return self.value
+
+    def __setstate__(self, state):
+        self.value = state
+
+
+class LazyJSONDescriptor(object):
+    """
+    Holds on to the encoded value of a ``GzippedJSONField`` until it's
+    first accessed, and then caches the decoded value on the instance.
+    """
+    def __init__(self, field):
+        self.field = field
+
+    def __get__(self, instance, owner):
+        if instance is None:
+            return self
+
+        value = instance.__dict__[self.field.attname]
+        if isinstance(value, EncodedJSON):
+            value = instance.__dict__[self.field.attname] = self.field.to_python(value.value)
+        return value
+
+    def __set__(self, instance, value):
+        if isinstance(value, basestring) and value:
+            value = EncodedJSON(value)
+        else:
+            value = self.field.to_python(value)
+        instance.__dict__[self.field.attname] = value
+
 
 class GzippedJSONField(models.TextField):
     """
     Slightly different from a JSONField in the sense that the default
     value is a dictionary.
+
+    Values are only decoded when they're first accessed, so rows can be
+    loaded without paying for fields which are never read.
+
+    Values are compressed with ``codec`` (see ``zumanji.compression``).
+    Those written with zlib are kept as a bare zlib stream, which is how
+    every value was stored before codecs were tagged, so either can be
+    read regardless of the codec.
     """
-    __metaclass__ = models.SubfieldBase
+    def __init__(self, *args, **kwargs):
+        self.codec = kwargs.pop('codec', 'zlib')
+        super(GzippedJSONField, self).__init__(*args, **kwargs)
 
-    def to_python(self, value):
-        if isinstance(value, basestring) and value:
-            try:
-                value = simplejson.loads(base64.b64decode(value).decode('zlib'))
-            except Exception:
-                return {}
-        elif not value:
+    def contribute_to_class(self, cls, name):
+        super(GzippedJSONField, self).contribute_to_class(cls, name)
+        setattr(cls, self.attname, LazyJSONDescriptor(self))
+
+    def get_default(self):
+        # a copy of the default as is (rather than as a string, like most fields)
+        if not self.has_default():
             return {}
-        return value
+        if callable(self.default):
+            return self.default()
+        return copy.deepcopy(self.default)
+
+    def to_python(self, value):
+        if isinstance(value, EncodedJSON):
+            value = value.value
+        if value is None or value == '':
+            return self.get_default()
+        if not isinstance(value, basestring):
+            return value
+
+        # plain JSON (neither of which is in the base64 alphabet), such as
+        # a column's default filled in by a migration
+        if value[0] in '{[':
+            return simplejson.loads(value)
+
+        value = base64.b64decode(value)
+        # a bare zlib stream (which always starts with 0x?8)
+        if ord(value[0]) & 0x0f == 8:
+            value = zlib.decompress(value)
+        else:
+            value = compression.decompress(value)
+        return simplejson.loads(value)
 
     def get_prep_value(self, value):
         if value is None:
             return
-        return base64.b64encode(simplejson.dumps(value).encode('zlib'))
+        if isinstance(value, EncodedJSON):
+            # never decoded, so it can't have changed
+            return value.value
+        value = simplejson.dumps(value)
+        if self.codec == 'zlib':
+            return base64.b64encode(zlib.compress(value))
+        return base64.b64encode(compression.compress(value, self.codec))
 
     def value_to_string(self, obj):
         value = self._get_val_from_obj(obj)
@@ -48,6 +147,38 @@ class GzippedJSONField(models.TextField):
         return (field_class, args, kwargs)
 
 
+class BlobField(models.Field):
+    """
+    Stores a string of bytes in a binary column.
+    """
+    __metaclass__ = models.SubfieldBase
+
+    def db_type(self, connection):
+        return {
+            'postgresql': 'bytea',
+            'mysql': 'longblob',
+        }.get(connection.vendor, 'blob')
+
+    def to_python(self, value):
+        if value is None or isinstance(value, str):
+            return value
+        return str(value)
+
+    def get_db_prep_value(self, value, connection, prepared=False):
+        if value is None:
+            return None
+        # most drivers only treat a buffer (rather than a str) as binary
+        if connection.vendor == 'mysql':
+            return str(value)
+        return buffer(value)
+
+    def south_field_triple(self):
+        "Returns a suitable description of this field for South."
+        from south.modelsinspector import introspector
+        args, kwargs = introspector(self)
+        return ('zumanji.models.BlobField', args, kwargs)
+
+
 class Project(models.Model):
     label = models.CharField(max_length=64, unique=True)
     data = GzippedJSONField(default={}, blank=True)
@@ -72,10 +203,20 @@ class Project(models.Model):
 class Revision(models.Model):
     project = models.ForeignKey(Project)
     label = models.CharField(max_length=64)
+    # the commit date
     datetime = models.DateTimeField(null=True)
+    # the full commit (as returned by GitHub); lists of revisions should
+    # defer it, as everything they show is copied into the columns below
     data = GzippedJSONField(default={}, blank=True)
+    subject = models.CharField(max_length=255, default='', blank=True)
+    author_name = models.CharField(max_length=128, default='', blank=True, db_index=True)
+    author_email = models.CharField(max_length=128, default='', blank=True, db_index=True)
+    # maintained by ``zumanji.lineage``
+    generation = models.IntegerField(null=True)
+    first_parent_label = models.CharField(max_length=64, null=True)
 
     class Meta:
+        # also indexed on (project, datetime)
         unique_together = (('project', 'label'),)
 
     def __unicode__(self):
@@ -114,9 +255,7 @@ class Revision(models.Model):
 
     @property
     def oneline(self):
-        if not self.data:
-            return ''
-        return self.data['commit']['message'].split('\n', 1)[0]
+        return self.subject
 
     @property
     def summary(self):
@@ -126,9 +265,9 @@ class Revision(models.Model):
 
     @property
     def author(self):
-        if not self.data:
+        if not (self.author_name or self.author_email):
             return {}
-        return self.data['commit']['author']
+        return {'name': self.author_name, 'email': self.author_email}
 
     def get_parents(self):
         return list(RevisionParent.objects.filter(
@@ -148,9 +287,26 @@ class Revision(models.Model):
                 parent_label=parent['sha'],
             )
 
+        if data.get('parents'):
+            self.first_parent_label = data['parents'][0]['sha']
         self.datetime = datetime
         self.data = type(self).sanitize_github_data(data)
 
+        commit = data['commit']
+        author = commit.get('author') or {}
+        self.subject = (commit.get('message') or '').split('\n', 1)[0][:255]
+        self.author_name = (author.get('name') or '')[:128]
+        self.author_email = (author.get('email') or '')[:128]
+
+    def touch_builds(self):
+        """
+        Marks the pages which show this revision as changed: those of its
+        builds, and of every build whose history includes one of them.
+        """
+        build_ids = list(self.build_set.values_list('id', flat=True))
+        Build.touch(build_ids + list(BuildLineage.objects.filter(ancestor__in=build_ids).values_list(
+            'build', flat=True)))
+
 
 class RevisionParent(models.Model):
     project = models.ForeignKey(Project)
@@ -169,6 +325,15 @@ class Build(models.Model):
     total_duration = models.FloatField(default=0.0)
     data = GzippedJSONField(default={}, blank=True)
     result = models.CharField(max_length=16, choices=RESULT_CHOICES, null=True)
+    # sha1 of the payload this build was imported from
+    checksum = models.CharField(max_length=40, null=True)
+    # the build before this one on its lineage (see ``zumanji.lineage``)
+    parent_build = models.ForeignKey('self', null=True, related_name='child_builds',
+        on_delete=models.SET_NULL)
+    # the number of builds before this one on its lineage
+    position = models.PositiveIntegerField(null=True)
+    # when anything shown on this build's pages last changed (see ``zumanji.pagecache``)
+    date_modified = models.DateTimeField(null=True)
 
     class Meta:
         unique_together = (('revision', 'datetime'),)
@@ -180,55 +345,131 @@ class Build(models.Model):
         self.project = self.revision.project
         super(Build, self).save(*args, **kwargs)
 
-    def _get_temporal_sibling(self, tag=None, previous=False):
-        filter_args = {
-            'project': self.project,
-            # datetime_filter: self.revision.datetime
-        }
-        if tag:
-            filter_args["tags"] = tag
-
-        qs = type(self).objects.filter(**filter_args)
-
-        # if datetime is present, it means we've parsed the commit
-        parents = self.revision.get_parents()
-        if parents:
-            if previous:
-                qs = qs.filter(
-                    revision__label__in=parents,
-                )
-                order_field = ('-revision__datetime', '-datetime')
-            else:
-                qs = qs.extra(
-                    tables=['zumanji_revisionparent'],
-                    where=['zumanji_revisionparent.revision_label = %s'],
-                    params=[self.revision.label],
-                )
-                order_field = ('revision__datetime', 'datetime')
-        else:
-            if previous:
-                qs = qs.filter(
-                    datetime__gt=self.datetime,
-                )
-                order_field = ('-datetime',)
-            else:
-                qs = qs.filter(
-                    datetime__lt=self.datetime,
-                )
-                order_field = ('datetime',)
+    @classmethod
+    def touch(cls, build_ids):
+        """
+        Marks the pages of the given builds as changed.
+        """
+        build_ids = sorted(set(b for b in build_ids if b is not None))
+        now = datetime.now()
+        for offset in xrange(0, len(build_ids), 500):
+            cls.objects.filter(id__in=build_ids[offset:offset + 500]).update(date_modified=now)
+
+    def get_previous_build(self, tag=None):
+        """
+        Returns the build before this one on its lineage (see
+        ``zumanji.lineage``), optionally the nearest one with the given tag.
+        """
+        if not tag:
+            if self.parent_build_id is None:
+                return None
+            return type(self).objects.select_related('revision').defer('revision__data').get(
+                id=self.parent_build_id)
 
         try:
-            return qs.exclude(
-                id=self.id,
-            ).select_related('revision').order_by(*order_field)[0]
+            return BuildLineage.objects.filter(
+                build=self,
+                ancestor__tags=tag,
+            ).select_related('ancestor__revision').defer('ancestor__revision__data').order_by(
+                'distance')[0].ancestor
         except IndexError:
             return None
 
-    def get_previous_build(self, tag=None):
-        return self._get_temporal_sibling(tag, previous=True)
-
     def get_next_build(self, tag=None):
-        return self._get_temporal_sibling(tag)
+        """
+        Returns the nearest build which has this one on its lineage (the
+        earliest, if several do), optionally with the given tag.
+        """
+        qs = BuildLineage.objects.filter(ancestor=self)
+        if tag:
+            qs = qs.filter(build__tags=tag)
+        try:
+            return qs.select_related('build__revision').defer('build__revision__data').order_by(
+                'distance', 'build__datetime')[0].build
+        except IndexError:
+            return None
+
+    def get_previous_builds(self, limit=50, tag=None):
+        """
+        Returns up to ``limit`` (at most ``LINEAGE_DEPTH``) of the builds
+        before this one on its lineage, nearest first.
+        """
+        qs = BuildLineage.objects.filter(build=self)
+        if tag:
+            qs = qs.filter(ancestor__tags=tag)
+        return [l.ancestor for l in qs.select_related('ancestor__revision').defer(
+            'ancestor__revision__data').order_by('distance')[:limit]]
+
+
+class BuildLineage(models.Model):
+    """
+    An ancestor of a build on its lineage, ``distance`` steps away.
+    """
+    build = models.ForeignKey(Build, related_name='ancestor_links')
+    ancestor = models.ForeignKey(Build, related_name='descendant_links')
+    distance = models.PositiveIntegerField()
+
+    class Meta:
+        # also indexed on (build, distance) and (ancestor, distance)
+        unique_together = (('build', 'ancestor'),)
+
+
+class ProjectSummary(models.Model):
+    """
+    What the index page shows of a project, kept current by the importer so
+    every project can be listed from a single query.
+    """
+    # number of builds whose total duration is kept in ``trend``
+    TREND_SIZE = 10
+
+    project = models.OneToOneField(Project, related_name='summary')
+    latest_build = models.ForeignKey(Build, null=True, on_delete=models.SET_NULL)
+    # copied from the latest build's revision
+    revision_label = models.CharField(max_length=64, null=True)
+    oneline = models.CharField(max_length=255, default='', blank=True)
+    author_name = models.CharField(max_length=255, default='', blank=True)
+    num_builds = models.PositiveIntegerField(default=0)
+    num_tests = models.PositiveIntegerField(default=0)
+    total_duration = models.FloatField(default=0.0)
+    # total duration of each of the latest builds, oldest first
+    trend = GzippedJSONField(default=[], blank=True)
+    date_imported = models.DateTimeField(null=True)
+
+    def __unicode__(self):
+        return unicode(self.project)
+
+    @classmethod
+    def update(cls, project, date_imported=None):
+        """
+        Recomputes the summary of the project, returning it.
+        """
+        builds = list(Build.objects.filter(project=project).order_by(
+            '-revision__datetime', '-datetime').select_related('revision').defer(
+            'revision__data')[:cls.TREND_SIZE])
+
+        summary, _ = cls.objects.get_or_create(project=project)
+        summary.num_builds = Build.objects.filter(project=project).count()
+        summary.trend = [b.total_duration for b in reversed(builds)]
+        if date_imported is not None:
+            summary.date_imported = date_imported
+
+        if builds:
+            latest = builds[0]
+            summary.latest_build = latest
+            summary.revision_label = latest.revision.label
+            summary.oneline = latest.revision.subject
+            summary.author_name = latest.revision.author_name
+            summary.num_tests = latest.num_tests
+            summary.total_duration = latest.total_duration
+        else:
+            summary.latest_build = None
+            summary.revision_label = None
+            summary.oneline = summary.author_name = ''
+            summary.num_tests = 0
+            summary.total_duration = 0.0
+
+        summary.save()
+        return summary
 
 
 class BuildTag(models.Model):
@@ -250,9 +491,18 @@ class Test(models.Model):
     mean_duration = models.FloatField(default=0.0)
     upper_duration = models.FloatField(default=0.0)
     lower_duration = models.FloatField(default=0.0)
+    upper50_duration = models.FloatField(default=0.0)
     upper90_duration = models.FloatField(default=0.0)
+    upper95_duration = models.FloatField(default=0.0)
+    upper99_duration = models.FloatField(default=0.0)
+    stddev_duration = models.FloatField(default=0.0)
+    # the number of runs mean_duration was measured from, and its standard error
+    num_samples = models.PositiveIntegerField(default=1)
+    stderr_duration = models.FloatField(default=0.0)
     data = GzippedJSONField(default={}, blank=True)
     result = models.CharField(max_length=16, choices=RESULT_CHOICES, null=True)
+    # sha1 of this row (and for leaves, its trace) as of the last import
+    checksum = models.CharField(max_length=40, null=True)
 
     class Meta:
         unique_together = (('build', 'label'),)
@@ -267,70 +517,54 @@ class Test(models.Model):
         self.project = self.revision.project
         super(Test, self).save(*args, **kwargs)
 
+    @property
+    def margin_duration(self):
+        """
+        The half-width of the 95% confidence interval of ``mean_duration``.
+        """
+        return get_margin(self.stderr_duration, self.num_samples)
+
     def shortlabel(self):
         if not self.parent:
             return self.label
         return self.label[len(self.parent.label) + 1:]
 
+    def get_series(self, limit=50):
+        """
+        Returns the ``TestSeries`` of this test in (up to ``limit`` of) the
+        builds before this one on its lineage which ran it, nearest first.
+        """
+        return list(TestSeries.objects.filter(
+            project=self.project_id,
+            label=self.label,
+            build__descendant_links__build=self.build_id,
+        ).select_related('build__revision').defer('build__revision__data').order_by(
+            '-position')[:limit])
+
     def get_test_in_previous_build(self):
         try:
-            qs = type(self).objects.filter(
-                build__project=self.project,
+            return TestSeries.objects.filter(
+                project=self.project_id,
                 label=self.label,
-            ).exclude(
-                build=self.build,
-            )
-            parents = self.revision.get_parents()
-            if self.revision.datetime:
-                qs = qs.filter(
-                    build__revision__datetime__lt=self.revision.datetime,
-                    build__revision__label__in=parents,
-                ).order_by('-build__revision__datetime', '-build__datetime')
-            else:
-                qs = qs.filter(
-                    build__datetime__lt=self.build.datetime,
-                ).order_by('-build__datetime')
-
-            return qs[0]
+                build__descendant_links__build=self.build_id,
+            ).select_related('test__build', 'test__revision').defer('test__revision__data').order_by(
+                '-position')[0].test
         except IndexError:
             return None
 
     def get_test_in_next_build(self):
         try:
-            qs = type(self).objects.filter(
-                build__project=self.project,
+            return TestSeries.objects.filter(
+                project=self.project_id,
                 label=self.label,
-            ).exclude(
-                build=self.build,
-            )
-            if self.revision.datetime:
-                qs = qs.extra(
-                    tables=['zumanji_revisionparent'],
-                    where=[
-                        'zumanji_revisionparent.parent_label = %s',
-                    ],
-                    params=[self.revision.label],
-                ).filter(
-                    build__revision__datetime__gt=self.revision.datetime,
-                ).order_by('build__revision__datetime', 'build__datetime')
-            else:
-                qs = qs.filter(
-                    build__datetime__gt=self.build.datetime,
-                ).order_by('build__datetime')
-            return qs[0]
+                build__ancestor_links__ancestor=self.build_id,
+            ).select_related('test__build', 'test__revision').defer('test__revision__data').order_by(
+                'position', 'build')[0].test
         except IndexError:
             return None
 
     def get_previous_builds(self, limit=50):
-        build = self.build
-        builds = []
-        for x in xrange(limit):
-            previous_build = build.get_previous_build()
-            if previous_build is None:
-                break
-            builds.append(previous_build)
-            build = previous_build
-        return builds
+        return [s.build for s in self.get_series(limit)]
 
     def get_context(self):
         # O(N), so dont abuse it
@@ -342,6 +576,147 @@ class Test(models.Model):
         nodes.reverse()
         return nodes
 
+    def get_interface_stats(self):
+        """
+        Returns a mapping of interface to ``TestInterfaceStat``, using the
+        rows prefetched with ``prefetch_related('interface_stats')`` if
+        there are any.
+        """
+        return dict((s.interface, s) for s in self.interface_stats.all())
+
+
+class TestInterfaceStat(models.Model):
+    """
+    The calls a test made to a single interface (summed over its leaves
+    for a branch), so they can be compared between builds in SQL.
+    """
+    project = models.ForeignKey(Project)
+    build = models.ForeignKey(Build)
+    test = models.ForeignKey(Test, related_name='interface_stats')
+    label = models.CharField(max_length=255)
+    interface = models.CharField(max_length=64)
+    num_tests = models.PositiveIntegerField(default=0)
+    mean_calls = models.PositiveIntegerField(default=0)
+    mean_duration = models.FloatField(default=0.0)
+    lower_duration = models.FloatField(default=0.0)
+    upper_duration = models.FloatField(default=0.0)
+    upper50_duration = models.FloatField(default=0.0)
+    upper90_duration = models.FloatField(default=0.0)
+    upper95_duration = models.FloatField(default=0.0)
+    upper99_duration = models.FloatField(default=0.0)
+    stddev_duration = models.FloatField(default=0.0)
+
+    class Meta:
+        unique_together = (('test', 'interface'),)
+
+    def __unicode__(self):
+        return u'%s (%s)' % (self.label, self.interface)
+
+    # Keys of a test's ``data[interface]`` which are stored as columns
+    FIELDS = ('num_tests', 'mean_calls', 'mean_duration', 'lower_duration', 'upper_duration',
+              'upper50_duration', 'upper90_duration', 'upper95_duration', 'upper99_duration',
+              'stddev_duration')
+
+    @classmethod
+    def from_data(cls, interface, data, **kwargs):
+        """
+        Returns an (unsaved) row for the given ``data[interface]`` of a test.
+        """
+        attrs = dict((k, data[k]) for k in cls.FIELDS if data.get(k) is not None)
+        # a leaf is the only test it summarizes
+        attrs.setdefault('num_tests', 1)
+        attrs.update(kwargs)
+        return cls(interface=interface, **attrs)
+
+    @classmethod
+    def get_changed_calls(cls, project, build_ids, previous_build_id, labels, interfaces):
+        """
+        Returns a mapping of (label, interface) to (current, previous) number
+        of calls, for each of the given tests whose calls to an interface
+        differ between any of ``build_ids`` and the previous build.
+        """
+        qn = connection.ops.quote_name
+        sql = '''
+            SELECT %(label)s, %(interface)s,
+                SUM(CASE WHEN %(build)s = %%s THEN 0 ELSE %(calls)s END),
+                SUM(CASE WHEN %(build)s = %%s THEN %(calls)s ELSE 0 END)
+            FROM %(table)s
+            WHERE %(project)s = %%s
+                AND %(label)s IN (%(labels)s)
+                AND %(interface)s IN (%(interfaces)s)
+                AND %(build)s IN (%(builds)s)
+            GROUP BY %(label)s, %(interface)s
+            HAVING SUM(CASE WHEN %(build)s = %%s THEN -%(calls)s ELSE %(calls)s END) <> 0
+        '''
+
+        build_ids = list(build_ids) + [previous_build_id]
+        interfaces = list(interfaces)
+        if not (labels and interfaces):
+            return {}
+        project_id = getattr(project, 'id', project)
+
+        results = {}
+        cursor = connection.cursor()
+        for offset in xrange(0, len(labels), 500):
+            chunk = list(labels[offset:offset + 500])
+            cursor.execute(sql % {
+                'table': qn(cls._meta.db_table),
+                'project': qn('project_id'),
+                'build': qn('build_id'),
+                'label': qn('label'),
+                'interface': qn('interface'),
+                'calls': qn('mean_calls'),
+                'labels': ', '.join(['%s'] * len(chunk)),
+                'interfaces': ', '.join(['%s'] * len(interfaces)),
+                'builds': ', '.join(['%s'] * len(build_ids)),
+            }, [previous_build_id, previous_build_id, project_id] + chunk + interfaces
+               + build_ids + [previous_build_id])
+            for label, interface, current, previous in cursor.fetchall():
+                results[(label, interface)] = (int(current), int(previous))
+        return results
+
+
+class TestSeries(models.Model):
+    """
+    The headline numbers of a test, keyed by its label and the position of
+    its build on the lineage (see ``zumanji.lineage``), so a test's history
+    can be read without going through ``Test``.
+    """
+    project = models.ForeignKey(Project)
+    label = models.CharField(max_length=255)
+    build = models.ForeignKey(Build)
+    test = models.OneToOneField(Test, related_name='series')
+    # copied from Build.position
+    position = models.PositiveIntegerField(default=0)
+    num_tests = models.PositiveIntegerField(default=0)
+    mean_duration = models.FloatField(default=0.0)
+    upper90_duration = models.FloatField(default=0.0)
+    result = models.CharField(max_length=16, choices=RESULT_CHOICES, null=True)
+    # {interface: mean_calls}
+    calls = GzippedJSONField(default={}, blank=True)
+
+    class Meta:
+        # also indexed on (project, label, position)
+        unique_together = (('build', 'label'),)
+
+    def __unicode__(self):
+        return u'%s (%s)' % (self.label, self.build_id)
+
+    @classmethod
+    def from_attrs(cls, attrs, **kwargs):
+        """
+        Returns an (unsaved) row for a test with the given attributes.
+        """
+        return cls(
+            num_tests=attrs.get('num_tests') or 0,
+            mean_duration=attrs.get('mean_duration') or 0.0,
+            upper90_duration=attrs.get('upper90_duration') or 0.0,
+            result=attrs.get('result'),
+            calls=dict((i, d.get('mean_calls', 0)) for i, d in attrs.get('data', {}).iteritems()
+                       if isinstance(d, dict)),
+            **kwargs
+        )
+
 
 class TestData(models.Model):
     project = models.ForeignKey(Project)
@@ -350,12 +725,287 @@ class TestData(models.Model):
     test = models.ForeignKey(Test)
     key = models.CharField(max_length=32)
     data = GzippedJSONField(default={}, blank=True)
+    # traces are stored here (see ``zumanji.trace``) rather than in data
+    blob = BlobField(null=True)
+    # or, with a blob store configured, stored there by their checksum
+    blob_checksum = models.CharField(max_length=40, null=True, db_index=True)
+    blob_length = models.PositiveIntegerField(null=True)
 
     class Meta:
         unique_together = (('test', 'key'),)
 
+    @property
+    def trace(self):
+        """
+        Returns the stored trace as a ``Trace``.
+        """
+        if self.blob_checksum is not None:
+            return Trace(get_blob_store().open(self.blob_checksum),
+                get_dictionary=CompressionDictionary.get_data)
+        if self.blob is not None:
+            return Trace(self.blob, get_dictionary=CompressionDictionary.get_data)
+        # Older rows store a list of calls (see ``migrate_traces``)
+        return Trace.from_calls(self.data or [])
+
     def save(self, *args, **kwargs):
         self.build = self.test.build
         self.revision = self.build.revision
         self.project = self.revision.project
         super(TestData, self).save(*args, **kwargs)
+
+
+class CallSignature(models.Model):
+    """
+    The parts of a call which are identical every time it is made, keyed by
+    the hash of its exact command (its ``sig``). Traces refer to these
+    rather than repeating them.
+    """
+    project = models.ForeignKey(Project)
+    checksum = models.CharField(max_length=32)
+    # the id shared by every call with the same fingerprint
+    call_id = models.CharField(max_length=32, null=True)
+    interface = models.CharField(max_length=64)
+    command = models.TextField()
+    fingerprint = models.TextField(null=True)
+    filename = models.TextField(null=True)
+    function = models.TextField(null=True)
+
+    class Meta:
+        unique_together = (('project', 'checksum'),)
+
+    def __unicode__(self):
+        return self.checksum
+
+    # Fields of a call which are stored on its signature rather than in the trace
+    FIELDS = ('interface', 'command', 'fingerprint', 'filename', 'function')
+
+    @classmethod
+    def split_call(cls, call):
+        """
+        Splits a call into (signature, call), where the call only retains
+        what varies between each time it was made.
+        """
+        signature = dict((k, call[k]) for k in cls.FIELDS)
+        signature['call_id'] = call['id']
+
+        call = dict((k, v) for k, v in call.iteritems() if k not in cls.FIELDS and k != 'id')
+        return signature, call
+
+    @classmethod
+    def get_call_ids(cls, project, checksums):
+        """
+        Returns a mapping of each signature's checksum to the id of its
+        call.
+        """
+        checksums = set(checksums)
+        checksums.discard(None)
+        checksums = list(checksums)
+
+        results = {}
+        for offset in xrange(0, len(checksums), 500):
+            results.update(
+                (checksum, call_id or checksum)
+                for checksum, call_id in cls.objects.filter(
+                    project=project,
+                    checksum__in=checksums[offset:offset + 500],
+                ).values_list('checksum', 'call_id')
+            )
+        return results
+
+    @classmethod
+    def expand_traces(cls, project, *traces):
+        """
+        Restores the full calls of each trace, in place.
+        """
+        # Older traces refer to their signature by id
+        checksums = set(c.get('sig', c.get('id')) for t in traces for c in t if 'command' not in c)
+        if not checksums:
+            return
+
+        signatures = dict(
+            (s['checksum'], s)
+            for s in cls.objects.filter(
+                project=project,
+                checksum__in=checksums,
+            ).values('checksum', 'call_id', *cls.FIELDS)
+        )
+        for trace in traces:
+            for call in trace:
+                if 'command' in call:
+                    continue
+                checksum = call.get('sig', call.get('id'))
+                signature = signatures.get(checksum, {})
+                for key in cls.FIELDS:
+                    call[key] = signature.get(key)
+                call['id'] = signature.get('call_id') or checksum
+                if call['fingerprint'] is None:
+                    call['fingerprint'] = call['command']
+
+
+class CallSite(models.Model):
+    """
+    The calls made to an interface from a single line of code, by a single
+    leaf test or (when ``test`` is null) by every test in the build.
+    """
+    project = models.ForeignKey(Project)
+    build = models.ForeignKey(Build)
+    test = models.ForeignKey(Test, null=True)
+    interface = models.CharField(max_length=64)
+    filename = models.TextField(null=True)
+    function = models.TextField(null=True)
+    lineno = models.PositiveIntegerField(null=True)
+    num_calls = models.PositiveIntegerField(default=0)
+    total_duration = models.FloatField(default=0.0)
+    num_tests = models.PositiveIntegerField(default=0)
+
+    def __unicode__(self):
+        return u'%s:%s' % (self.filename, self.lineno)
+
+
+class CallModule(models.Model):
+    """
+    The calls made to an interface from a single file, by every test in the
+    build.
+    """
+    project = models.ForeignKey(Project)
+    build = models.ForeignKey(Build)
+    interface = models.CharField(max_length=64)
+    filename = models.TextField(null=True)
+    num_calls = models.PositiveIntegerField(default=0)
+    total_duration = models.FloatField(default=0.0)
+    num_tests = models.PositiveIntegerField(default=0)
+
+    def __unicode__(self):
+        return self.filename or u''
+
+
+class StackFrame(models.Model):
+    """
+    A frame of a stacktrace captured in a build. Traces refer to each frame
+    by its checksum rather than repeating it for every call.
+    """
+    build = models.ForeignKey(Build)
+    checksum = models.CharField(max_length=32)
+    data = GzippedJSONField(default={}, blank=True)
+
+    class Meta:
+        unique_together = (('build', 'checksum'),)
+
+    def __unicode__(self):
+        return self.checksum
+
+    @classmethod
+    def expand_stacks(cls, build, calls):
+        """
+        Restores the frames of each call's stacktrace, in place.
+        """
+        # Older traces store their frames in full
+        checksums = set(f for c in calls for f in c.get('stacktrace') or () if isinstance(f, basestring))
+        if not checksums:
+            return
+
+        frames = dict(
+            (f.checksum, f.data)
+            for f in cls.objects.filter(
+                build=build,
+                checksum__in=checksums,
+            )
+        )
+        for call in calls:
+            if not call.get('stacktrace'):
+                continue
+            call['stacktrace'] = [
+                frames.get(f, {}) if isinstance(f, basestring) else f
+                for f in call['stacktrace']
+            ]
+
+
+class CompressionDictionary(models.Model):
+    """
+    A dictionary trained from a project's traces, which they can be
+    compressed against (see ``zumanji.compression``).
+    """
+    project = models.ForeignKey(Project)
+    codec = models.CharField(max_length=16)
+    data = BlobField()
+    date_created = models.DateTimeField(default=datetime.now)
+
+    # Dictionaries never change once they're created
+    _cache = {}
+
+    def __unicode__(self):
+        return u'%s (%s)' % (self.codec, self.date_created)
+
+    @classmethod
+    def get_data(cls, dictionary_id):
+        if dictionary_id not in cls._cache:
+            cls._cache[dictionary_id] = cls.objects.get(id=dictionary_id).data
+        return cls._cache[dictionary_id]
+
+    @classmethod
+    def get_latest(cls, project, codec):
+        """
+        Returns the (id, data) of the project's latest dictionary for the
+        codec, or None if it has none.
+        """
+        if not compression.get_codec(codec).supports_dictionaries:
+            return None
+
+        try:
+            dictionary = cls.objects.filter(project=project, codec=codec).order_by('-id')[0]
+        except IndexError:
+            return None
+        cls._cache[dictionary.id] = dictionary.data
+        return dictionary.id, dictionary.data
+
+
+class ImportJob(models.Model):
+    """
+    An uploaded build which is waiting to be (or has been) imported by
+    ``process_import_jobs``.
+    """
+    project = models.ForeignKey(Project)
+    revision_label = models.CharField(max_length=64, null=True)
+    payload = models.FileField(upload_to='zumanji/jobs/%Y/%m/%d', max_length=255)
+    status = models.CharField(max_length=16, choices=JOB_STATUS_CHOICES, default='queued', db_index=True)
+    build = models.ForeignKey(Build, null=True)
+    error = models.TextField(null=True)
+    date_created = models.DateTimeField(default=datetime.now)
+    date_started = models.DateTimeField(null=True)
+    date_finished = models.DateTimeField(null=True)
+
+    def __unicode__(self):
+        return unicode(self.id)
+
+    @classmethod
+    def claim_next(cls):
+        """
+        Marks the oldest queued job as running and returns it, or returns
+        None if there is nothing left to do. Safe to call from several
+        workers at once.
+
+        Jobs which have been running for longer than
+        ``ZUMANJI_CONFIG['IMPORT_JOB_TIMEOUT']`` seconds are assumed to
+        have lost their worker, and are queued again first.
+        """
+        timeout = getattr(settings, 'ZUMANJI_CONFIG', {}).get('IMPORT_JOB_TIMEOUT', IMPORT_JOB_TIMEOUT)
+        cls.objects.filter(
+            status='running',
+            date_started__lt=datetime.now() - timedelta(seconds=timeout),
+        ).update(status='queued', date_started=None)
+
+        while True:
+            try:
+                job = cls.objects.filter(status='queued').order_by('id')[0]
+            except IndexError:
+                return None
+
+            now = datetime.now()
+            claimed = cls.objects.filter(id=job.id, status='queued').update(
+                status='running',
+                date_started=now,
+            )
+            if claimed:
+                job.status = 'running'
+                job.date_started = now
+                return job
@@ -0,0 +1,135 @@
+"""
+Caching of build (and test) pages.
+
+Once imported, a build's pages only change when it (or a build near it on
+its lineage) is imported again, which is recorded in ``Build.date_modified``
+(see ``Build.touch``). A page is cached under its path and query along with
+the ``date_modified`` of its build (and of the build it's compared with),
+so re-importing a build simply moves its pages to new keys, and nothing
+else has to be invalidated.
+
+The same key serves as the page's ETag, so a browser which already has the
+page gets a 304 for the price of a single query.
+
+With ``ZUMANJI_CONFIG['PREWARM_PAGES']`` set, the pages of a build and of
+its top-level tests are rendered as soon as it has been imported.
+"""
+__all__ = ('cache_build_page', 'prewarm_build', 'is_prewarm_enabled')
+
+import hashlib
+from calendar import timegm
+from django.conf import settings
+from django.core.cache import cache
+from django.core.urlresolvers import resolve, reverse
+from django.http import HttpResponse, HttpResponseNotModified
+from django.test.client import RequestFactory
+from django.utils.http import http_date, parse_etags, quote_etag
+from functools import wraps
+from zumanji.models import Build
+
+# Seconds to keep a rendered page for
+DEFAULT_TIMEOUT = 24 * 3600
+
+
+def get_config(key, default=None):
+    return getattr(settings, 'ZUMANJI_CONFIG', {}).get(key, default)
+
+
+def is_prewarm_enabled():
+    return bool(get_config('PREWARM_PAGES'))
+
+
+def get_versions(project_label, build_id, compare_with=None):
+    """
+    Returns the ``date_modified`` of the build and of the build it's
+    compared with (or None), or None if either doesn't exist (or has never
+    been marked).
+    """
+    build_ids = [int(build_id)]
+    if compare_with:
+        try:
+            build_ids.append(int(compare_with))
+        except ValueError:
+            return None
+
+    versions = dict(Build.objects.filter(
+        project__label=project_label,
+        id__in=build_ids,
+    ).values_list('id', 'date_modified'))
+
+    results = [versions.get(b) for b in build_ids]
+    if None in results:
+        return None
+    return results
+
+
+def get_page_key(request, versions):
+    query = sorted((k, v) for k in request.GET for v in request.GET.getlist(k))
+    return hashlib.sha1(repr((request.path, query, [v.isoformat() for v in versions]))).hexdigest()
+
+
+def is_not_modified(request, etag):
+    # If-Modified-Since is ignored: a page can change more than once within
+    # the (whole) second it carries, which only the ETag tells apart
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+    return bool(if_none_match) and etag in parse_etags(if_none_match)
+
+
+def cache_build_page(view):
+    """
+    Caches the (successful) responses of a view which takes the project
+    label and build id, and answers conditional requests for them.
+    """
+    @wraps(view)
+    def wrapped(request, project_label, build_id, *args, **kwargs):
+        if request.method not in ('GET', 'HEAD'):
+            return view(request, project_label, build_id, *args, **kwargs)
+
+        versions = get_versions(project_label, build_id, request.GET.get('compare_with'))
+        if versions is None:
+            return view(request, project_label, build_id, *args, **kwargs)
+
+        key = get_page_key(request, versions)
+        last_modified = timegm(max(versions).utctimetuple())
+        if is_not_modified(request, key):
+            response = HttpResponseNotModified()
+        else:
+            timeout = get_config('PAGE_CACHE_TIMEOUT', DEFAULT_TIMEOUT)
+            content = cache.get('zumanji:page:%s' % key) if timeout else None
+            if content is None:
+                response = view(request, project_label, build_id, *args, **kwargs)
+                if response.status_code != 200:
+                    return response
+                if timeout:
+                    cache.set('zumanji:page:%s' % key, response.content, timeout)
+            else:
+                response = HttpResponse(content)
+
+        response['ETag'] = quote_etag(key)
+        response['Last-Modified'] = http_date(last_modified)
+        return response
+    return wrapped
+
+
+def prewarm_build(build):
+    """
+    Renders the page of the build, and those of its top-level tests, into
+    the cache. Returns the number of pages rendered.
+    """
+    project_label = build.project.label
+    paths = [reverse('zumanji:view_build', kwargs={
+        'project_label': project_label,
+        'build_id': build.id,
+    })]
+    for label in build.test_set.filter(parent__isnull=True).values_list('label', flat=True):
+        paths.append(reverse('zumanji:view_test', kwargs={
+            'project_label': project_label,
+            'build_id': build.id,
+            'test_label': label,
+        }))
+
+    factory = RequestFactory()
+    for path in paths:
+        match = resolve(path)
+        match.func(factory.get(path), *match.args, **match.kwargs)
+    return len(paths)
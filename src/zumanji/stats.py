@@ -0,0 +1,413 @@
+"""
+Rollups of leaf results into their branches.
+
+Leaves are stored column-wise and ordered by label, which places every leaf
+beneath a given branch in one contiguous range. Totals for any branch are
+then a difference of two prefix sums, and distributions only need to look
+at that branch's slice. NumPy is used when it is installed.
+"""
+__all__ = ('LeafTable', 'RunningStats', 'get_margin', 'percentile')
+
+import math
+from bisect import bisect_left
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Percentiles reported for every branch (and interface) as upper<N>_duration
+PERCENTILES = (50, 90, 95, 99)
+
+# Two-sided 95% critical values of Student's t distribution, by degrees of
+# freedom; beyond the table the normal approximation is close enough
+T_CRITICAL_95 = (
+    12.706, 4.303, 3.182, 2.776, 2.571, 2.447, 2.365, 2.306, 2.262, 2.228,
+    2.201, 2.179, 2.160, 2.145, 2.131, 2.120, 2.110, 2.101, 2.093, 2.086,
+    2.080, 2.074, 2.069, 2.064, 2.060, 2.056, 2.052, 2.048, 2.045, 2.042,
+)
+Z_CRITICAL_95 = 1.960
+
+
+def percentile(values, pct):
+    """
+    Returns the given percentile of a sorted list, interpolating linearly
+    between the closest ranks.
+    """
+    if not values:
+        return 0.0
+
+    rank = (len(values) - 1) * (pct / 100.0)
+    lower = int(rank)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (rank - lower)
+
+
+def get_margin(stderr, num_samples):
+    """
+    Returns the half-width of the 95% confidence interval of a mean with the
+    given standard error, or 0.0 if it was only sampled once.
+    """
+    if num_samples < 2:
+        return 0.0
+    if num_samples - 1 <= len(T_CRITICAL_95):
+        return T_CRITICAL_95[num_samples - 2] * stderr
+    return Z_CRITICAL_95 * stderr
+
+
+class RunningStats(object):
+    """
+    The mean, variance and extremes of a series of samples, updated one
+    sample at a time using Welford's method.
+
+    Two series can be combined with ``merge``, which is how the results of
+    separate runs of a test accumulate.
+    """
+    __slots__ = ('count', 'mean', 'm2', 'lower', 'upper')
+
+    def __init__(self, count=0, mean=0.0, m2=0.0, lower=None, upper=None):
+        self.count = count
+        self.mean = mean
+        # sum of squared differences from the mean
+        self.m2 = m2
+        self.lower = lower
+        self.upper = upper
+
+    @classmethod
+    def from_attrs(cls, attrs):
+        """
+        Restores the series summarized by ``get_attrs``.
+        """
+        count = attrs['num_samples']
+        return cls(
+            count=count,
+            mean=attrs['mean_duration'],
+            m2=attrs['stddev_duration'] ** 2 * (count - 1),
+            lower=attrs['lower_duration'],
+            upper=attrs['upper_duration'],
+        )
+
+    def add(self, value):
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+        self.lower = value if self.lower is None else min(self.lower, value)
+        self.upper = value if self.upper is None else max(self.upper, value)
+
+    def merge(self, other):
+        if not other.count:
+            return
+        if not self.count:
+            self.count, self.mean, self.m2 = other.count, other.mean, other.m2
+            self.lower, self.upper = other.lower, other.upper
+            return
+
+        count = self.count + other.count
+        delta = other.mean - self.mean
+        self.mean += delta * other.count / count
+        self.m2 += other.m2 + delta ** 2 * self.count * other.count / count
+        self.count = count
+        self.lower = min(self.lower, other.lower)
+        self.upper = max(self.upper, other.upper)
+
+    @property
+    def variance(self):
+        if self.count < 2:
+            return 0.0
+        return self.m2 / (self.count - 1)
+
+    @property
+    def stddev(self):
+        return math.sqrt(self.variance)
+
+    @property
+    def stderr(self):
+        if not self.count:
+            return 0.0
+        return self.stddev / math.sqrt(self.count)
+
+    def get_attrs(self):
+        """
+        Returns the ``Test`` attributes of a leaf whose runs took these
+        durations.
+        """
+        attrs = {
+            'num_samples': self.count,
+            'mean_duration': self.mean,
+            'lower_duration': self.lower,
+            'upper_duration': self.upper,
+            'stddev_duration': self.stddev,
+            'stderr_duration': self.stderr,
+        }
+        # only the moments of the runs are kept, so there is no distribution to rank
+        for pct in PERCENTILES:
+            attrs['upper%d_duration' % pct] = self.mean
+        return attrs
+
+
+def prefix_sums(values):
+    result = [0]
+    total = 0
+    for value in values:
+        total += value
+        result.append(total)
+    return result
+
+
+def describe(values):
+    """
+    Summarizes a sorted list of durations.
+    """
+    num = len(values)
+    total = sum(values)
+    mean = total / num
+    variance = sum((v - mean) ** 2 for v in values) / num
+
+    result = {
+        'lower_duration': values[0],
+        'upper_duration': values[-1],
+        'stddev_duration': math.sqrt(variance),
+    }
+    for pct in PERCENTILES:
+        result['upper%d_duration' % pct] = percentile(values, pct)
+    return result
+
+
+def describe_segments(values, segments, num_segments):
+    """
+    Summarizes many groups of durations at once, returning a dict of arrays
+    with one entry per group.
+
+    ``values`` must be ordered by group, and ``segments`` gives the group
+    of each value.
+    """
+    counts = numpy.bincount(segments, minlength=num_segments)
+    if not len(values):
+        zeros = numpy.zeros(num_segments)
+        result = dict((k, zeros) for k in ('lower_duration', 'upper_duration', 'stddev_duration'))
+        result.update(('upper%d_duration' % pct, zeros) for pct in PERCENTILES)
+        return result, counts, zeros
+
+    offsets = numpy.concatenate(([0], numpy.cumsum(counts)[:-1]))
+    # avoid dividing by (or indexing with) empty groups; they're discarded by the caller
+    sizes = numpy.maximum(counts, 1)
+
+    # sort each group in place, all in a single pass
+    values = values[numpy.lexsort((values, segments))]
+
+    totals = numpy.bincount(segments, weights=values, minlength=num_segments)
+    means = totals / sizes
+    variances = numpy.bincount(segments, weights=(values - means[segments]) ** 2,
+        minlength=num_segments) / sizes
+
+    last = numpy.minimum(offsets + sizes - 1, len(values) - 1)
+    result = {
+        'lower_duration': values[numpy.minimum(offsets, len(values) - 1)],
+        'upper_duration': values[last],
+        'stddev_duration': numpy.sqrt(variances),
+    }
+    for pct in PERCENTILES:
+        rank = (sizes - 1) * (pct / 100.0)
+        lower = numpy.floor(rank).astype(int)
+        upper = numpy.minimum(lower + 1, sizes - 1)
+        low_values = values[numpy.minimum(offsets + lower, last)]
+        high_values = values[numpy.minimum(offsets + upper, last)]
+        result['upper%d_duration' % pct] = low_values + (high_values - low_values) * (rank - lower)
+
+    return result, counts, totals
+
+
+class LeafTable(object):
+    """
+    Column-wise metrics for every leaf of a build.
+
+    ``leaves`` is an iterable of (label, attrs), where ``attrs`` are the
+    leaf's ``Test`` attributes. Unless ``ordered`` is set they are sorted
+    by label, so that branches can be found by their label; otherwise the
+    caller must already know the range of leaves beneath each branch.
+    """
+    def __init__(self, leaves, ordered=False):
+        if ordered:
+            leaves = list(leaves)
+        else:
+            leaves = sorted(leaves, key=lambda x: x[0])
+
+        self.labels = [label for label, _ in leaves]
+        self.interfaces = sorted(set(i for _, a in leaves for i in a['data']))
+
+        durations = [a['mean_duration'] for _, a in leaves]
+        # the uncertainty of each leaf's mean, which add up across a branch
+        variances = [a.get('stderr_duration', 0.0) ** 2 for _, a in leaves]
+        num_samples = [a.get('num_samples', 1) for _, a in leaves]
+        # per interface: whether each leaf made any calls, how many, and how long they took
+        present = dict((i, [i in a['data'] for _, a in leaves]) for i in self.interfaces)
+        calls = dict((i, [a['data'].get(i, {}).get('mean_calls', 0) for _, a in leaves])
+            for i in self.interfaces)
+        interface_durations = dict((i, [a['data'].get(i, {}).get('mean_duration', 0.0) for _, a in leaves])
+            for i in self.interfaces)
+
+        if numpy is not None:
+            self.durations = numpy.array(durations, dtype=float)
+            self.num_samples = numpy.array(num_samples, dtype=int)
+            self.calls = dict((i, numpy.array(v, dtype=int)) for i, v in calls.iteritems())
+            self.present = dict((i, numpy.array(v, dtype=bool)) for i, v in present.iteritems())
+            self.interface_durations = dict((i, numpy.array(v, dtype=float))
+                for i, v in interface_durations.iteritems())
+
+            def cumsum(values):
+                return numpy.concatenate(([0], numpy.cumsum(values)))
+        else:
+            self.durations = durations
+            self.num_samples = num_samples
+            self.present = present
+            self.interface_durations = interface_durations
+            cumsum = prefix_sums
+
+        self.duration_sums = cumsum(durations)
+        self.variance_sums = cumsum(variances)
+        self.present_sums = dict((i, cumsum(v)) for i, v in present.iteritems())
+        self.call_sums = dict((i, cumsum(v)) for i, v in calls.iteritems())
+        self.interface_duration_sums = dict((i, cumsum(v))
+            for i, v in interface_durations.iteritems())
+
+    def __len__(self):
+        return len(self.labels)
+
+    def get_range(self, label):
+        """
+        Returns the (start, end) of the leaves beneath ``label``.
+        """
+        # '/' immediately follows '.', so this spans every label starting with "label."
+        return (bisect_left(self.labels, label + '.'),
+                bisect_left(self.labels, label + '/'))
+
+    def get_durations(self, start, end, interface=None):
+        if interface is None:
+            values = self.durations[start:end]
+        else:
+            values = [d for d, p in zip(self.interface_durations[interface][start:end],
+                                        self.present[interface][start:end]) if p]
+
+        return describe(sorted(values)) if len(values) else None
+
+    def rollup(self, label):
+        """
+        Returns the ``Test`` attributes of the branch ``label``, aggregated
+        from the leaves beneath it.
+        """
+        return self.rollup_range(*self.get_range(label))
+
+    def rollup_range(self, start, end):
+        if start == end:
+            return {}
+
+        result = self.get_durations(start, end)
+        result['num_tests'] = end - start
+        result['mean_duration'] = float(self.duration_sums[end] - self.duration_sums[start])
+        result['stderr_duration'] = math.sqrt(max(self.variance_sums[end] - self.variance_sums[start], 0.0))
+        result['num_samples'] = int(min(self.num_samples[start:end]))
+
+        data = {}
+        for interface in self.interfaces:
+            num_tests = int(self.present_sums[interface][end] - self.present_sums[interface][start])
+            if not num_tests:
+                continue
+
+            data[interface] = self.get_durations(start, end, interface)
+            data[interface].update({
+                'num_tests': num_tests,
+                'mean_calls': int(self.call_sums[interface][end] - self.call_sums[interface][start]),
+                'mean_duration': float(self.interface_duration_sums[interface][end]
+                                       - self.interface_duration_sums[interface][start]),
+            })
+        result['data'] = data
+
+        return result
+
+    def rollup_all(self, labels):
+        """
+        Returns a mapping of each branch in ``labels`` to its ``Test``
+        attributes, as ``rollup`` would.
+        """
+        return self.rollup_ranges([(label,) + self.get_range(label) for label in labels])
+
+    def rollup_ranges(self, ranges):
+        """
+        Returns a mapping of each label to its ``Test`` attributes, given a
+        list of (label, start, end) for each branch.
+        """
+        if numpy is None:
+            return dict((label, self.rollup_range(start, end)) for label, start, end in ranges)
+
+        # Branches at the same depth can't contain one another, so the
+        # leaves beneath each of them never overlap
+        levels = {}
+        for branch in ranges:
+            levels.setdefault(branch[0].count('.'), []).append(branch)
+
+        results = {}
+        for level_ranges in levels.itervalues():
+            results.update(self.rollup_level(level_ranges))
+        return results
+
+    def rollup_level(self, ranges):
+        labels = [label for label, _, _ in ranges]
+        ranges = numpy.array([(start, end) for _, start, end in ranges], dtype=int).reshape(-1, 2)
+        counts = ranges[:, 1] - ranges[:, 0]
+
+        # the index of every leaf within each branch, and the branch it belongs to
+        segments = numpy.repeat(numpy.arange(len(labels)), counts)
+        positions = (numpy.repeat(ranges[:, 0] - numpy.concatenate(([0], numpy.cumsum(counts)[:-1])), counts)
+                     + numpy.arange(counts.sum()))
+
+        if not len(positions):
+            return dict((label, {}) for label in labels)
+
+        stats, _, totals = describe_segments(self.durations[positions], segments, len(labels))
+        stats['stderr_duration'] = numpy.sqrt(numpy.maximum(
+            self.variance_sums[ranges[:, 1]] - self.variance_sums[ranges[:, 0]], 0.0))
+        # (empty branches are discarded below)
+        nonempty = counts > 0
+        num_samples = numpy.zeros(len(labels), dtype=int)
+        num_samples[nonempty] = numpy.minimum.reduceat(self.num_samples[positions],
+            numpy.concatenate(([0], numpy.cumsum(counts)[:-1]))[nonempty])
+
+        interface_stats = {}
+        for interface in self.interfaces:
+            mask = self.present[interface][positions]
+            interface_segments = segments[mask]
+            interface_positions = positions[mask]
+            interface_stats[interface] = describe_segments(
+                self.interface_durations[interface][interface_positions],
+                interface_segments, len(labels)) + (
+                numpy.bincount(interface_segments,
+                    weights=self.calls[interface][interface_positions],
+                    minlength=len(labels)),
+            )
+
+        results = {}
+        for index, label in enumerate(labels):
+            if not counts[index]:
+                results[label] = {}
+                continue
+
+            result = dict((k, float(v[index])) for k, v in stats.iteritems())
+            result['num_tests'] = int(counts[index])
+            result['num_samples'] = int(num_samples[index])
+            result['mean_duration'] = float(totals[index])
+
+            data = {}
+            for interface, (i_stats, i_counts, i_totals, i_calls) in interface_stats.iteritems():
+                if not i_counts[index]:
+                    continue
+                data[interface] = dict((k, float(v[index])) for k, v in i_stats.iteritems())
+                data[interface].update({
+                    'num_tests': int(i_counts[index]),
+                    'mean_calls': int(i_calls[index]),
+                    'mean_duration': float(i_totals[index]),
+                })
+            result['data'] = data
+            results[label] = result
+
+        return results
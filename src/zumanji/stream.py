@@ -0,0 +1,201 @@
+"""
+Incremental reading of build payloads.
+
+A payload is a single JSON object, of which ``tests`` is (by far) the
+largest member. ``BuildPayload`` reads every other member up front, and
+then parses the entries of ``tests`` one at a time each time they are
+iterated, so that only a single test is ever held in memory.
+"""
+__all__ = ('BuildPayload', 'PayloadHasher', 'checksum_payload')
+
+import hashlib
+from django.utils import simplejson
+
+CHUNK_SIZE = 64 * 1024
+
+WHITESPACE = ' \t\n\r'
+
+
+class JSONReader(object):
+    """
+    Decodes consecutive JSON values from a file object, reading more of the
+    file only as needed.
+    """
+    def __init__(self, fp, offset=0, chunk_size=None):
+        self.fp = fp
+        self.fp.seek(offset)
+        self.chunk_size = chunk_size or CHUNK_SIZE
+        self.decoder = simplejson.JSONDecoder()
+        self.buffer = ''
+        self.pos = 0
+        # absolute offset of buffer[0] within the file
+        self.base = offset
+        self.eof = False
+
+    @property
+    def offset(self):
+        return self.base + self.pos
+
+    def fill(self, size=None):
+        if self.eof:
+            return False
+
+        # drop whatever has already been consumed
+        if self.pos:
+            self.base += self.pos
+            self.buffer = self.buffer[self.pos:]
+            self.pos = 0
+
+        chunk = self.fp.read(max(size or 0, self.chunk_size))
+        if not chunk:
+            self.eof = True
+            return False
+        self.buffer += chunk
+        return True
+
+    def peek(self):
+        """
+        Returns the next non-whitespace character without consuming it.
+        """
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self.fill():
+                raise ValueError('Unexpected end of JSON data at offset %d' % self.offset)
+
+    def expect(self, chars):
+        char = self.peek()
+        if char not in chars:
+            raise ValueError('Expected one of %r at offset %d, got %r' % (chars, self.offset, char))
+        self.pos += 1
+        return char
+
+    def value(self):
+        """
+        Decodes and consumes the next value.
+        """
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+            except ValueError:
+                # most likely the value is only partially buffered
+                if not self.fill(len(self.buffer)):
+                    raise
+                continue
+
+            # a number which runs up to the end of the buffer may continue past it
+            if end == len(self.buffer) and self.fill():
+                continue
+
+            self.pos = end
+            return value
+
+    def iter_array(self):
+        """
+        Yields each member of the array starting at the current position.
+        """
+        self.expect('[')
+        if self.peek() == ']':
+            self.pos += 1
+            return
+
+        while True:
+            yield self.value()
+            if self.expect(',]') == ']':
+                return
+
+    def iter_object(self):
+        """
+        Yields the key of each member of the object starting at the current
+        position. The caller is expected to consume the member's value
+        before advancing.
+        """
+        self.expect('{')
+        if self.peek() == '}':
+            self.pos += 1
+            return
+
+        while True:
+            key = self.value()
+            self.expect(':')
+            yield key
+            if self.expect(',}') == '}':
+                return
+
+
+class PayloadHasher(object):
+    """
+    Hashes the content of a payload, however it was serialized: each of
+    its tests, and then its other members, as JSON with sorted keys. Tests
+    are added one at a time, so a payload is hashed as it's streamed.
+    """
+    def __init__(self):
+        self.tests = hashlib.sha1()
+
+    def add_test(self, test):
+        self.tests.update(simplejson.dumps(test, sort_keys=True))
+        self.tests.update('\n')
+
+    def hexdigest(self, members):
+        members = dict((k, v) for k, v in members.iteritems() if k != 'tests')
+        return hashlib.sha1(simplejson.dumps(members, sort_keys=True) + self.tests.hexdigest()).hexdigest()
+
+
+def checksum_payload(data):
+    """
+    Returns the checksum of a payload held in memory (see ``PayloadHasher``).
+    """
+    hasher = PayloadHasher()
+    for test in data.get('tests', ()):
+        hasher.add_test(test)
+    return hasher.hexdigest(data)
+
+
+class TestStream(object):
+    """
+    Iterates the entries of ``tests`` within a payload, reparsing them from
+    the file on every iteration.
+    """
+    def __init__(self, fp, offset):
+        self.fp = fp
+        self.offset = offset
+
+    def __iter__(self):
+        return JSONReader(self.fp, self.offset).iter_array()
+
+
+class BuildPayload(object):
+    """
+    A dict-like view of a build payload stored in a (seekable) file.
+
+    ``checksum`` is that of the payload's content (see ``PayloadHasher``),
+    the same as for the payload decoded in full.
+    """
+    def __init__(self, fp):
+        self.fp = fp
+        self.data = {}
+
+        hasher = PayloadHasher()
+        reader = JSONReader(fp)
+        for key in reader.iter_object():
+            if key == 'tests':
+                self.data[key] = TestStream(fp, reader.offset)
+                # hash the tests one at a time, so we never hold more than one
+                for test in reader.iter_array():
+                    hasher.add_test(test)
+            else:
+                self.data[key] = reader.value()
+
+        self.checksum = hasher.hexdigest(self.data)
+
+    def __getitem__(self, key):
+        return self.data[key]
+
+    def __contains__(self, key):
+        return key in self.data
+
+    def get(self, key, default=None):
+        return self.data.get(key, default)
@@ -79,14 +79,14 @@ def render_historical_sparkline(test):
 
 @register.inclusion_tag('zumanji/includes/test_row.html')
 def render_test_row(test):
-    data = test.data
+    stats = test.get_interface_stats()
     columns = []
     for column, _ in settings.ZUMANJI_CONFIG['call_types']:
-        result = data.get(column)
+        result = stats.get(column)
         if not result:
             columns.append(None)
         else:
-            columns.append((result.get('mean_duration'), result.get('mean_calls')))
+            columns.append((result.mean_duration, result.mean_calls))
 
     return {
         'test': test,
@@ -116,6 +116,7 @@ def render_change_row(change, compare_build):
     return {
         'test': test,
         'columns': columns,
+        'duration': data.get('duration'),
         'compare_build': compare_build,
     }
 
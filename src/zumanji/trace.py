@@ -0,0 +1,406 @@
+"""
+Compact binary encoding of test traces.
+
+A trace is stored column-wise rather than as a list of call dicts: one
+array per field (durations, start times, depths, and so on), with strings
+(signatures and arguments) and stack frames interned into tables which
+each call refers to by index. Anything a column can't represent exactly
+is kept alongside the call as JSON, so every trace survives a round trip
+(except that a call without a stacktrace comes back with an empty one).
+
+Consecutive calls tend to be made from (mostly) the same stack, so each
+stack only stores the frames it doesn't share with the stack before it:
+``stack_shared`` holds the number of outermost frames taken from the
+previous call's stack. Every ``STACK_RESTART`` calls the stack is stored
+in full, so that decoding any one stack only has to visit a handful of
+the calls before it.
+
+The encoded trace starts with a fixed header (which includes the number
+of calls), followed by the compressed sections (see ``zumanji.compression``;
+traces before version 3 are always zlib compressed). ``Trace`` only
+decodes a column (or an entry of a table) when it is first needed, and
+only builds the dicts of the calls which are actually accessed.
+"""
+__all__ = ('Trace', 'encode_trace')
+
+import array
+import math
+import mmap
+import struct
+import sys
+import zlib
+from datetime import datetime, timedelta
+from django.utils import simplejson
+from zumanji import compression
+
+MAGIC = 'ZTRC'
+VERSION = 3
+
+# magic, version, number of calls
+HEADER = struct.Struct('<4sBI')
+
+SECTION_LENGTH = struct.Struct('<I')
+
+# Each column holds one entry per call (except stack_offsets, which has an
+# extra entry so the frames of call N are stack_frames[offsets[N]:offsets[N + 1]])
+COLUMNS = (
+    ('sig', 'i'),
+    ('duration', 'd'),
+    ('time', 'd'),
+    ('depth', 'i'),
+    ('lineno', 'i'),
+    ('args', 'i'),
+    ('extra', 'i'),
+    ('stack_offsets', 'I'),
+    ('stack_frames', 'I'),
+    ('stack_shared', 'I'),
+)
+COLUMN_TYPES = dict(COLUMNS)
+
+TABLES = ('strings', 'frames')
+
+# The sections stored by each version, in order
+SECTIONS = {
+    1: tuple(name for name, _ in COLUMNS if name != 'stack_shared') + TABLES,
+    2: tuple(name for name, _ in COLUMNS) + TABLES,
+    3: tuple(name for name, _ in COLUMNS) + TABLES,
+}
+
+STACK_RESTART = 64
+
+# Stands in for a missing value in an integer column
+MISSING = -1
+
+EPOCH = datetime(1970, 1, 1)
+
+TIME_FORMATS = ('%Y-%m-%dT%H:%M:%S.%f', '%Y-%m-%dT%H:%M:%S')
+
+
+def dump_array(values):
+    if sys.byteorder != 'little':
+        values = array.array(values.typecode, values)
+        values.byteswap()
+    return values.tostring()
+
+
+def load_array(typecode, data):
+    values = array.array(typecode)
+    values.fromstring(data)
+    if sys.byteorder != 'little':
+        values.byteswap()
+    return values
+
+
+def dump_table(values):
+    """
+    Encodes a list of unicode strings, such that each can be decoded
+    without decoding the others.
+    """
+    values = [v.encode('utf-8') for v in values]
+    offsets = array.array('I', [0])
+    for value in values:
+        offsets.append(offsets[-1] + len(value))
+    return SECTION_LENGTH.pack(len(values)) + dump_array(offsets) + ''.join(values)
+
+
+class Table(object):
+    """
+    A decoded ``dump_table``.
+    """
+    def __init__(self, data):
+        count = SECTION_LENGTH.unpack_from(data)[0]
+        start = SECTION_LENGTH.size + (count + 1) * array.array('I').itemsize
+        self.offsets = load_array('I', data[SECTION_LENGTH.size:start])
+        self.data = data[start:]
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, index):
+        return self.data[self.offsets[index]:self.offsets[index + 1]].decode('utf-8')
+
+
+class Interner(object):
+    def __init__(self):
+        self.indexes = {}
+        self.values = []
+
+    def add(self, value):
+        index = self.indexes.get(value)
+        if index is None:
+            index = self.indexes[value] = len(self.values)
+            self.values.append(value)
+        return index
+
+
+def encode_time(value):
+    """
+    Returns the given ISO 8601 time as microseconds since the epoch, or
+    None if it would not decode to exactly the same string.
+    """
+    for time_format in TIME_FORMATS:
+        try:
+            dt = datetime.strptime(value, time_format)
+        except (TypeError, ValueError):
+            continue
+        delta = dt - EPOCH
+        result = float((delta.days * 86400 + delta.seconds) * 1000000 + delta.microseconds)
+        if decode_time(result) == value:
+            return result
+    return None
+
+
+def decode_time(value):
+    return (EPOCH + timedelta(microseconds=value)).isoformat()
+
+
+def dumps(value):
+    return simplejson.dumps(value, sort_keys=True)
+
+
+def get_shared_frames(stack, previous):
+    """
+    Returns the number of outermost (i.e. trailing) frames which both
+    stacks have in common.
+    """
+    limit = min(len(stack), len(previous))
+    shared = 0
+    while shared < limit and stack[-1 - shared] == previous[-1 - shared]:
+        shared += 1
+    return shared
+
+
+def encode_trace(calls, codec='zlib', dictionary=None):
+    """
+    Encodes a list of calls (as stored by the importer), compressed with
+    the given codec and (optional) dictionary of (id, data).
+    """
+    strings, frames = Interner(), Interner()
+    columns = dict((name, array.array(typecode)) for name, typecode in COLUMNS)
+    columns['stack_offsets'].append(0)
+
+    num_calls = 0
+    previous_stack = []
+    for call in calls:
+        num_calls += 1
+        # whatever isn't taken from the call is kept as is
+        extra = dict(call)
+
+        sig = extra.pop('sig', None)
+        if isinstance(sig, basestring):
+            columns['sig'].append(strings.add(unicode(sig)))
+        else:
+            columns['sig'].append(MISSING)
+            if sig is not None:
+                extra['sig'] = sig
+
+        duration = extra.pop('duration', None)
+        if isinstance(duration, (int, long, float)) and not isinstance(duration, bool):
+            columns['duration'].append(float(duration))
+        else:
+            columns['duration'].append(float('nan'))
+            if duration is not None:
+                extra['duration'] = duration
+
+        time = encode_time(extra.get('time'))
+        if time is not None:
+            del extra['time']
+            columns['time'].append(time)
+        else:
+            columns['time'].append(float('nan'))
+
+        for key in ('depth', 'lineno'):
+            value = extra.get(key)
+            if isinstance(value, (int, long)) and not isinstance(value, bool) and 0 <= value < 2 ** 31:
+                del extra[key]
+                columns[key].append(value)
+            else:
+                columns[key].append(MISSING)
+
+        if 'args' in extra:
+            columns['args'].append(strings.add(dumps(extra.pop('args'))))
+        else:
+            columns['args'].append(MISSING)
+
+        stacktrace = extra.pop('stacktrace', None)
+        if isinstance(stacktrace, list):
+            stack = [frames.add(dumps(frame)) for frame in stacktrace]
+        else:
+            stack = []
+            if stacktrace is not None:
+                extra['stacktrace'] = stacktrace
+
+        if num_calls % STACK_RESTART == 1:
+            shared = 0
+        else:
+            shared = get_shared_frames(stack, previous_stack)
+        columns['stack_shared'].append(shared)
+        columns['stack_frames'].extend(stack[:len(stack) - shared])
+        columns['stack_offsets'].append(len(columns['stack_frames']))
+        previous_stack = stack
+
+        columns['extra'].append(strings.add(dumps(extra)) if extra else MISSING)
+
+    sections = [dump_array(columns[name]) for name, _ in COLUMNS]
+    sections.append(dump_table(strings.values))
+    sections.append(dump_table(frames.values))
+
+    body = ''.join(SECTION_LENGTH.pack(len(s)) + s for s in sections)
+    return HEADER.pack(MAGIC, VERSION, num_calls) + compression.compress(body, codec, dictionary)
+
+
+class Trace(object):
+    """
+    A lazily decoded trace, which behaves as a (read-only) list of calls.
+
+    ``data`` may also be a (read-only) ``mmap``, which is decoded from in
+    place. ``get_dictionary`` returns the data of a compression dictionary
+    given its id, for traces which were compressed against one.
+    """
+    def __init__(self, data, get_dictionary=None):
+        if not isinstance(data, (str, mmap.mmap)):
+            data = str(data)
+        magic, version, self.num_calls = HEADER.unpack_from(data)
+        if magic != MAGIC:
+            raise ValueError('Not an encoded trace')
+        if version not in SECTIONS:
+            raise ValueError('Unsupported trace version: %r' % version)
+
+        self.data = data
+        self.version = version
+        self.get_dictionary = get_dictionary
+        self._sections = None
+        self._columns = {}
+        self._tables = {}
+        self._frames = {}
+        self._stacks = {}
+
+    @classmethod
+    def from_calls(cls, calls):
+        return cls(encode_trace(calls))
+
+    def __len__(self):
+        return self.num_calls
+
+    def __iter__(self):
+        for index in xrange(self.num_calls):
+            yield self.get_call(index)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self.get_call(i) for i in xrange(*index.indices(self.num_calls))]
+        if index < 0:
+            index += self.num_calls
+        if not 0 <= index < self.num_calls:
+            raise IndexError(index)
+        return self.get_call(index)
+
+    @property
+    def codec(self):
+        if self.version < 3:
+            return 'zlib'
+        return compression.get_header(self.data, HEADER.size)[0].name
+
+    @property
+    def dictionary_id(self):
+        if self.version < 3:
+            return None
+        return compression.get_header(self.data, HEADER.size)[1]
+
+    def get_body(self):
+        """
+        Returns the uncompressed sections.
+        """
+        if self.version < 3:
+            return zlib.decompress(buffer(self.data, HEADER.size))
+        return compression.decompress(self.data, self.get_dictionary, HEADER.size)
+
+    def get_section(self, name):
+        if self._sections is None:
+            body = self.get_body()
+            self._sections = {}
+            pos = 0
+            for section in SECTIONS[self.version]:
+                length = SECTION_LENGTH.unpack_from(body, pos)[0]
+                pos += SECTION_LENGTH.size
+                self._sections[section] = body[pos:pos + length]
+                pos += length
+        return self._sections[name]
+
+    def get_column(self, name):
+        if name not in self._columns:
+            if name not in SECTIONS[self.version]:
+                # stored by a later version; zero for every call
+                self._columns[name] = array.array(COLUMN_TYPES[name], [0]) * self.num_calls
+                return self._columns[name]
+            self._columns[name] = load_array(COLUMN_TYPES[name], self.get_section(name))
+        return self._columns[name]
+
+    def get_table(self, name):
+        if name not in self._tables:
+            self._tables[name] = Table(self.get_section(name))
+        return self._tables[name]
+
+    def get_sigs(self):
+        """
+        Returns the signature of each call (or None for calls stored in
+        full), without building any of the calls.
+        """
+        strings = self.get_table('strings')
+        return [strings[i] if i != MISSING else None for i in self.get_column('sig')]
+
+    def get_frame(self, index):
+        if index not in self._frames:
+            self._frames[index] = simplejson.loads(self.get_table('frames')[index])
+        return self._frames[index]
+
+    def get_stack(self, index):
+        """
+        Returns the indexes (within the frames table) of the call's frames.
+        """
+        if index in self._stacks:
+            return self._stacks[index]
+
+        offsets = self.get_column('stack_offsets')
+        stack = self.get_column('stack_frames')[offsets[index]:offsets[index + 1]].tolist()
+
+        shared = self.get_column('stack_shared')[index]
+        if shared:
+            previous = self.get_stack(index - 1)
+            stack.extend(previous[len(previous) - shared:])
+
+        self._stacks[index] = stack
+        return stack
+
+    def get_call(self, index):
+        strings = self.get_table('strings')
+        call = {}
+
+        sig = self.get_column('sig')[index]
+        if sig != MISSING:
+            call['sig'] = strings[sig]
+
+        duration = self.get_column('duration')[index]
+        if not math.isnan(duration):
+            call['duration'] = duration
+
+        time = self.get_column('time')[index]
+        if not math.isnan(time):
+            call['time'] = decode_time(time)
+
+        for key in ('depth', 'lineno'):
+            value = self.get_column(key)[index]
+            if value != MISSING:
+                call[key] = value
+
+        args = self.get_column('args')[index]
+        if args != MISSING:
+            call['args'] = simplejson.loads(strings[args])
+
+        call['stacktrace'] = [self.get_frame(i) for i in self.get_stack(index)]
+
+        extra = self.get_column('extra')[index]
+        if extra != MISSING:
+            call.update(simplejson.loads(strings[extra]))
+
+        return call
@@ -0,0 +1,256 @@
+"""
+Diffs between the traces of two runs of a test.
+
+Calls are matched by their call id alone (which is shared by every call
+with the same fingerprint), never by their position, so a call inserted
+near the start of a trace doesn't throw off the rest of it.
+
+Call ids are interned as integers and diffed with Myers' algorithm, in
+its linear space (divide and conquer) form, after trimming whatever the
+traces have in common at either end. Its cost grows with the number of
+differences, so it's bounded by ``ZUMANJI_CONFIG['TRACE_DIFF_BUDGET']``
+(the number of diagonals it may explore). Whatever is left once that runs
+out is matched approximately, by keeping as many calls of each id as
+both sides have and pairing those up in order, and the diff is then
+flagged as not exact.
+
+A diff is a list of difflib-style opcodes. Since each opcode starts where
+the one before it ended, they're stored (see ``pack_opcodes``) as just
+``[tag, length in a, length in b]``. The importer stores the diff of each
+trace against the previous run of its test (see ``TRACE_DIFF_KEY``), which
+is what a test's page shows by default.
+"""
+__all__ = ('TRACE_DIFF_KEY', 'get_call_ids', 'get_opcodes', 'get_rows', 'pack_opcodes',
+           'unpack_opcodes')
+
+import array
+from collections import defaultdict
+from django.conf import settings
+from zumanji.models import CallSignature
+
+# The ``TestData`` key under which a stored diff is kept
+TRACE_DIFF_KEY = 'trace_diff'
+
+# Diagonals explored before falling back to an approximate diff
+DEFAULT_BUDGET = 1000000
+
+
+class BudgetExceeded(Exception):
+    pass
+
+
+def get_call_ids(project, *traces):
+    """
+    Returns a list of the call id of each call, for each trace, without
+    building the calls (other than those stored in full by older imports).
+    """
+    sigs = [t.get_sigs() for t in traces]
+    call_ids = CallSignature.get_call_ids(project, (s for trace_sigs in sigs for s in trace_sigs))
+
+    results = []
+    for trace, trace_sigs in zip(traces, sigs):
+        legacy = dict((x, trace[x]) for x, sig in enumerate(trace_sigs) if sig is None)
+        if legacy:
+            CallSignature.expand_traces(project, legacy.values())
+        results.append([
+            legacy[x]['id'] if sig is None else call_ids.get(sig, sig)
+            for x, sig in enumerate(trace_sigs)
+        ])
+    return results
+
+
+def get_budget():
+    return getattr(settings, 'ZUMANJI_CONFIG', {}).get('TRACE_DIFF_BUDGET', DEFAULT_BUDGET)
+
+
+def intern_ids(*sequences):
+    """
+    Returns each sequence as an array of integers, where equal values map
+    to the same integer.
+    """
+    ids = {}
+    return [array.array('i', [ids.setdefault(v, len(ids)) for v in seq]) for seq in sequences]
+
+
+def find_middle_snake(a, alo, ahi, b, blo, bhi, budget):
+    """
+    Returns ``(x0, y0, x1, y1)``, the (possibly empty) run of matches in the
+    middle of a shortest edit script from ``a[alo:ahi]`` to ``b[blo:bhi]``,
+    relative to ``alo`` and ``blo``. ``budget`` is a one item list holding
+    the diagonals left to explore.
+    """
+    n, m = ahi - alo, bhi - blo
+    delta = n - m
+    odd = delta & 1
+    max_d = (n + m + 1) // 2
+    offset = max_d + 1
+    # the furthest x reached on each diagonal, forwards and (from the ends) backwards
+    forward = [0] * (2 * offset + 1)
+    backward = [0] * (2 * offset + 1)
+
+    for d in xrange(max_d + 1):
+        budget[0] -= 2 * (d + 1)
+        if budget[0] < 0:
+            raise BudgetExceeded
+
+        for k in xrange(-d, d + 1, 2):
+            if k == -d or (k != d and forward[offset + k - 1] < forward[offset + k + 1]):
+                x = forward[offset + k + 1]
+            else:
+                x = forward[offset + k - 1] + 1
+            y = x - k
+            x0, y0 = x, y
+            while x < n and y < m and a[alo + x] == b[blo + y]:
+                x += 1
+                y += 1
+            forward[offset + k] = x
+            if odd and delta - d < k < delta + d and x + backward[offset + delta - k] >= n:
+                return x0, y0, x, y
+
+        for k in xrange(-d, d + 1, 2):
+            if k == -d or (k != d and backward[offset + k - 1] < backward[offset + k + 1]):
+                x = backward[offset + k + 1]
+            else:
+                x = backward[offset + k - 1] + 1
+            y = x - k
+            x0, y0 = x, y
+            while x < n and y < m and a[ahi - 1 - x] == b[bhi - 1 - y]:
+                x += 1
+                y += 1
+            backward[offset + k] = x
+            if not odd and -d <= delta - k <= d and x + forward[offset + delta - k] >= n:
+                return n - x, m - y, n - x0, m - y0
+
+    raise AssertionError('No middle snake found')
+
+
+def match_counts(a, alo, ahi, b, blo, bhi, blocks):
+    """
+    Approximately matches ``a[alo:ahi]`` with ``b[blo:bhi]``, in linear
+    time: as many calls of each id as both sides have are kept (the first
+    ones on each side), and the kept calls are paired up in order.
+    """
+    counts_a, counts_b = defaultdict(int), defaultdict(int)
+    for x in xrange(alo, ahi):
+        counts_a[a[x]] += 1
+    for y in xrange(blo, bhi):
+        counts_b[b[y]] += 1
+
+    def get_kept(seq, lo, hi, limits):
+        seen = defaultdict(int)
+        kept = []
+        for x in xrange(lo, hi):
+            if seen[seq[x]] < limits[seq[x]]:
+                seen[seq[x]] += 1
+                kept.append(x)
+        return kept
+
+    for x, y in zip(get_kept(a, alo, ahi, counts_b), get_kept(b, blo, bhi, counts_a)):
+        if a[x] == b[y]:
+            blocks.append((x, y, 1))
+
+
+def diff_range(a, alo, ahi, b, blo, bhi, blocks, budget):
+    """
+    Appends the matches between ``a[alo:ahi]`` and ``b[blo:bhi]`` to
+    ``blocks`` (in order), as ``(i, j, length)``. Returns whether they make
+    a longest common subsequence.
+    """
+    # common prefix and suffix
+    start = 0
+    while alo + start < ahi and blo + start < bhi and a[alo + start] == b[blo + start]:
+        start += 1
+    end = 0
+    while ahi - end > alo + start and bhi - end > blo + start and a[ahi - 1 - end] == b[bhi - 1 - end]:
+        end += 1
+
+    if start:
+        blocks.append((alo, blo, start))
+    exact = True
+    if ahi - end > alo + start and bhi - end > blo + start:
+        lo_a, hi_a, lo_b, hi_b = alo + start, ahi - end, blo + start, bhi - end
+        try:
+            if budget[0] < 0:
+                raise BudgetExceeded
+            x0, y0, x1, y1 = find_middle_snake(a, lo_a, hi_a, b, lo_b, hi_b, budget)
+        except BudgetExceeded:
+            match_counts(a, lo_a, hi_a, b, lo_b, hi_b, blocks)
+            exact = False
+        else:
+            exact = diff_range(a, lo_a, lo_a + x0, b, lo_b, lo_b + y0, blocks, budget)
+            if x1 > x0:
+                blocks.append((lo_a + x0, lo_b + y0, x1 - x0))
+            exact = diff_range(a, lo_a + x1, hi_a, b, lo_b + y1, hi_b, blocks, budget) and exact
+    if end:
+        blocks.append((ahi - end, bhi - end, end))
+    return exact
+
+
+def get_opcodes(a, b, budget=None):
+    """
+    Returns ``(opcodes, exact)``, where ``opcodes`` turn the call ids ``a``
+    into ``b``, and ``exact`` is False if the diff had to be approximated
+    (so isn't necessarily the shortest).
+    """
+    if budget is None:
+        budget = get_budget()
+    a, b = intern_ids(a, b)
+
+    blocks = []
+    # diff_range recurses about log2(number of differences) deep
+    exact = diff_range(a, 0, len(a), b, 0, len(b), blocks, [budget])
+
+    opcodes = []
+    i = j = 0
+    for x, y, size in blocks + [(len(a), len(b), 0)]:
+        if i < x and j < y:
+            opcodes.append(('replace', i, x, j, y))
+        elif i < x:
+            opcodes.append(('delete', i, x, j, y))
+        elif j < y:
+            opcodes.append(('insert', i, x, j, y))
+        if size:
+            # adjacent blocks are merged
+            if opcodes and opcodes[-1][0] == 'equal' and opcodes[-1][2] == x:
+                tag, i1, _, j1, _ = opcodes.pop()
+                opcodes.append(('equal', i1, x + size, j1, y + size))
+            else:
+                opcodes.append(('equal', x, x + size, y, y + size))
+        i, j = x + size, y + size
+    return opcodes, exact
+
+
+def pack_opcodes(opcodes):
+    return [[tag, i2 - i1, j2 - j1] for tag, i1, i2, j1, j2 in opcodes]
+
+
+def unpack_opcodes(packed):
+    opcodes = []
+    i = j = 0
+    for tag, len_a, len_b in packed:
+        opcodes.append((tag, i, i + len_a, j, j + len_b))
+        i += len_a
+        j += len_b
+    return opcodes
+
+
+def get_rows(opcodes):
+    """
+    Returns the rows of a side-by-side diff, as a list of (tag, index in a,
+    index in b), where an index is None if that side of the row is empty.
+    """
+    rows = []
+    for tag, i1, i2, j1, j2 in opcodes:
+        if tag == 'equal':
+            rows.extend((tag, i1 + x, j1 + x) for x in xrange(i2 - i1))
+        elif tag in ('replace', 'delete', 'insert'):
+            # the shorter side of a replacement is padded, so both stay aligned
+            for x in xrange(max(i2 - i1, j2 - j1)):
+                rows.append((
+                    tag,
+                    i1 + x if i1 + x < i2 else None,
+                    j1 + x if j1 + x < j2 else None,
+                ))
+        else:
+            raise ValueError(tag)
+    return rows
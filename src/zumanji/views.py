@@ -1,15 +1,20 @@
 from django.conf import settings
 from django.core.urlresolvers import reverse
 from django.db import transaction
-from django.http import HttpResponseRedirect, HttpResponseForbidden
+from django.http import HttpResponse, HttpResponseBadRequest, HttpResponseRedirect, HttpResponseForbidden
 from django.shortcuts import render, get_object_or_404
+from django.template.loader import render_to_string
 from django.utils import simplejson
 from django.views.decorators.csrf import csrf_protect, csrf_exempt
 from functools import wraps
 from zumanji.forms import UploadJsonForm
-from zumanji.helpers import get_trace_data, get_changes, get_git_changes
-from zumanji.models import Project, Build, BuildTag, Test
-from zumanji.importer import import_build
+from zumanji.helpers import (get_build_page, get_trace_data, get_changes, get_git_changes,
+    get_top_callsites, get_top_modules, parse_build_cursor)
+from zumanji.models import Project, Build, BuildTag, Test, ImportJob
+from zumanji.importer import import_build, prewarm_pages
+from zumanji.jobs import enqueue_build
+from zumanji.pagecache import cache_build_page
+from zumanji.stream import BuildPayload
 
 
 NOTSET = object()
@@ -26,33 +31,52 @@ def api_auth(func):
     return csrf_exempt(wrapped)
 
 
+def json_response(data, status=200):
+    return HttpResponse(simplejson.dumps(data), status=status, content_type='application/json')
+
+
+def is_async_upload(request):
+    if request.REQUEST.get('async') is not None:
+        return request.REQUEST['async'] not in ('', '0', 'false')
+    return settings.ZUMANJI_CONFIG.get('ASYNC_IMPORT', False)
+
+
 def index(request):
-    build_qs = Build.objects.order_by('-revision__datetime', '-datetime').select_related('revision')
-    project_list = []
-    # lol O(N)
-    for project in Project.objects.all():
-        try:
-            latest_build = build_qs.filter(project=project)[0]
-        except IndexError:
-            latest_build = None
-        project_list.append((project, latest_build))
+    # each summary is kept current by the importer
+    project_list = Project.objects.select_related('summary').order_by('label')
 
     return render(request, 'zumanji/index.html', {
         'project_list': project_list,
     })
 
 
+def get_builds(request, project, tag=None):
+    """
+    Returns the page of builds (and the cursor of the next page) requested
+    by ``?after=<cursor>``, raising ValueError for an invalid cursor.
+    """
+    queryset = Build.objects.filter(project=project)
+    if tag:
+        queryset = queryset.filter(tags=tag)
+
+    cursor = request.GET.get('after')
+    if cursor:
+        cursor = parse_build_cursor(cursor)
+    return get_build_page(queryset, cursor or None)
+
+
 def view_project(request, project_label):
-    project = get_object_or_404(Project, label=project_label)
+    project = get_object_or_404(Project.objects.select_related('summary'), label=project_label)
 
-    build_list = list(Build.objects
-        .filter(project=project)
-        .order_by('-revision__datetime', '-datetime')
-        .select_related('revision', 'project'))
+    try:
+        build_list, next_cursor = get_builds(request, project)
+    except ValueError, e:
+        return HttpResponseBadRequest(unicode(e))
 
     return render(request, 'zumanji/project.html', {
         'project': project,
         'build_list': build_list,
+        'next_cursor': next_cursor,
     })
 
 
@@ -60,18 +84,47 @@ def view_tag(request, project_label, tag_id):
     project = get_object_or_404(Project, label=project_label)
     tag = get_object_or_404(BuildTag, pk=tag_id)
 
-    build_list = list(Build.objects
-        .filter(project=project, tags=tag)
-        .order_by('-datetime')
-        .select_related('revision', 'project'))
+    try:
+        build_list, next_cursor = get_builds(request, project, tag)
+    except ValueError, e:
+        return HttpResponseBadRequest(unicode(e))
 
     return render(request, 'zumanji/tag.html', {
         'project': project,
         'tag': tag,
         'build_list': build_list,
+        'next_cursor': next_cursor,
     })
 
 
+def view_builds_json(request, project_label, tag_id=None):
+    """
+    The page of builds following ``?after=<cursor>``, as both data and the
+    rendered rows, for "load more" on the project and tag pages.
+    """
+    project = get_object_or_404(Project, label=project_label)
+    tag = get_object_or_404(BuildTag, pk=tag_id) if tag_id else None
+
+    try:
+        build_list, next_cursor = get_builds(request, project, tag)
+    except ValueError, e:
+        return json_response({'error': unicode(e)}, status=400)
+
+    template = 'zumanji/includes/tag_build_row.html' if tag else 'zumanji/includes/build_row.html'
+    html = ''.join(render_to_string(template, {
+        'project': project,
+        'tag': tag,
+        'build': build,
+    }) for build in build_list)
+
+    return json_response({
+        'builds': [b.to_dict() for b in build_list],
+        'html': html,
+        'next_cursor': next_cursor,
+    })
+
+
+@cache_build_page
 def view_build(request, project_label, build_id, tag_id=None):
     filter_args = dict(project__label=project_label, id=build_id)
     tag = None
@@ -79,19 +132,21 @@ def view_build(request, project_label, build_id, tag_id=None):
         tag = get_object_or_404(BuildTag, id=tag_id)
         filter_args["tags"] = tag
 
-    build = get_object_or_404(Build, **filter_args)
+    build = get_object_or_404(Build.objects.select_related('revision').defer('revision__data'), **filter_args)
     project = build.project
     previous_build = build.get_previous_build(tag=tag)
     next_build = build.get_next_build(tag=tag)
 
     test_list = list(build.test_set
         .filter(parent__isnull=True)
-        .order_by('-upper90_duration'))
+        .order_by('-upper90_duration')
+        .prefetch_related('interface_stats'))
 
     compare_with = request.GET.get('compare_with')
     if compare_with:
         try:
-            compare_build = Build.objects.get(project__label=project_label, id=compare_with)
+            compare_build = Build.objects.select_related('revision').defer('revision__data').get(
+                project__label=project_label, id=compare_with)
         except Build.DoesNotExist:
             compare_build = None
     else:
@@ -115,17 +170,22 @@ def view_build(request, project_label, build_id, tag_id=None):
         'test_list': test_list,
         'changes': changes,
         'git_changes': git_changes,
+        'top_callsites': get_top_callsites(build),
+        'top_modules': get_top_modules(build),
     })
 
 
+@cache_build_page
 def view_test(request, project_label, build_id, test_label):
-    test = get_object_or_404(Test, project__label=project_label, build=build_id, label=test_label)
+    test = get_object_or_404(Test.objects.select_related('build', 'revision').defer('revision__data'),
+        project__label=project_label, build=build_id, label=test_label)
     project = test.project
     build = test.build
 
     test_list = list(Test.objects.filter(parent=test)
         .order_by('-upper90_duration')
-        .select_related('parent'))
+        .select_related('parent')
+        .prefetch_related('interface_stats'))
 
     # this is actually a <Test>
     previous_test_by_build = test.get_test_in_previous_build()
@@ -151,7 +211,8 @@ def view_test(request, project_label, build_id, test_label):
     compare_with = request.GET.get('compare_with')
     if compare_with:
         try:
-            compare_build = Build.objects.get(project__label=project_label, id=compare_with)
+            compare_build = Build.objects.select_related('revision').defer('revision__data').get(
+                project__label=project_label, id=compare_with)
         except Build.DoesNotExist:
             compare_build = None
     else:
@@ -168,7 +229,12 @@ def view_test(request, project_label, build_id, test_label):
         compare_test = None
         git_changes = None
 
-    trace_results = get_trace_data(test, compare_test)
+    try:
+        trace_offset = max(int(request.GET.get('trace_offset', 0)), 0)
+    except ValueError:
+        trace_offset = 0
+
+    trace_results = get_trace_data(test, compare_test, offset=trace_offset)
     if previous_test_by_build:
         tests_to_check = test_list
         changes = get_changes(compare_build, tests_to_check)
@@ -188,27 +254,68 @@ def view_test(request, project_label, build_id, test_label):
         'compare_build': compare_build,
         'trace_results': trace_results,
         'git_changes': git_changes,
+        'top_callsites': get_top_callsites(build, test),
     })
 
 
-@api_auth
 @transaction.commit_on_success
-def upload_project_build(request, project_label):
+def handle_upload(request, project_label):
+    """
+    Returns ``(response, build)``, where ``build`` is the build imported
+    (if any).
+    """
     project = get_object_or_404(Project, label=project_label)
 
     form = UploadJsonForm(request.POST or None, request.FILES or None)
-    if form.is_valid():
-        data = simplejson.loads(request.FILES['json_file'].read())
+    if form.is_valid() and is_async_upload(request):
+        job = enqueue_build(project, request.FILES['json_file'],
+            revision=form.cleaned_data.get('revision'))
+        return json_response(get_job_status(job), status=202), None
 
+    elif form.is_valid():
         try:
+            data = BuildPayload(request.FILES['json_file'])
             build = import_build(data, project=project.label, revision=form.cleaned_data.get('revision'))
         except Exception, e:
             form.errors['json_file'] = unicode(e)
         else:
             return HttpResponseRedirect(reverse('zumanji:view_build', kwargs={
-                'project_label': project.label, 'build_id': build.id}))
+                'project_label': project.label, 'build_id': build.id})), build
 
     return render(request, 'zumanji/upload_build.html', {
         'project': project,
         'form': form,
-    })
+    }), None
+
+
+@api_auth
+def upload_project_build(request, project_label):
+    response, build = handle_upload(request, project_label)
+    # only once the import is committed
+    if build is not None:
+        prewarm_pages(build)
+    return response
+
+
+def get_job_status(job):
+    if job.build_id:
+        build_url = reverse('zumanji:view_build', kwargs={
+            'project_label': job.project.label, 'build_id': job.build_id})
+    else:
+        build_url = None
+
+    return {
+        'job_id': job.id,
+        'status': job.status,
+        'status_url': reverse('zumanji:view_import_job', kwargs={
+            'project_label': job.project.label, 'job_id': job.id}),
+        'build_id': job.build_id,
+        'build_url': build_url,
+        'error': job.error,
+    }
+
+
+def view_import_job(request, project_label, job_id):
+    job = get_object_or_404(ImportJob, project__label=project_label, id=job_id)
+
+    return json_response(get_job_status(job))
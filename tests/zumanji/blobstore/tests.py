@@ -0,0 +1,49 @@
+import mmap
+import os
+import shutil
+import tempfile
+import time
+from django.test import TestCase
+from zumanji.blobstore import BlobStore
+from zumanji.trace import Trace, encode_trace
+
+
+class BlobStoreTest(TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.path)
+        self.store = BlobStore(self.path)
+
+    def test_identical_blobs_are_stored_once(self):
+        checksum = self.store.put('foo')
+        self.assertEquals(self.store.put('foo'), checksum)
+        self.assertNotEquals(self.store.put('bar'), checksum)
+        self.assertEquals(sorted(self.store), sorted([checksum, self.store.put('bar')]))
+
+    def test_traces_are_read_from_a_map(self):
+        calls = [{'sig': 'a' * 40, 'duration': 1.0, 'stacktrace': []}]
+        data = self.store.open(self.store.put(encode_trace(calls)))
+        self.assertTrue(isinstance(data, mmap.mmap))
+
+        trace = Trace(data)
+        self.assertTrue(trace.data is data)
+        self.assertEquals(list(trace), calls)
+
+    def test_collect_garbage(self):
+        kept, old, new = self.store.put('foo'), self.store.put('bar'), self.store.put('baz')
+        past = time.time() - 7200
+        for checksum in (kept, old):
+            os.utime(self.store.get_path(checksum), (past, past))
+
+        self.assertEquals(self.store.collect_garbage(set([kept])), 1)
+        self.assertEquals(sorted(self.store), sorted([kept, new]))
+
+    def test_reused_blobs_are_kept(self):
+        checksum = self.store.put('foo')
+        past = time.time() - 7200
+        os.utime(self.store.get_path(checksum), (past, past))
+
+        # referenced again by a build which hasn't been committed yet
+        self.assertEquals(self.store.put('foo'), checksum)
+        self.assertEquals(self.store.collect_garbage(set()), 0)
+        self.assertEquals(list(self.store), [checksum])
@@ -0,0 +1,125 @@
+from datetime import datetime
+import os
+import zlib
+import shutil
+import mock
+import tempfile
+from django.test import TestCase
+from django.test.utils import override_settings
+from zumanji.blobstore import BlobStore
+from zumanji.management.commands.import_performance_json import Ledger, find_json_files
+from zumanji.management.commands.migrate_traces import migrate_traces
+from zumanji.management.commands.process_import_jobs import run_worker
+from zumanji.management.commands.recompress_traces import recompress_traces
+from zumanji.trace import HEADER, MAGIC, Trace, encode_trace
+from zumanji import models
+
+
+class ImportPerformanceJsonTest(TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.path)
+
+        os.makedirs(os.path.join(self.path, 'b'))
+        for name in ('a.json', 'b/c.json', 'b/d.txt'):
+            with open(os.path.join(self.path, name), 'w') as fp:
+                fp.write('{}')
+
+    def test_find_json_files(self):
+        self.assertEquals(find_json_files([self.path]), [
+            os.path.join(self.path, 'a.json'),
+            os.path.join(self.path, 'b', 'c.json'),
+        ])
+        self.assertEquals(find_json_files([os.path.join(self.path, 'b', '*')]), [
+            os.path.join(self.path, 'b', 'c.json'),
+            os.path.join(self.path, 'b', 'd.txt'),
+        ])
+
+    def test_ledger_resumes(self):
+        json_file = os.path.join(self.path, 'a.json')
+        ledger_path = os.path.join(self.path, 'ledger')
+
+        ledger = Ledger(ledger_path)
+        self.assertFalse(json_file in ledger)
+        ledger.add(json_file, 1)
+
+        ledger = Ledger(ledger_path)
+        self.assertTrue(json_file in ledger)
+        self.assertFalse(os.path.join(self.path, 'b', 'c.json') in ledger)
+
+
+class ProcessImportJobsTest(TestCase):
+    @mock.patch('zumanji.management.commands.process_import_jobs.connection')
+    @mock.patch('zumanji.management.commands.process_import_jobs.time')
+    @mock.patch('zumanji.management.commands.process_import_jobs.process_jobs')
+    def test_worker_survives_errors(self, process_jobs, time, connection):
+        process_jobs.side_effect = [Exception('database went away'), 0, KeyboardInterrupt]
+        self.assertRaises(KeyboardInterrupt, run_worker, None, False, 5.0)
+        self.assertEquals(process_jobs.call_count, 3)
+
+
+class MigrateTracesTest(TestCase):
+    def test_json_traces_are_encoded(self):
+        project = models.Project.objects.create(label='foo/bar')
+        revision = models.Revision.objects.create(project=project, label='a' * 40)
+        build = models.Build.objects.create(project=project, revision=revision, datetime=datetime(2012, 5, 16))
+        calls = [{'sig': 'b' * 40, 'duration': 1.0, 'depth': 0, 'args': [], 'stacktrace': []}]
+        for n in xrange(3):
+            test = models.Test.objects.create(project=project, revision=revision, build=build,
+                label='foo.%d' % n)
+            models.TestData.objects.create(test=test, key='trace', data=calls)
+
+        self.assertEquals(list(migrate_traces(batch_size=2)), [2, 3])
+        self.assertEquals(list(migrate_traces()), [])
+
+        for testdata in models.TestData.objects.filter(key='trace'):
+            self.assertEquals(testdata.data, {})
+            self.assertEquals(list(testdata.trace), calls)
+
+
+class RecompressTracesTest(TestCase):
+    def test_outdated_traces_are_recompressed(self):
+        project = models.Project.objects.create(label='foo/bar')
+        revision = models.Revision.objects.create(project=project, label='a' * 40)
+        build = models.Build.objects.create(project=project, revision=revision, datetime=datetime(2012, 5, 16))
+        calls = [{'sig': 'b' * 40, 'duration': 1.0, 'depth': 0, 'args': [], 'stacktrace': []}]
+
+        # as written before traces recorded their codec
+        body = Trace(encode_trace(calls)).get_body()
+        blobs = [HEADER.pack(MAGIC, 2, len(calls)) + zlib.compress(body), encode_trace(calls)]
+        for n, blob in enumerate(blobs):
+            test = models.Test.objects.create(project=project, revision=revision, build=build,
+                label='foo.%d' % n)
+            models.TestData.objects.create(test=test, key='trace', blob=blob)
+
+        self.assertEquals(list(recompress_traces(project, 'zlib')), [(1, 1)])
+        self.assertEquals(list(recompress_traces(project, 'zlib')), [(0, 2)])
+
+        for testdata in models.TestData.objects.all():
+            self.assertEquals(testdata.trace.version, 3)
+            self.assertEquals(list(testdata.trace), calls)
+
+    def test_traces_in_blob_store_are_recompressed(self):
+        path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, path)
+
+        project = models.Project.objects.create(label='foo/bar')
+        revision = models.Revision.objects.create(project=project, label='a' * 40)
+        build = models.Build.objects.create(project=project, revision=revision, datetime=datetime(2012, 5, 16))
+        test = models.Test.objects.create(project=project, revision=revision, build=build, label='foo')
+        calls = [{'sig': 'b' * 40, 'duration': 1.0, 'depth': 0, 'args': [], 'stacktrace': []}]
+
+        with override_settings(ZUMANJI_CONFIG={'BLOB_STORE': path}):
+            # as written before traces recorded their codec
+            blob = HEADER.pack(MAGIC, 2, len(calls)) + zlib.compress(Trace(encode_trace(calls)).get_body())
+            models.TestData.objects.create(test=test, key='trace', blob_checksum=BlobStore(path).put(blob),
+                blob_length=len(blob))
+
+            self.assertEquals(list(recompress_traces(project, 'zlib')), [(1, 0)])
+            testdata = models.TestData.objects.get()
+            self.assertEquals(testdata.blob, None)
+            self.assertEquals(testdata.trace.version, 3)
+            self.assertEquals(list(testdata.trace), calls)
+
+        with override_settings(ZUMANJI_CONFIG={}):
+            self.assertRaises(ValueError, list, recompress_traces(project, 'zlib'))
@@ -0,0 +1,26 @@
+from django.test import TestCase
+from zumanji import compression
+
+
+class CompressionTest(TestCase):
+    def test_round_trip(self):
+        data = 'foo bar ' * 100
+        for codec in compression.CODECS:
+            value = compression.compress(data, codec)
+            self.assertEquals(compression.get_header(value)[:2], (compression.get_codec(codec), None))
+            self.assertEquals(compression.decompress(value), data)
+
+    def test_unknown_codec(self):
+        self.assertRaises(ValueError, compression.compress, 'foo', 'foo')
+        self.assertRaises(ValueError, compression.decompress, compression.HEADER.pack(0x0f, 0) + 'foo')
+
+    def test_dictionary_is_required(self):
+        value = (compression.HEADER.pack(compression.ZlibCodec.tag, compression.HAS_DICTIONARY)
+                 + compression.DICTIONARY_ID.pack(5) + 'foo')
+        self.assertEquals(compression.get_header(value)[1], 5)
+        self.assertRaises(ValueError, compression.decompress, value)
+
+    def test_codecs_without_dictionaries_ignore_them(self):
+        value = compression.compress('foo', 'zlib', dictionary=(5, 'bar'))
+        self.assertEquals(compression.get_header(value)[1], None)
+        self.assertEquals(compression.decompress(value), 'foo')
@@ -0,0 +1,250 @@
+from __future__ import absolute_import
+
+import datetime
+import mock
+from django.test import TestCase
+from django.test.utils import override_settings
+from zumanji import models
+from zumanji.helpers import (get_build_page, get_changes, get_historical_data, get_top_callsites,
+    get_trace_data, parse_build_cursor)
+from zumanji.importer import BuildImporter, import_build
+from tests.zumanji.importer.tests import (COMMIT_DATA, ZUMANJI_CONFIG, make_build_data, make_call,
+    make_leaf)
+
+
+# queries which differ only by a number share a call id
+NAMES = ('foo', 'bar', 'qux', 'quux', 'corge')
+
+
+class GetTraceDataTest(TestCase):
+    def setUp(self):
+        patcher = mock.patch('zumanji.models.github')
+        self.github = patcher.start()
+        self.github.get_commit.return_value = COMMIT_DATA
+        self.addCleanup(patcher.stop)
+
+    def import_calls(self, calls, time):
+        return import_build(make_build_data([
+            make_leaf('tests.foo.FooTest.test_a', 1.0, calls),
+            make_leaf('tests.foo.FooTest.test_b', 1.0),
+        ], time=time)).test_set.get(label='tests.foo.FooTest.test_a')
+
+    def test_signatures_are_shared(self):
+        importer = BuildImporter(make_build_data([
+            make_leaf('tests.foo.FooTest.test_a', 1.0, [make_call('SELECT 1', 1.0), make_call('SELECT 2', 2.0)]),
+            make_leaf('tests.foo.FooTest.test_b', 1.0, [make_call('SELECT 1', 1.0)]),
+        ]))
+        importer.run()
+        self.assertEquals(importer.counts['signatures'], 2)
+
+    def test_calls_are_expanded(self):
+        previous_test = self.import_calls([
+            make_call('SELECT foo', 1.0),
+            make_call('SELECT bar', 2.0),
+        ], '2012-05-16T03:43:59.23')
+        test = self.import_calls([
+            make_call('SELECT foo', 1.0),
+            make_call('SELECT baz', 2.0),
+            make_call('SELECT bar', 3.0),
+        ], '2012-05-17T03:43:59.23')
+
+        result = get_trace_data(test, previous_test)
+
+        previous_calls, calls = [n['calls'] for n in result['diff']]
+        self.assertEquals([(t, c and c['command']) for t, _, c in calls],
+            [('equal', 'SELECT foo'), ('insert', 'SELECT baz'), ('equal', 'SELECT bar')])
+        self.assertEquals([(t, c and c['command']) for t, _, c in previous_calls],
+            [('equal', 'SELECT foo'), ('insert', None), ('equal', 'SELECT bar')])
+        self.assertEquals(result['num_diffs'], 1)
+        self.assertEquals(set(c['interface'] for c in result['calls'].itervalues()), set(['sql']))
+        self.assertEquals(calls[0][2]['stacktrace'][0]['filename'], 'foo.py')
+
+    def test_insertions_keep_alignment(self):
+        previous_test = self.import_calls([
+            make_call('SELECT %s' % n, 1.0) for n in NAMES
+        ], '2012-05-16T03:43:59.23')
+        test = self.import_calls([make_call('SELECT baz', 1.0)] + [
+            make_call('SELECT %s' % n, 1.0) for n in NAMES
+        ], '2012-05-17T03:43:59.23')
+
+        with mock.patch('zumanji.helpers.get_opcodes') as get_opcodes:
+            result = get_trace_data(test, previous_test)
+        # the diff against the previous build was stored by the importer
+        self.assertFalse(get_opcodes.called)
+        self.assertEquals(result['num_diffs'], 1)
+        self.assertEquals([t for t, _, _ in result['diff'][1]['calls']], ['insert'] + ['equal'] * 5)
+
+        # against any other build, it's computed when viewed
+        other_test = self.import_calls([
+            make_call('SELECT %s' % n, 1.0) for n in NAMES[:3]
+        ], '2012-05-15T03:43:59.23')
+        result = get_trace_data(test, other_test)
+        self.assertEquals(result['num_diffs'], 3)
+        self.assertEquals(result['num_rows'], 6)
+        previous_calls, calls = [n['calls'] for n in result['diff']]
+        self.assertEquals([c and c['command'] for _, _, c in previous_calls],
+            [None] + ['SELECT %s' % n for n in NAMES[:3]] + [None, None])
+
+    def test_rows_are_paged(self):
+        test = self.import_calls([
+            make_call('SELECT %d' % n, 1.0) for n in xrange(5)
+        ], '2012-05-16T03:43:59.23')
+
+        result = get_trace_data(test, offset=2, limit=2)
+        self.assertEquals(result['num_rows'], 5)
+        self.assertEquals(result['next_offset'], 4)
+        calls = result['diff'][1]['calls']
+        self.assertEquals([c['command'] for _, _, c in calls], ['SELECT 2', 'SELECT 3'])
+        self.assertEquals(len(result['calls']), 2)
+
+        result = get_trace_data(test, offset=4, limit=2)
+        self.assertEquals(result['next_offset'], None)
+
+    def test_json_traces_are_read(self):
+        test = self.import_calls([make_call('SELECT 1', 1.0)], '2012-05-16T03:43:59.23')
+        testdata = test.testdata_set.get(key='trace')
+        sig = testdata.trace[0]['sig']
+        testdata.blob = None
+        testdata.data = [{'id': sig, 'depth': 0, 'duration': 1.0, 'args': [], 'stacktrace': []}]
+        testdata.save()
+
+        result = get_trace_data(test)
+        calls = result['diff'][1]['calls']
+        self.assertEquals([c['command'] for _, _, c in calls], ['SELECT 1'])
+
+
+@override_settings(ZUMANJI_CONFIG=ZUMANJI_CONFIG)
+class GetChangesTest(TestCase):
+    def setUp(self):
+        patcher = mock.patch('zumanji.models.github')
+        self.github = patcher.start()
+        self.github.get_commit.return_value = COMMIT_DATA
+        self.addCleanup(patcher.stop)
+
+    def import_durations(self, durations, revision, time):
+        return import_build(make_build_data([
+            make_leaf('tests.foo.FooTest.test_a', durations),
+            make_leaf('tests.foo.FooTest.test_b', 1.0),
+        ], revision=revision, time=time))
+
+    def get_changes(self, previous_durations, durations):
+        previous_build = self.import_durations(previous_durations, 'a' * 40, '2012-05-16T03:43:59.23')
+        build = self.import_durations(durations, 'b' * 40, '2012-05-17T03:43:59.23')
+        return dict((t.label, c) for t, c in get_changes(previous_build, list(build.test_set.all())))
+
+    def test_significant_duration_change(self):
+        changes = self.get_changes([1.0, 1.1, 0.9], [2.0, 2.1, 1.9])
+
+        duration = changes['tests.foo.FooTest.test_a']['duration']
+        self.assertEquals(duration['type'], 'increase')
+        self.assertEquals(duration['change'], '+1.000')
+        self.assertTrue(duration['current_interval'][0] < 2.0 < duration['current_interval'][1])
+
+    def test_noise_is_not_a_change(self):
+        changes = self.get_changes([1.0, 2.0, 0.5], [1.2, 2.1, 0.6])
+
+        self.assertFalse('tests.foo.FooTest.test_a' in changes)
+
+    def test_call_count_change(self):
+        previous_build = import_build(make_build_data([
+            make_leaf('tests.foo.FooTest.test_a', 1.0, [make_call('SELECT 1', 1.0)]),
+            make_leaf('tests.foo.FooTest.test_b', 1.0, [make_call('SELECT 1', 1.0)]),
+        ], revision='a' * 40, time='2012-05-16T03:43:59.23'))
+        build = import_build(make_build_data([
+            make_leaf('tests.foo.FooTest.test_a', 1.0, [make_call('SELECT 1', 1.0)] * 3),
+            make_leaf('tests.foo.FooTest.test_b', 1.0, [make_call('SELECT 1', 1.0)]),
+        ], revision='a' * 40, time='2012-05-17T03:43:59.23'))
+
+        changes = dict((t.label, c) for t, c in get_changes(previous_build, list(build.test_set.all())))
+
+        self.assertEquals(changes['tests.foo.FooTest.test_a']['interfaces']['sql'], {
+            'current': 3,
+            'previous': 1,
+            'change': '+2',
+            'type': 'increase',
+        })
+        self.assertEquals(changes['tests.foo.FooTest']['interfaces']['sql']['change'], '+2')
+        self.assertFalse('tests.foo.FooTest.test_b' in changes)
+
+        history = get_historical_data(build, [build.test_set.get(label='tests.foo.FooTest.test_a')])
+        self.assertEquals(history.values()[0][-2:], [(previous_build.id, [1, 0, 0]), (build.id, [3, 0, 0])])
+
+
+class GetTopCallsitesTest(TestCase):
+    def setUp(self):
+        patcher = mock.patch('zumanji.models.github')
+        self.github = patcher.start()
+        self.github.get_commit.return_value = COMMIT_DATA
+        self.addCleanup(patcher.stop)
+
+        self.build = import_build(make_build_data([
+            make_leaf('tests.foo.FooTest.test_a', 1.0, [
+                make_call('SELECT 1', 1.0, filename='a.py'),
+                make_call('SELECT 2', 2.0, filename='b.py'),
+                make_call('SELECT 3', 3.0, filename='b.py'),
+            ]),
+            make_leaf('tests.foo.FooTest.test_b', 1.0, [make_call('SELECT 1', 1.0, filename='a.py')]),
+            make_leaf('tests.bar.BarTest.test_c', 1.0, [make_call('SELECT 1', 1.0, filename='c.py')]),
+        ]))
+
+    def test_build(self):
+        result = get_top_callsites(self.build, limit=2)
+        self.assertEquals([(c.filename, c.num_calls) for c in result], [('a.py', 2), ('b.py', 2)])
+
+    def test_branch(self):
+        branch = self.build.test_set.get(label='tests.foo.FooTest')
+        result = get_top_callsites(self.build, branch)
+        self.assertEquals(sorted((c.filename, c.num_calls, c.num_tests) for c in result),
+            [('a.py', 2, 2), ('b.py', 2, 1)])
+
+    def test_leaf(self):
+        leaf = self.build.test_set.get(label='tests.bar.BarTest.test_c')
+        result = get_top_callsites(self.build, leaf)
+        self.assertEquals([c.filename for c in result], ['c.py'])
+
+
+class GetBuildPageTest(TestCase):
+    def setUp(self):
+        self.project = models.Project.objects.create(label='disqus/zumanji')
+        self.builds = []
+        time = datetime.datetime(2012, 5, 16)
+        # two builds of each revision; the last revision has no commit date
+        for x, revision_time in enumerate([time, time + datetime.timedelta(days=1), None]):
+            revision = models.Revision.objects.create(
+                project=self.project,
+                label=str(x) * 40,
+                datetime=revision_time,
+                subject='Commit %d' % x,
+                author_name='Foo',
+            )
+            for hours in (1, 2):
+                self.builds.append(models.Build.objects.create(
+                    revision=revision, datetime=time + datetime.timedelta(hours=hours)))
+        self.tag = models.BuildTag.objects.create(label='py27')
+        self.tag.builds.add(self.builds[0])
+
+    def get_pages(self, limit):
+        pages, cursor = [], None
+        while True:
+            rows, cursor = get_build_page(models.Build.objects.filter(project=self.project),
+                cursor and parse_build_cursor(cursor), limit)
+            pages.append([r.id for r in rows])
+            if cursor is None:
+                return pages
+
+    def test_pages(self):
+        b = [x.id for x in self.builds]
+        self.assertEquals(self.get_pages(4), [[b[3], b[2], b[1], b[0]], [b[5], b[4]]])
+        self.assertEquals(self.get_pages(1), [[b[3]], [b[2]], [b[1]], [b[0]], [b[5]], [b[4]]])
+        self.assertEquals(self.get_pages(6), [[b[3], b[2], b[1], b[0], b[5], b[4]]])
+
+    def test_rows(self):
+        rows, _ = get_build_page(models.Build.objects.filter(project=self.project))
+        row = rows[3]
+        self.assertEquals(row.id, self.builds[0].id)
+        self.assertEquals(row.oneline, 'Commit 0')
+        self.assertEquals(row.author_name, 'Foo')
+        self.assertEquals(row.to_dict()['tags'], [{'id': self.tag.id, 'label': 'py27'}])
+
+    def test_invalid_cursor(self):
+        self.assertRaises(ValueError, parse_build_cursor, 'foo')
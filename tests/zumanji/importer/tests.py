@@ -1,9 +1,369 @@
+import mock
+import shutil
+import tempfile
+from cStringIO import StringIO
 from datetime import datetime
 from django.test import TestCase
-from zumanji.importer import convert_timestamp
+from django.test.utils import override_settings
+from django.utils import simplejson
+import zumanji.importer
+from zumanji.blobstore import BlobStore
+from zumanji.importer import BuildImporter, LabelTrie, convert_timestamp, format_v2_data, import_build
+from zumanji.models import Build
+from zumanji.stream import BuildPayload
+from zumanji.tracediff import TRACE_DIFF_KEY
 
 
 class ConvertTimestampTest(TestCase):
     def test_basic(self):
         result = convert_timestamp('2012-05-16T03:43:59.23')
         self.assertEquals(result, datetime(2012, 5, 16, 3, 43, 59, 230000))
+
+
+def make_call(name, start, duration=0.01, type='sql', filename='foo.py', function='bar'):
+    return {
+        'type': type,
+        'name': name,
+        'args': [],
+        'start': start,
+        'end': start + duration,
+        'stacktrace': [{'filename': filename, 'function': function, 'lineno': 1, 'context': []}],
+    }
+
+
+def make_leaf(label, duration=1.0, calls=()):
+    return {
+        'id': label,
+        'duration': duration,
+        'doc': None,
+        'calls': list(calls),
+    }
+
+
+def make_build_data(tests, revision='a' * 40, time='2012-05-16T03:43:59.23'):
+    return {
+        'version': 2,
+        'project': 'disqus/zumanji',
+        'revision': revision,
+        'time': time,
+        'tags': [],
+        'tests': tests,
+    }
+
+
+# settings for tests which render (or compare) calls by type
+ZUMANJI_CONFIG = {
+    'call_types': [('sql', 'SQL'), ('cache', 'Cache'), ('redis', 'Redis')],
+}
+
+
+COMMIT_DATA = {
+    'sha': 'a' * 40,
+    'parents': [],
+    'commit': {
+        'message': 'Initial commit',
+        'author': {'name': 'Foo', 'email': 'foo@example.com', 'date': '2012-05-16T03:43:59'},
+        'committer': {'name': 'Foo', 'email': 'foo@example.com', 'date': '2012-05-16T03:43:59'},
+    },
+}
+
+
+class BuildImporterTest(TestCase):
+    def setUp(self):
+        patcher = mock.patch('zumanji.models.github')
+        self.github = patcher.start()
+        self.github.get_commit.return_value = COMMIT_DATA
+        self.addCleanup(patcher.stop)
+
+    def get_data(self):
+        return make_build_data([
+            make_leaf('tests.foo.FooTest.test_a', 1.0, [
+                make_call('SELECT 1', 1.0),
+                make_call('SELECT 2', 2.0),
+            ]),
+            make_leaf('tests.foo.FooTest.test_b', 2.0, [
+                make_call('SELECT 1', 1.0),
+            ]),
+            make_leaf('tests.bar.BarTest.test_c', 4.0),
+        ])
+
+    def test_creates_tree(self):
+        importer = BuildImporter(self.get_data())
+        build = importer.run()
+
+        self.assertEquals(build.num_tests, 3)
+        self.assertEquals(build.total_duration, 7.0)
+
+        tests = dict((t.label, t) for t in build.test_set.all())
+        leaf = tests['tests.foo.FooTest.test_a']
+        self.assertEquals(leaf.parent.label, 'tests.foo.FooTest')
+        self.assertEquals(leaf.data['sql']['mean_calls'], 2)
+        self.assertEquals(len(leaf.testdata_set.get(key='trace').trace), 2)
+
+        branch = tests['tests.foo.FooTest']
+        self.assertEquals(branch.num_tests, 2)
+        self.assertEquals(branch.mean_duration, 3.0)
+        self.assertEquals(branch.data['sql']['mean_calls'], 3)
+        self.assertEquals(branch.series.num_tests, 2)
+        self.assertEquals(branch.series.calls, {'sql': 3})
+
+        roots = [t for t in tests.itervalues() if t.parent is None]
+        self.assertEquals(sum(t.num_tests for t in roots), 3)
+
+        self.assertEquals(importer.counts['leaves'], 3)
+        self.assertEquals(importer.counts['testdata'], 3)
+        self.assertEquals(importer.counts['tests'], len(tests))
+
+    def test_reimport_replaces_tests(self):
+        import_build(self.get_data())
+        build = import_build(self.get_data())
+
+        self.assertEquals(Build.objects.count(), 1)
+        self.assertEquals(build.test_set.filter(label='tests.foo.FooTest.test_a').count(), 1)
+
+    def test_reimport_unchanged_is_noop(self):
+        build = import_build(self.get_data())
+        test_ids = sorted(build.test_set.values_list('id', flat=True))
+
+        importer = BuildImporter(self.get_data())
+        importer.run()
+
+        self.assertEquals(importer.counts['tests'], 0)
+        self.assertEquals(importer.counts['testdata'], 0)
+        self.assertEquals(sorted(build.test_set.values_list('id', flat=True)), test_ids)
+
+    def test_reimport_of_streamed_payload_is_noop(self):
+        import_build(self.get_data())
+
+        importer = BuildImporter(BuildPayload(StringIO(simplejson.dumps(self.get_data(), indent=2))))
+        importer.run()
+        self.assertTrue(importer.unchanged)
+
+    def test_reimport_changed_applies_diff(self):
+        build = import_build(self.get_data())
+        test_b = build.test_set.get(label='tests.foo.FooTest.test_b')
+        test_c = build.test_set.get(label='tests.bar.BarTest.test_c')
+
+        data = self.get_data()
+        data['tests'][0]['calls'].append(make_call('SELECT 3', 3.0))
+        del data['tests'][2]
+
+        importer = BuildImporter(data)
+        build = importer.run()
+
+        self.assertEquals(build.num_tests, 2)
+        self.assertEquals(importer.counts['tests'], 0)
+        self.assertEquals(importer.counts['testdata'], 1)
+        self.assertTrue(importer.counts['deleted'] >= 1)
+
+        # untouched rows keep their ids
+        self.assertEquals(build.test_set.get(label=test_b.label).id, test_b.id)
+        self.assertFalse(build.test_set.filter(label=test_c.label).exists())
+        self.assertEquals(build.testseries_set.count(), build.test_set.count())
+
+        test_a = build.test_set.get(label='tests.foo.FooTest.test_a')
+        self.assertEquals(test_a.data['sql']['mean_calls'], 3)
+        self.assertEquals(len(test_a.testdata_set.get(key='trace').trace), 3)
+        self.assertEquals(build.test_set.get(label='tests.foo.FooTest').data['sql']['mean_calls'], 4)
+
+    def test_leaf_which_becomes_a_branch(self):
+        build = import_build(self.get_data())
+        test_a = build.test_set.get(label='tests.foo.FooTest.test_a')
+
+        data = self.get_data()
+        data['tests'][0]['id'] = 'tests.foo.FooTest.test_a.test_sub'
+        build = import_build(data)
+
+        branch = build.test_set.get(label=test_a.label)
+        self.assertEquals(branch.id, test_a.id)
+        self.assertFalse(branch.testdata_set.exists())
+        self.assertFalse(branch.callsite_set.exists())
+        self.assertEquals(build.callsite_set.get(test__isnull=True, interface='sql').num_calls, 3)
+
+    def test_traces_are_formatted_once(self):
+        with mock.patch('zumanji.importer.format_test_leaf', wraps=zumanji.importer.format_test_leaf) as format_leaf:
+            build = import_build(self.get_data())
+        self.assertEquals(format_leaf.call_count, 3)
+        self.assertEquals(build.testdata_set.count(), 3)
+
+        # traces beyond those kept are formatted again when written
+        data = self.get_data()
+        data['revision'] = 'b' * 40
+        with mock.patch('zumanji.importer.KEPT_TRACE_CALLS', 2):
+            with mock.patch('zumanji.importer.format_test_leaf', wraps=zumanji.importer.format_test_leaf) as format_leaf:
+                build = import_build(data)
+        self.assertEquals(format_leaf.call_count, 4)
+        self.assertEquals(len(build.test_set.get(label='tests.foo.FooTest.test_b').testdata_set.get(key='trace').trace), 1)
+
+    def test_callsite_rollups(self):
+        data = self.get_data()
+        data['tests'][2]['calls'].append(make_call('GET foo', 1.0, type='cache', filename='baz.py'))
+        build = import_build(data)
+
+        callsites = dict(
+            ((c.interface, c.filename), c)
+            for c in build.callsite_set.filter(test__isnull=True)
+        )
+        self.assertEquals(len(callsites), 2)
+        self.assertEquals(callsites['sql', 'foo.py'].num_calls, 3)
+        self.assertEquals(callsites['sql', 'foo.py'].num_tests, 2)
+        self.assertAlmostEquals(callsites['sql', 'foo.py'].total_duration, 0.03)
+        self.assertEquals(callsites['cache', 'baz.py'].num_tests, 1)
+
+        test_a = build.test_set.get(label='tests.foo.FooTest.test_a')
+        self.assertEquals(test_a.callsite_set.get().num_calls, 2)
+
+        modules = dict((m.filename, m) for m in build.callmodule_set.all())
+        self.assertEquals(modules['foo.py'].num_calls, 3)
+
+        # changing one leaf updates the totals, but leaves the others in place
+        data['tests'][0]['calls'].append(make_call('SELECT 3', 3.0))
+        importer = BuildImporter(data)
+        importer.run()
+
+        self.assertEquals(importer.counts['callsites'], 1)
+        self.assertEquals(build.callsite_set.get(test__isnull=True, interface='sql').num_calls, 4)
+        self.assertEquals(build.callmodule_set.get(filename='foo.py').num_calls, 4)
+
+    def test_repeated_runs_are_merged(self):
+        data = self.get_data()
+        data['tests'][0]['duration'] = [1.0, 2.0, 3.0]
+        data['tests'].append(make_leaf('tests.foo.FooTest.test_a', 6.0))
+        build = import_build(data)
+
+        test_a = build.test_set.get(label='tests.foo.FooTest.test_a')
+        self.assertEquals(test_a.num_samples, 4)
+        self.assertEquals(test_a.mean_duration, 3.0)
+        self.assertEquals(test_a.lower_duration, 1.0)
+        self.assertEquals(test_a.upper_duration, 6.0)
+        self.assertAlmostEquals(test_a.stddev_duration, (14.0 / 3) ** 0.5)
+        self.assertAlmostEquals(test_a.stderr_duration, (14.0 / 3 / 4) ** 0.5)
+        self.assertTrue(test_a.margin_duration > 0)
+
+        # a single run has no spread, so the branch inherits only test_a's
+        branch = build.test_set.get(label='tests.foo.FooTest')
+        self.assertEquals(branch.num_samples, 1)
+        self.assertAlmostEquals(branch.stderr_duration, test_a.stderr_duration)
+
+    def test_uploads_of_a_revision_accumulate(self):
+        import_build(self.get_data())
+        data = self.get_data()
+        data['time'] = '2012-05-16T04:43:59.23'
+        data['tests'][0]['duration'] = 3.0
+        build = import_build(data)
+
+        test_a = build.test_set.get(label='tests.foo.FooTest.test_a')
+        self.assertEquals(test_a.num_samples, 2)
+        self.assertEquals(test_a.mean_duration, 2.0)
+        self.assertAlmostEquals(test_a.stddev_duration, 2 ** 0.5)
+
+        # only builds with the same tags are runs of the same thing
+        data['time'] = '2012-05-16T05:43:59.23'
+        data['tags'] = ['mysql']
+        build = import_build(data)
+        self.assertEquals(build.test_set.get(label=test_a.label).num_samples, 1)
+
+    def test_builds_imported_out_of_order(self):
+        data = self.get_data()
+        data['time'] = '2012-05-17T03:43:59.23'
+        later = import_build(data)
+        test_a = later.test_set.get(label='tests.foo.FooTest.test_a')
+        self.assertFalse(test_a.testdata_set.filter(key=TRACE_DIFF_KEY).exists())
+
+        earlier = import_build(self.get_data())
+        later = Build.objects.get(id=later.id)
+        self.assertEquals(later.get_previous_build(), earlier)
+        self.assertEquals((earlier.position, later.position), (0, 1))
+
+        # the later build is now diffed against the earlier one
+        diff = test_a.testdata_set.get(key=TRACE_DIFF_KEY)
+        self.assertEquals(diff.data['test'], earlier.test_set.get(label=test_a.label).id)
+
+    def test_frames_are_shared(self):
+        importer = BuildImporter(self.get_data())
+        build = importer.run()
+
+        # every call is made from the same frame
+        self.assertEquals(importer.counts['frames'], 1)
+        frame = build.stackframe_set.get()
+        self.assertEquals(frame.data['filename'], 'foo.py')
+
+        trace = build.test_set.get(label='tests.foo.FooTest.test_a').testdata_set.get(key='trace').trace
+        self.assertEquals([c['stacktrace'] for c in trace], [[frame.checksum]] * 2)
+
+    def test_traces_in_blob_store(self):
+        path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, path)
+
+        with override_settings(ZUMANJI_CONFIG={'BLOB_STORE': path}):
+            build = import_build(self.get_data())
+            data = self.get_data()
+            data['time'] = '2012-05-17T03:43:59.23'
+            import_build(data)
+
+            testdata = build.test_set.get(label='tests.foo.FooTest.test_a').testdata_set.get(key='trace')
+            self.assertEquals(testdata.blob, None)
+            self.assertEquals(len(testdata.trace), 2)
+
+        # both builds share the same blobs
+        self.assertEquals(len(list(BlobStore(path))), 3)
+
+    def test_streamed_payload(self):
+        fp = StringIO(simplejson.dumps(self.get_data()))
+        build = import_build(BuildPayload(fp))
+
+        self.assertEquals(build.num_tests, 3)
+        self.assertEquals(build.testdata_set.count(), 3)
+
+
+class LabelTrieTest(TestCase):
+    def get_nodes(self, labels):
+        trie = LabelTrie()
+        for label in labels:
+            trie.add(label, ({'mean_duration': 1.0}, None, None))
+        return trie.get_nodes()
+
+    def test_collapses_single_children(self):
+        nodes, leaves, ranges = self.get_nodes([
+            'tests.foo.FooTest.test_a',
+            'tests.foo.FooTest.test_b',
+            'tests.bar.BarTest.test_c',
+            'toplevel',
+        ])
+
+        parents = dict((n.label, n.parent.label if n.parent else None) for n in nodes)
+        self.assertEquals(parents, {
+            'tests.foo': None,
+            'tests.foo.FooTest': 'tests.foo',
+            'tests.foo.FooTest.test_a': 'tests.foo.FooTest',
+            'tests.foo.FooTest.test_b': 'tests.foo.FooTest',
+            'tests.bar.BarTest': None,
+            'tests.bar.BarTest.test_c': 'tests.bar.BarTest',
+        })
+
+        # parents come first
+        seen = set()
+        for node in nodes:
+            self.assertTrue(node.parent is None or node.parent.label in seen)
+            seen.add(node.label)
+
+        ranges = dict((b.label, [l.label for l in leaves[start:end]]) for b, start, end in ranges)
+        self.assertEquals(ranges['tests.foo'], ['tests.foo.FooTest.test_a', 'tests.foo.FooTest.test_b'])
+        self.assertEquals(ranges['tests.bar.BarTest'], ['tests.bar.BarTest.test_c'])
+
+    def test_test_which_is_also_a_branch(self):
+        nodes, leaves, _ = self.get_nodes(['a.b', 'a.b.c'])
+
+        self.assertEquals([l.label for l in leaves], ['a.b.c'])
+        self.assertEquals(dict((n.label, n.depth) for n in nodes), {'a': 0, 'a.b': 1, 'a.b.c': 2})
+
+
+class FormatV2DataTest(TestCase):
+    def test_calls_differing_by_literals_share_id(self):
+        first = format_v2_data(make_call("SELECT * FROM foo WHERE id = 1", 1.0))
+        second = format_v2_data(make_call("SELECT * FROM foo WHERE id = 2", 2.0))
+
+        self.assertEquals(first['id'], second['id'])
+        self.assertNotEquals(first['sig'], second['sig'])
+        self.assertEquals(first['fingerprint'], 'SELECT * FROM foo WHERE id = %s')
+        self.assertEquals(first['command'], 'SELECT * FROM foo WHERE id = 1')
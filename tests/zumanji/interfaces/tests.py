@@ -0,0 +1,43 @@
+from django.test import TestCase
+from zumanji.interfaces import get_interface
+
+
+class SQLFingerprintTest(TestCase):
+    def fingerprint(self, command):
+        return get_interface('sql').fingerprint(command, [])
+
+    def test_literals(self):
+        self.assertEquals(
+            self.fingerprint("SELECT * FROM foo WHERE name = 'bar' AND id = 12 AND x = 1.5"),
+            "SELECT * FROM foo WHERE name = %s AND id = %s AND x = %s")
+
+    def test_in_list(self):
+        self.assertEquals(
+            self.fingerprint('SELECT * FROM foo WHERE id IN (1, 2, 3)'),
+            self.fingerprint('SELECT * FROM foo WHERE id IN (%s)'))
+
+    def test_values(self):
+        self.assertEquals(
+            self.fingerprint('INSERT INTO foo (a, b) VALUES (1, 2), (3, 4)'),
+            'INSERT INTO foo (a, b) VALUES (%s, %s)')
+
+    def test_identifiers_untouched(self):
+        self.assertEquals(
+            self.fingerprint('SELECT "table1"."col2" FROM table1'),
+            'SELECT "table1"."col2" FROM table1')
+
+
+class KeyFingerprintTest(TestCase):
+    def test_redis(self):
+        redis = get_interface('redis')
+        self.assertEquals(redis.fingerprint('GET', ['user:123:profile']), 'GET user:%s:profile')
+        self.assertEquals(redis.fingerprint('GET', [['user:456:profile', 1]]), 'GET user:%s:profile')
+
+    def test_cache(self):
+        cache = get_interface('cache')
+        self.assertEquals(
+            cache.fingerprint('get', ['forum:d41d8cd98f00b204e9800998ecf8427e']),
+            'get forum:%s')
+
+    def test_unknown_interface(self):
+        self.assertEquals(get_interface('template').fingerprint('foo.html', []), 'foo.html')
@@ -0,0 +1,60 @@
+from __future__ import absolute_import
+
+import mock
+import shutil
+import tempfile
+from datetime import datetime, timedelta
+from django.core.files.base import ContentFile
+from django.test import TestCase
+from django.test.utils import override_settings
+from django.utils import simplejson
+from zumanji.jobs import enqueue_build, process_jobs
+from zumanji.models import Project, ImportJob
+from tests.zumanji.importer.tests import COMMIT_DATA, make_build_data, make_call, make_leaf
+
+
+class ProcessJobsTest(TestCase):
+    def setUp(self):
+        patcher = mock.patch('zumanji.models.github')
+        self.github = patcher.start()
+        self.github.get_commit.return_value = COMMIT_DATA
+        self.addCleanup(patcher.stop)
+
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        settings_override = override_settings(MEDIA_ROOT=media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        self.project = Project.objects.create(label='disqus/zumanji')
+
+    def test_imports_queued_jobs(self):
+        data = make_build_data([
+            make_leaf('tests.foo.FooTest.test_a', 1.0, [make_call('SELECT 1', 1.0)]),
+        ])
+        job = enqueue_build(self.project, ContentFile(simplejson.dumps(data)))
+        failed_job = enqueue_build(self.project, ContentFile('{"tests": ['))
+
+        self.assertEquals(process_jobs(), 2)
+        self.assertEquals(ImportJob.claim_next(), None)
+
+        job = ImportJob.objects.get(id=job.id)
+        self.assertEquals(job.status, 'done')
+        self.assertEquals(job.build.num_tests, 1)
+
+        failed_job = ImportJob.objects.get(id=failed_job.id)
+        self.assertEquals(failed_job.status, 'failed')
+        self.assertTrue(failed_job.error)
+
+    def test_stale_jobs_are_queued_again(self):
+        job = enqueue_build(self.project, ContentFile('{}'))
+        self.assertEquals(ImportJob.claim_next().id, job.id)
+        self.assertEquals(ImportJob.claim_next(), None)
+
+        # the worker went away
+        ImportJob.objects.filter(id=job.id).update(date_started=datetime.now() - timedelta(hours=2))
+        self.assertEquals(ImportJob.claim_next().id, job.id)
+
+        with override_settings(ZUMANJI_CONFIG={'IMPORT_JOB_TIMEOUT': 10 * 3600}):
+            ImportJob.objects.filter(id=job.id).update(date_started=datetime.now() - timedelta(hours=2))
+            self.assertEquals(ImportJob.claim_next(), None)
@@ -0,0 +1,210 @@
+import datetime
+import random
+from django.test import TestCase
+from zumanji import models
+from zumanji.lineage import LINEAGE_DEPTH, get_generations, place_build, update_lineage
+
+
+class LineageTest(TestCase):
+    def setUp(self):
+        self.project = models.Project.objects.create(label='disqus/zumanji')
+        self.time = datetime.datetime(2012, 5, 16)
+
+    def add_revision(self, label, *parents):
+        for parent in parents:
+            models.RevisionParent.objects.create(
+                project=self.project, revision_label=label, parent_label=parent)
+        return models.Revision.objects.create(
+            project=self.project,
+            label=label,
+            first_parent_label=parents[0] if parents else None,
+        )
+
+    def add_build(self, revision, hours):
+        return models.Build.objects.create(
+            revision=revision, datetime=self.time + datetime.timedelta(hours=hours))
+
+    def reload(self, *builds):
+        return [models.Build.objects.get(id=b.id) for b in builds]
+
+    def get_ancestors(self, build):
+        return list(models.BuildLineage.objects.filter(build=build).order_by('distance').values_list(
+            'ancestor', 'distance'))
+
+    def test_generations(self):
+        parents = {'b': ['a'], 'c': ['a'], 'd': ['b', 'c'], 'e': ['d', 'x']}
+        self.assertEquals(get_generations(set('abcde'), parents), {'a': 0, 'b': 1, 'c': 1, 'd': 2, 'e': 3})
+
+    def test_first_parent_chain(self):
+        a = self.add_revision('a')
+        b = self.add_revision('b', 'a')
+        self.add_revision('c', 'b')
+        feature = self.add_revision('f', 'a')
+        d = self.add_revision('d', 'c', 'f')
+
+        build_a = self.add_build(a, 0)
+        build_f = self.add_build(feature, 1)
+        build_b = self.add_build(b, 2)
+        build_a2 = self.add_build(a, 3)
+        build_d = self.add_build(d, 4)
+        update_lineage(self.project)
+        build_a2, build_b, build_f = self.reload(build_a2, build_b, build_f)
+
+        self.assertEquals(models.Revision.objects.get(label='d').generation, 3)
+        # a rebuild follows the earlier build of its revision
+        self.assertEquals(build_a2.get_previous_build(), build_a)
+        self.assertEquals(build_b.get_previous_build(), build_a2)
+        # c was never built; the merged branch isn't on d's lineage
+        self.assertEquals(self.get_ancestors(build_d), [(build_b.id, 1), (build_a2.id, 2), (build_a.id, 3)])
+        self.assertEquals(build_f.get_previous_build(), build_a2)
+
+        self.assertEquals(build_a.get_next_build(), build_a2)
+        self.assertEquals(build_b.get_next_build(), build_d)
+        self.assertEquals(build_d.get_next_build(), None)
+        self.assertEquals(build_d.get_previous_builds(2), [build_b, build_a2])
+
+    def test_out_of_order_builds(self):
+        a = self.add_revision('a')
+        b = self.add_revision('b', 'a')
+        c = self.add_revision('c', 'b')
+
+        build_c = self.add_build(c, 0)
+        update_lineage(self.project)
+        self.assertEquals(self.get_ancestors(build_c), [])
+
+        build_a = self.add_build(a, 1)
+        update_lineage(self.project)
+        self.assertEquals(self.get_ancestors(build_c), [(build_a.id, 1)])
+
+        build_b = self.add_build(b, 2)
+        self.assertEquals(update_lineage(self.project), 2)
+        self.assertEquals(self.get_ancestors(build_c), [(build_b.id, 1), (build_a.id, 2)])
+        self.assertEquals(update_lineage(self.project), 0)
+
+    def test_unrooted_builds_are_ordered_by_time(self):
+        a = self.add_revision('a')
+        b = self.add_revision('b')
+
+        first = self.add_build(b, 0)
+        second = self.add_build(a, 1)
+        third = self.add_build(b, 2)
+        update_lineage(self.project)
+
+        self.assertEquals(self.reload(first)[0].get_previous_build(), None)
+        self.assertEquals(self.get_ancestors(third), [(first.id, 1)])
+        self.assertEquals(self.get_ancestors(second), [(first.id, 1)])
+
+    def test_depth_is_limited(self):
+        revision = self.add_revision('a')
+        builds = [self.add_build(revision, i) for i in xrange(LINEAGE_DEPTH + 2)]
+        update_lineage(self.project)
+
+        ancestors = self.get_ancestors(builds[-1])
+        self.assertEquals(len(ancestors), LINEAGE_DEPTH)
+        self.assertEquals(ancestors[-1], (builds[1].id, LINEAGE_DEPTH))
+
+    def add_leaf(self, build, label):
+        test = models.Test.objects.create(build=build, label=label)
+        models.TestSeries.from_attrs({'data': {'sql': {'mean_calls': 2}}},
+            project=self.project, build=build, test=test, label=label,
+            position=build.position or 0).save()
+        return test
+
+    def test_tests_in_adjacent_builds(self):
+        revision = self.add_revision('a')
+        builds = [self.add_build(revision, i) for i in xrange(4)]
+        update_lineage(self.project)
+        builds = self.reload(*builds)
+        self.assertEquals([b.position for b in builds], [0, 1, 2, 3])
+
+        first = self.add_leaf(builds[0], 'tests.foo.FooTest')
+        last = self.add_leaf(builds[2], 'tests.foo.FooTest')
+        self.assertEquals(last.get_test_in_previous_build(), first)
+        self.assertEquals(first.get_test_in_next_build(), last)
+        self.assertEquals(first.get_test_in_previous_build(), None)
+        self.assertEquals(last.get_previous_builds(), [builds[0]])
+        self.assertEquals(last.series.calls, {'sql': 2})
+
+    def test_series_follow_their_build(self):
+        a = self.add_revision('a')
+        b = self.add_revision('b', 'a')
+
+        build_b = self.add_build(b, 0)
+        update_lineage(self.project)
+        test = self.add_leaf(self.reload(build_b)[0], 'tests.foo.FooTest')
+        self.assertEquals(test.series.position, 0)
+
+        self.add_build(a, 1)
+        update_lineage(self.project)
+        self.assertEquals(models.TestSeries.objects.get(test=test).position, 1)
+
+    def get_state(self):
+        return (
+            sorted(models.Build.objects.values_list('id', 'parent_build', 'position')),
+            sorted(models.BuildLineage.objects.values_list('build', 'ancestor', 'distance')),
+            sorted(models.TestSeries.objects.values_list('build', 'position')),
+        )
+
+    def test_placed_builds_follow_their_history(self):
+        a = self.add_revision('a')
+        c = self.add_revision('c', 'b')
+
+        build_c = self.add_build(c, 0)
+        build_a = self.add_build(a, 1)
+        self.assertEquals(place_build(self.project, build_c), [build_c.id])
+        self.assertEquals(place_build(self.project, build_a), [build_a.id])
+        # b isn't known yet, so c's history stops there
+        self.assertEquals(self.get_ancestors(build_c), [])
+
+        build_b = self.add_build(self.add_revision('b', 'a'), 2)
+        self.assertEquals(place_build(self.project, build_b), [build_b.id, build_c.id])
+        self.assertEquals(self.get_ancestors(build_c), [(build_b.id, 1), (build_a.id, 2)])
+
+    def test_unplaced_builds_are_ignored(self):
+        revision = self.add_revision('a')
+        first, second, third = [self.add_build(revision, i) for i in xrange(3)]
+
+        self.assertEquals(place_build(self.project, third), [third.id])
+        self.assertEquals(self.reload(third)[0].get_previous_build(), None)
+
+        self.assertEquals(place_build(self.project, first), [first.id, third.id])
+        self.assertEquals(self.get_ancestors(third), [(first.id, 1)])
+        self.assertEquals(self.reload(first)[0].position, 0)
+
+    def test_placement_matches_update(self):
+        rand = random.Random(0)
+        for run in xrange(5):
+            models.Build.objects.all().delete()
+            models.Revision.objects.all().delete()
+
+            # a history with branches, and revisions without any
+            first_parents = {}
+            for x in xrange(12):
+                first_parents['%d-%d' % (run, x)] = rand.choice(
+                    [None] + ['%d-%d' % (run, y) for y in xrange(max(0, x - 3), x)])
+            # each revision is built three times, at any time (and in any order)
+            builds = [(label, hours) for label in sorted(first_parents) for hours in rand.sample(xrange(20), 3)]
+            rand.shuffle(builds)
+
+            # builds wait to be placed for a while, and are placed in any order
+            unplaced = []
+            for x, (label, hours) in enumerate(builds):
+                revision = models.Revision.objects.filter(label=label)
+                if revision:
+                    revision = revision[0]
+                else:
+                    revision = self.add_revision(label, *filter(None, [first_parents[label]]))
+                build = self.add_build(revision, hours)
+                self.add_leaf(build, 'tests.foo.FooTest')
+                unplaced.append(build)
+                if x + 1 < len(builds) and rand.random() < 0.5:
+                    continue
+
+                rand.shuffle(unplaced)
+                for build in unplaced:
+                    place_build(self.project, build)
+                unplaced = []
+
+                state = self.get_state()
+                update_lineage(self.project)
+                self.assertEquals(self.get_state(), state)
@@ -0,0 +1,89 @@
+import base64
+import datetime
+import pickle
+import zlib
+from django.test import TestCase
+from django.utils import simplejson
+from zumanji import compression
+from zumanji.models import (Build, BuildLineage, EncodedJSON, GzippedJSONField, Project, ProjectSummary,
+    Revision)
+
+
+class GzippedJSONFieldTest(TestCase):
+    def setUp(self):
+        Project.objects.create(label='foo/bar', data={'foo': [1, 2]})
+
+    def test_decodes_on_access(self):
+        project = Project.objects.get(label='foo/bar')
+        self.assertTrue(isinstance(project.__dict__['data'], EncodedJSON))
+        self.assertEquals(project.data, {'foo': [1, 2]})
+        self.assertTrue(project.data is project.data)
+
+    def test_save_without_access(self):
+        project = Project.objects.get(label='foo/bar')
+        project.label = 'foo/baz'
+        project.save()
+
+        project = pickle.loads(pickle.dumps(Project.objects.get(label='foo/baz')))
+        self.assertEquals(project.data, {'foo': [1, 2]})
+
+    def test_empty_values(self):
+        self.assertEquals(Project(label='foo/baz', data=None).data, {})
+        self.assertEquals(Project(label='foo/baz', data='').data, {})
+
+    def test_defaults(self):
+        project = Project(label='foo/baz')
+        self.assertEquals(project.data, {})
+        self.assertFalse(project.data is Project(label='foo/baz').data)
+        self.assertEquals(ProjectSummary().trend, [])
+
+        # as filled in for existing rows by a migration
+        self.assertEquals(GzippedJSONField().to_python('{}'), {})
+
+    def test_codecs(self):
+        field = GzippedJSONField()
+        value = {'foo': [1, 2]}
+
+        legacy = base64.b64encode(zlib.compress(simplejson.dumps(value)))
+        self.assertEquals(field.get_prep_value(value), legacy)
+        self.assertEquals(field.to_python(legacy), value)
+
+        tagged = base64.b64encode(compression.compress(simplejson.dumps(value), 'zlib'))
+        self.assertEquals(field.to_python(tagged), value)
+
+
+class RevisionTest(TestCase):
+    def test_commit_columns(self):
+        project = Project.objects.create(label='disqus/zumanji')
+        revision = Revision(project=project, label='a' * 40)
+        revision.update_from_github({
+            'sha': 'a' * 40,
+            'parents': [],
+            'commit': {
+                'message': 'Fix a bug\n\nAt length',
+                'author': {'name': 'Foo', 'email': 'foo@example.com', 'date': '2012-05-16T03:43:59'},
+                'committer': {'name': 'Bar', 'email': 'bar@example.com', 'date': '2012-05-16T03:43:59'},
+            },
+        })
+        revision.save()
+
+        revision = Revision.objects.defer('data').get(id=revision.id)
+        self.assertEquals(revision.oneline, 'Fix a bug')
+        self.assertEquals(revision.author, {'name': 'Foo', 'email': 'foo@example.com'})
+        self.assertEquals(Revision.objects.filter(author_email='foo@example.com').count(), 1)
+        # the body is only kept in the data
+        self.assertEquals(revision.summary, '\nAt length')
+
+    def test_touch_builds(self):
+        project = Project.objects.create(label='disqus/zumanji')
+        revision = Revision.objects.create(project=project, label='a' * 40)
+        other = Revision.objects.create(project=project, label='b' * 40)
+        build, later, unrelated = [
+            Build.objects.create(project=project, revision=r, datetime=datetime.datetime(2012, 5, 16, n))
+            for n, r in enumerate((revision, other, other))
+        ]
+        BuildLineage.objects.create(build=later, ancestor=build, distance=1)
+
+        revision.touch_builds()
+        touched = Build.objects.exclude(date_modified=None).values_list('id', flat=True)
+        self.assertEquals(sorted(touched), [build.id, later.id])
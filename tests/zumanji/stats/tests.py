@@ -0,0 +1,116 @@
+import mock
+from django.test import TestCase
+from zumanji import stats
+from zumanji.stats import LeafTable, RunningStats, get_margin, percentile
+
+
+def make_attrs(duration, **interfaces):
+    return {
+        'mean_duration': duration,
+        'data': dict(
+            (i, {'mean_calls': calls, 'mean_duration': duration / 2})
+            for i, calls in interfaces.iteritems()
+        ),
+    }
+
+
+class PercentileTest(TestCase):
+    def test_interpolates(self):
+        self.assertEquals(percentile([1.0, 2.0, 3.0, 4.0], 50), 2.5)
+        self.assertEquals(percentile([1.0, 2.0, 3.0, 4.0], 100), 4.0)
+        self.assertEquals(percentile([5.0], 90), 5.0)
+        self.assertEquals(percentile([], 90), 0.0)
+
+
+class RunningStatsTest(TestCase):
+    def test_add(self):
+        stats = RunningStats()
+        for value in (2.0, 4.0, 4.0, 4.0, 5.0, 5.0, 7.0, 9.0):
+            stats.add(value)
+
+        self.assertEquals(stats.count, 8)
+        self.assertEquals(stats.mean, 5.0)
+        self.assertAlmostEquals(stats.variance, 32.0 / 7)
+        self.assertEquals((stats.lower, stats.upper), (2.0, 9.0))
+
+    def test_merge_matches_add(self):
+        first, second, combined = RunningStats(), RunningStats(), RunningStats()
+        for value in (2.0, 4.0, 4.0):
+            first.add(value)
+            combined.add(value)
+        for value in (4.0, 5.0, 5.0, 7.0, 9.0):
+            second.add(value)
+            combined.add(value)
+
+        first.merge(second)
+        self.assertEquals(first.count, combined.count)
+        self.assertAlmostEquals(first.mean, combined.mean)
+        self.assertAlmostEquals(first.variance, combined.variance)
+        self.assertEquals((first.lower, first.upper), (2.0, 9.0))
+
+    def test_attrs_round_trip(self):
+        stats = RunningStats()
+        for value in (1.0, 2.0, 6.0):
+            stats.add(value)
+
+        restored = RunningStats.from_attrs(stats.get_attrs())
+        self.assertEquals(restored.count, 3)
+        self.assertAlmostEquals(restored.m2, stats.m2)
+
+    def test_margin(self):
+        self.assertEquals(get_margin(1.0, 1), 0.0)
+        self.assertEquals(get_margin(1.0, 2), 12.706)
+        self.assertEquals(get_margin(1.0, 1000), 1.960)
+
+
+class LeafTableTest(TestCase):
+    leaves = [
+        ('a.b.test_1', make_attrs(1.0, sql=2)),
+        ('a.b.test_2', make_attrs(2.0, sql=1, redis=4)),
+        ('a.b-c.test_3', make_attrs(4.0)),
+        ('a.c.test_4', make_attrs(8.0, redis=1)),
+    ]
+
+    def check_rollups(self):
+        rollups = LeafTable(self.leaves).rollup_all(['a', 'a.b', 'b'])
+
+        result = rollups['a.b']
+        self.assertEquals(result['num_tests'], 2)
+        self.assertEquals(result['mean_duration'], 3.0)
+        self.assertEquals(result['lower_duration'], 1.0)
+        self.assertEquals(result['upper_duration'], 2.0)
+        self.assertEquals(result['upper50_duration'], 1.5)
+        self.assertEquals(result['stddev_duration'], 0.5)
+        self.assertEquals(result['data']['sql']['mean_calls'], 3)
+        self.assertEquals(result['data']['sql']['num_tests'], 2)
+        self.assertEquals(result['data']['redis']['mean_calls'], 4)
+        self.assertEquals(result['data']['redis']['upper_duration'], 1.0)
+
+        result = rollups['a']
+        self.assertEquals(result['num_tests'], 4)
+        self.assertEquals(result['mean_duration'], 15.0)
+        self.assertEquals(result['data']['redis']['mean_calls'], 5)
+        self.assertEquals(result['data']['redis']['num_tests'], 2)
+
+        self.assertEquals(rollups['b'], {})
+
+    def check_unused_interface(self):
+        # nothing at the depth of x.y made any sql calls
+        rollups = LeafTable([
+            ('x.y.test_1', make_attrs(1.0)),
+            ('z.test_2', make_attrs(2.0, sql=1)),
+        ]).rollup_all(['x.y', 'z'])
+
+        self.assertEquals(rollups['x.y']['data'], {})
+        self.assertEquals(rollups['z']['data']['sql']['mean_calls'], 1)
+
+    def test_numpy(self):
+        if stats.numpy is None:
+            return
+        self.check_rollups()
+        self.check_unused_interface()
+
+    def test_pure_python(self):
+        with mock.patch('zumanji.stats.numpy', None):
+            self.check_rollups()
+            self.check_unused_interface()
@@ -0,0 +1,56 @@
+from cStringIO import StringIO
+from django.test import TestCase
+from django.utils import simplejson
+from zumanji import stream
+from zumanji.stream import BuildPayload, checksum_payload
+
+
+class BuildPayloadTest(TestCase):
+    def setUp(self):
+        self.data = {
+            'version': 12345,
+            'revision': 'a' * 40,
+            'tests': [
+                {'id': 'foo.bar.%d' % n, 'duration': n * 1.5, 'doc': u'\u2603'}
+                for n in xrange(20)
+            ],
+            'time': '2012-05-16T03:43:59.23',
+        }
+        self.fp = StringIO(simplejson.dumps(self.data, indent=2))
+
+    def test_header(self):
+        payload = BuildPayload(self.fp)
+        self.assertEquals(payload['version'], 12345)
+        self.assertEquals(payload['revision'], 'a' * 40)
+        self.assertEquals(payload.get('time'), '2012-05-16T03:43:59.23')
+        self.assertEquals(payload.get('project'), None)
+
+    def test_tests_can_be_iterated_repeatedly(self):
+        payload = BuildPayload(self.fp)
+        self.assertEquals(list(payload['tests']), self.data['tests'])
+        self.assertEquals(list(payload['tests']), self.data['tests'])
+
+    def test_checksum_is_of_the_content(self):
+        checksum = BuildPayload(self.fp).checksum
+        self.assertEquals(checksum, checksum_payload(self.data))
+        self.assertEquals(BuildPayload(StringIO(simplejson.dumps(self.data))).checksum, checksum)
+
+        self.data['tests'].reverse()
+        self.assertNotEquals(checksum_payload(self.data), checksum)
+
+    def test_small_chunks(self):
+        chunk_size = stream.CHUNK_SIZE
+        stream.CHUNK_SIZE = 7
+        try:
+            payload = BuildPayload(self.fp)
+        finally:
+            stream.CHUNK_SIZE = chunk_size
+        self.assertEquals(payload['version'], 12345)
+        self.assertEquals(list(payload['tests']), self.data['tests'])
+
+    def test_empty(self):
+        payload = BuildPayload(StringIO('{}'))
+        self.assertFalse('tests' in payload)
+
+    def test_invalid(self):
+        self.assertRaises(ValueError, BuildPayload, StringIO('{"tests": [{"id": '))
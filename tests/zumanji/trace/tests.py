@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+from django.test import TestCase
+from zumanji.trace import HEADER, MAGIC, STACK_RESTART, Trace, encode_trace
+
+
+class TraceTest(TestCase):
+    def setUp(self):
+        self.calls = [
+            {
+                'sig': 'a' * 40,
+                'duration': 1.5,
+                'time': '2012-05-16T03:43:59.230000',
+                'depth': n % 3,
+                'lineno': 10 + n,
+                'args': [n, u'☃'],
+                'stacktrace': [['foo.py', 'bar', 10], ['foo.py', 'baz', n]],
+            }
+            for n in xrange(10)
+        ]
+
+    def test_round_trip(self):
+        trace = Trace(encode_trace(self.calls))
+        self.assertEquals(len(trace), 10)
+        self.assertEquals(list(trace), self.calls)
+        self.assertEquals(trace[-1], self.calls[-1])
+        self.assertEquals(trace[2:4], self.calls[2:4])
+        self.assertEquals(trace.get_sigs(), ['a' * 40] * 10)
+
+    def test_stacks_share_frames(self):
+        calls = [
+            {'stacktrace': [n, 'b', 'a']}
+            for n in xrange(STACK_RESTART * 2 + 1)
+        ]
+        calls.extend([{'stacktrace': ['a']}, {'stacktrace': ['c', 'a']}, {'stacktrace': []}])
+
+        trace = Trace(encode_trace(calls))
+        self.assertEquals(list(trace), calls)
+        self.assertEquals(len(trace.get_column('stack_frames')), len(calls) + 4)
+        # stacks are decoded from the nearest one stored in full
+        trace = Trace(encode_trace(calls))
+        self.assertEquals(trace[STACK_RESTART + 1], calls[STACK_RESTART + 1])
+        self.assertEquals(len(trace._stacks), 2)
+
+    def test_length_is_read_from_header(self):
+        trace = Trace(encode_trace(self.calls))
+        self.assertEquals(len(trace), 10)
+        self.assertEquals(trace._sections, None)
+
+    def test_unknown_values_are_kept(self):
+        calls = [
+            {'id': 5, 'command': 'SELECT 1', 'time': 'yesterday', 'depth': -1, 'duration': '1.0'},
+            {},
+        ]
+        trace = Trace(encode_trace(calls))
+        self.assertEquals(trace.get_sigs(), [None, None])
+        self.assertEquals(list(trace), [dict(c, stacktrace=[]) for c in calls])
+
+    def test_unknown_version(self):
+        data = encode_trace(self.calls)
+        data = HEADER.pack(MAGIC, 255, 10) + data[HEADER.size:]
+        self.assertRaises(ValueError, Trace, data)
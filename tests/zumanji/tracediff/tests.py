@@ -0,0 +1,66 @@
+import random
+from django.test import TestCase
+from zumanji.tracediff import get_opcodes, get_rows, pack_opcodes, unpack_opcodes
+
+
+def get_matches(a, b, opcodes):
+    """
+    Checks that the opcodes turn ``a`` into ``b``, and returns the number
+    of calls they match.
+    """
+    i = j = matches = 0
+    for tag, i1, i2, j1, j2 in opcodes:
+        assert (i1, j1) == (i, j)
+        if tag == 'equal':
+            assert a[i1:i2] == b[j1:j2]
+            matches += i2 - i1
+        i, j = i2, j2
+    assert (i, j) == (len(a), len(b))
+    return matches
+
+
+def get_lcs_length(a, b):
+    previous = [0] * (len(b) + 1)
+    for x in a:
+        current = [0]
+        for j, y in enumerate(b):
+            current.append(previous[j] + 1 if x == y else max(previous[j + 1], current[j]))
+        previous = current
+    return previous[-1]
+
+
+class GetOpcodesTest(TestCase):
+    def test_insertion(self):
+        opcodes, exact = get_opcodes(['a', 'b', 'c'], ['x', 'a', 'b', 'c'])
+        self.assertTrue(exact)
+        self.assertEquals(opcodes, [('insert', 0, 0, 0, 1), ('equal', 0, 3, 1, 4)])
+
+    def test_repetitive_traces(self):
+        a = ['select', 'update'] * 50
+        b = ['select', 'update'] * 20 + ['select', 'cache'] + ['select', 'update'] * 30
+        opcodes, exact = get_opcodes(a, b)
+        self.assertTrue(exact)
+        self.assertEquals([o for o in opcodes if o[0] != 'equal'], [('insert', 41, 41, 41, 43)])
+
+    def test_diffs_are_shortest(self):
+        rand = random.Random(0)
+        for _ in xrange(200):
+            a = [rand.randint(0, 4) for _ in xrange(rand.randint(0, 20))]
+            b = [rand.randint(0, 4) for _ in xrange(rand.randint(0, 20))]
+            opcodes, exact = get_opcodes(a, b)
+            self.assertTrue(exact)
+            self.assertEquals(get_matches(a, b, opcodes), get_lcs_length(a, b))
+
+    def test_budget_falls_back_to_counts(self):
+        a = ['a', 'b', 'c', 'd', 'e', 'f']
+        b = ['a', 'f', 'c', 'x', 'e', 'b', 'f']
+        opcodes, exact = get_opcodes(a, b, budget=0)
+        self.assertFalse(exact)
+        self.assertTrue(get_matches(a, b, opcodes) > 0)
+
+    def test_rows_are_aligned(self):
+        opcodes = [('equal', 0, 1, 0, 1), ('replace', 1, 2, 1, 3), ('delete', 2, 3, 3, 3)]
+        self.assertEquals(unpack_opcodes(pack_opcodes(opcodes)), opcodes)
+        self.assertEquals(get_rows(opcodes), [
+            ('equal', 0, 0), ('replace', 1, 1), ('replace', None, 2), ('delete', 2, None),
+        ])
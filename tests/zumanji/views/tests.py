@@ -1,13 +1,23 @@
+from __future__ import absolute_import
+
 import mock
+import shutil
+import tempfile
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
 from django.core.urlresolvers import reverse
 from django.test import TestCase, Client
 from django.test.utils import override_settings
-from zumanji.models import Project
+from django.utils import simplejson
+from zumanji.importer import import_build, prewarm_pages
+from zumanji.models import Project, ProjectSummary, ImportJob
+from tests.zumanji.importer.tests import (COMMIT_DATA, ZUMANJI_CONFIG, make_build_data, make_call,
+    make_leaf)
 
 
 class UploadCSRFTest(TestCase):
     def setUp(self):
-        self.project = Project.objects.create(label='test')
+        self.project = Project.objects.create(label='disqus/test')
         self.path = reverse('zumanji:upload_project_build', kwargs={
             'project_label': self.project.label,
         })
@@ -38,3 +48,187 @@ class UploadCSRFTest(TestCase):
         })
         self.assertEquals(resp.status_code, 302)
         self.assertTrue(import_build.called)
+
+    @override_settings(ZUMANJI_CONFIG={'API_KEY': 'foo'})
+    @mock.patch('zumanji.views.prewarm_pages')
+    @mock.patch('zumanji.views.import_build')
+    def test_imported_build_is_prewarmed(self, import_build, prewarm_pages):
+        import_build.return_value.id = 1
+        self.client.post(self.path, {
+            'json_file': self.get_mock_file(),
+            'api_key': 'foo',
+        })
+        prewarm_pages.assert_called_once_with(import_build.return_value)
+
+
+class AsyncUploadTest(TestCase):
+    def setUp(self):
+        self.project = Project.objects.create(label='disqus/test')
+        self.path = reverse('zumanji:upload_project_build', kwargs={
+            'project_label': self.project.label,
+        })
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+
+    @mock.patch('zumanji.views.import_build')
+    def test_upload_is_queued(self, import_build):
+        with override_settings(ZUMANJI_CONFIG={'API_KEY': 'foo'}, MEDIA_ROOT=self.media_root):
+            resp = self.client.post(self.path, {
+                'json_file': SimpleUploadedFile('foo.json', '{}'),
+                'api_key': 'foo',
+                'async': '1',
+            })
+        self.assertEquals(resp.status_code, 202)
+        self.assertFalse(import_build.called)
+
+        result = simplejson.loads(resp.content)
+        job = ImportJob.objects.get(id=result['job_id'])
+        self.assertEquals(job.status, 'queued')
+        self.assertEquals(job.project, self.project)
+
+        resp = self.client.get(result['status_url'])
+        self.assertEquals(resp.status_code, 200)
+        self.assertEquals(simplejson.loads(resp.content)['status'], 'queued')
+
+
+@override_settings(ZUMANJI_CONFIG=ZUMANJI_CONFIG)
+class BuildViewTest(TestCase):
+    def setUp(self):
+        patcher = mock.patch('zumanji.models.github')
+        self.github = patcher.start()
+        self.github.get_commit.return_value = COMMIT_DATA
+        self.addCleanup(patcher.stop)
+
+        self.build = import_build(make_build_data([
+            make_leaf('tests.foo.FooTest.test_a', 1.0, [make_call('SELECT 1', 1.0, filename='hot.py')]),
+            make_leaf('tests.foo.FooTest.test_b', 2.0),
+        ]))
+
+    def test_build_shows_top_callsites(self):
+        resp = self.client.get(reverse('zumanji:view_build', kwargs={
+            'project_label': self.build.project.label,
+            'build_id': self.build.id,
+        }))
+        self.assertEquals(resp.status_code, 200)
+        self.assertEquals([c.filename for c in resp.context['top_callsites']], ['hot.py'])
+        self.assertContains(resp, 'hot.py')
+
+    def test_test_shows_top_callsites(self):
+        resp = self.client.get(reverse('zumanji:view_test', kwargs={
+            'project_label': self.build.project.label,
+            'build_id': self.build.id,
+            'test_label': 'tests.foo.FooTest',
+        }))
+        self.assertEquals(resp.status_code, 200)
+        self.assertEquals([c.filename for c in resp.context['top_callsites']], ['hot.py'])
+
+
+@override_settings(ZUMANJI_CONFIG=ZUMANJI_CONFIG)
+class PageCacheTest(TestCase):
+    def setUp(self):
+        patcher = mock.patch('zumanji.models.github')
+        self.github = patcher.start()
+        self.github.get_commit.return_value = COMMIT_DATA
+        self.addCleanup(patcher.stop)
+        cache.clear()
+
+        self.build = import_build(make_build_data([make_leaf('tests.foo.FooTest.test_a', 1.0)]))
+        self.path = reverse('zumanji:view_build', kwargs={
+            'project_label': self.build.project.label,
+            'build_id': self.build.id,
+        })
+
+    def test_repeat_views_are_not_modified(self):
+        resp = self.client.get(self.path)
+        self.assertEquals(resp.status_code, 200)
+        etag = resp['ETag']
+
+        with self.assertNumQueries(1):
+            cached = self.client.get(self.path)
+        self.assertEquals(cached.status_code, 200)
+        self.assertEquals(cached.content, resp.content)
+
+        with self.assertNumQueries(1):
+            resp = self.client.get(self.path, HTTP_IF_NONE_MATCH=etag)
+        self.assertEquals(resp.status_code, 304)
+
+        # Last-Modified is only to the second, so isn't enough on its own
+        resp = self.client.get(self.path, HTTP_IF_MODIFIED_SINCE=cached['Last-Modified'])
+        self.assertEquals(resp.status_code, 200)
+
+        resp = self.client.get(self.path, {'compare_with': self.build.id}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEquals(resp.status_code, 200)
+        self.assertNotEquals(resp['ETag'], etag)
+
+    def test_reimporting_a_neighbour_invalidates(self):
+        etag = self.client.get(self.path)['ETag']
+
+        import_build(make_build_data([make_leaf('tests.foo.FooTest.test_a', 2.0)],
+            time='2012-05-17T03:43:59.23'))
+
+        resp = self.client.get(self.path, HTTP_IF_NONE_MATCH=etag)
+        self.assertEquals(resp.status_code, 200)
+        self.assertNotEquals(resp['ETag'], etag)
+        self.assertContains(resp, 'Next Build <small>#%d' % (self.build.id + 1))
+
+    def test_prewarm_renders_top_level_pages(self):
+        with self.settings(ZUMANJI_CONFIG=dict(ZUMANJI_CONFIG, PREWARM_PAGES=True)):
+            prewarm_pages(self.build)
+
+        with self.assertNumQueries(1):
+            resp = self.client.get(self.path)
+        self.assertEquals(resp.status_code, 200)
+
+        with self.assertNumQueries(1):
+            resp = self.client.get(reverse('zumanji:view_test', kwargs={
+                'project_label': self.build.project.label,
+                'build_id': self.build.id,
+                'test_label': 'tests.foo.FooTest',
+            }))
+        self.assertEquals(resp.status_code, 200)
+
+
+class IndexViewTest(TestCase):
+    def setUp(self):
+        patcher = mock.patch('zumanji.models.github')
+        self.github = patcher.start()
+        self.github.get_commit.return_value = COMMIT_DATA
+        self.addCleanup(patcher.stop)
+
+    def test_index_uses_summaries(self):
+        import_build(make_build_data([make_leaf('tests.foo.FooTest.test_a', 1.0)]))
+        build = import_build(make_build_data([
+            make_leaf('tests.foo.FooTest.test_a', 1.0),
+            make_leaf('tests.foo.FooTest.test_b', 2.0),
+        ], time='2012-05-17T03:43:59.23'))
+        Project.objects.create(label='disqus/empty')
+
+        summary = ProjectSummary.objects.get(project=build.project)
+        self.assertEquals(summary.latest_build_id, build.id)
+        self.assertEquals(summary.num_builds, 2)
+        self.assertEquals(summary.oneline, 'Initial commit')
+        self.assertEquals(len(summary.trend), 2)
+
+        with self.assertNumQueries(1):
+            resp = self.client.get(reverse('zumanji:index'))
+        self.assertEquals(resp.status_code, 200)
+        self.assertContains(resp, '#%s &mdash; %s' % (build.id, build.revision.label))
+        self.assertContains(resp, 'No builds have been executed.')
+
+    def test_builds_are_paged(self):
+        for day in xrange(3):
+            build = import_build(make_build_data([make_leaf('tests.foo.FooTest.test_a', 1.0)],
+                time='2012-05-1%dT03:43:59.23' % (6 + day)))
+
+        resp = self.client.get(reverse('zumanji:view_project', kwargs={'project_label': build.project.label}))
+        self.assertEquals(resp.status_code, 200)
+        self.assertEquals(len(resp.context['build_list']), 3)
+        self.assertEquals(resp.context['next_cursor'], None)
+
+        url = reverse('zumanji:view_builds_json', kwargs={'project_label': build.project.label})
+        data = simplejson.loads(self.client.get(url, {'after': resp.context['build_list'][0].cursor}).content)
+        self.assertEquals([b['id'] for b in data['builds']], [build.id - 1, build.id - 2])
+        self.assertTrue('#%d' % (build.id - 1) in data['html'])
+        self.assertEquals(data['next_cursor'], None)
+
+        self.assertEquals(self.client.get(url, {'after': 'foo'}).status_code, 400)